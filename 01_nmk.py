@@ -1,39 +1,499 @@
-import requests
+import argparse
+import asyncio
 import json
+import os
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from math import ceil
 from os.path import join
 
+import requests
+
+import instrument
+from http_cache import CachedSession, add_cache_arguments, cache_options
+from throttle import (
+    IDEMPOTENT_METHODS,
+    MAX_ATTEMPTS,
+    Throttle,
+    ThrottledSession,
+    add_throttle_arguments,
+    throttle_options,
+)
+
+BASE_URL = "https://api.dimu.org/api/solr/select?"
+ROWS = 10
+# Incremental queries only return a handful of documents, so use big pages
+DELTA_ROWS = 500
+OWNER = "NMK*"
+PRODUCER = "Hans Gude"
+
+output_dir = "./data/raw_json/"
+# High-water mark and the last delta; must not live in output_dir as the
+# combiner reads every json file there
+state_file = "./data/harvest_state.json"
+shards_dir = "./data/shards/"
+
+# A part of the collection harvested on its own: the Solr filters that select
+# it, the directory its pages go in and its own harvest state
+Shard = namedtuple("Shard", ["name", "filters", "output_dir", "state_file"])
+DEFAULT_SHARD = Shard("default", (f"identifier.owner:{OWNER}", f"artifact.producer:{PRODUCER}"), output_dir, state_file)
+
+
+def make_session(
+    max_in_flight: int,
+    max_rps: float | None = None,
+    min_concurrency: int = 1,
+    max_attempts: int = MAX_ATTEMPTS,
+    **cache_kwargs,
+) -> CachedSession:
+    # A single keep-alive pool shared by every in-flight page, so we only pay
+    # for the TCP/TLS handshake once per connection instead of once per page
+    throttle = Throttle(max_in_flight, min_concurrency, max_rps, max_attempts, name="api.dimu.org")
+    # Solr queries are POSTed, but only read, so they are as safe to retry as a GET
+    return CachedSession(ThrottledSession(throttle, retry_methods=IDEMPOTENT_METHODS | {"POST"}), **cache_kwargs)
 
-def make_request(start: int):
-    base_url = "https://api.dimu.org/api/solr/select?"
 
+def make_request(
+    session: CachedSession,
+    start: int,
+    extra_filters: tuple[str, ...] = (),
+    fields: str | None = None,
+    rows: int = ROWS,
+    filters: tuple[str, ...] = DEFAULT_SHARD.filters,
+):
     payload = {
         "q": "*",
         "wt": "json",
         "api.key": "demo",
         "start": start,
-        "fq": [
-            "identifier.owner:NMK*",
-            "artifact.producer:Hans Gude",
-        ],
-        "rows": 10,
+        "fq": [*filters, *extra_filters],
+        "rows": rows,
     }
-    response = requests.post(url=base_url, params=payload)
+    if fields is not None:
+        payload["fl"] = fields
+    response = session.post(url=BASE_URL, params=payload)
+    response.raise_for_status()
 
     return response
 
 
-output_dir = "./data/raw_json/"
-TOTAL_N = 1018
+def page_file(page: int, output_dir: str = output_dir) -> str:
+    return join(output_dir, f"{page:03}.json")
+
+
+def checkpoint_file(output_dir: str = output_dir) -> str:
+    # One page number per line, appended once the page file is safely on disk
+    return join(output_dir, "checkpoint.log")
 
 
-for i, start in enumerate(range(0, TOTAL_N, 10)):
-    output_file = join(output_dir, f"{i:03}.json")
-    print(i, output_file)
+def read_checkpoint(output_dir: str = output_dir) -> set[int]:
+    """Return the pages a previous, interrupted run already wrote."""
+    if not os.path.exists(checkpoint_file(output_dir)):
+        return set()
 
-    response = make_request(start)
-    print(response)
-    response_json = response.json()
+    with open(checkpoint_file(output_dir)) as f:
+        done = {int(line) for line in f if line.strip()}
 
-    with open(output_file, "w") as f:
+    # Only trust the journal if the page actually made it to disk
+    return {page for page in done if os.path.exists(page_file(page, output_dir))}
+
+
+def write_page(page: int, response_json, checkpoint, output_dir: str = output_dir) -> None:
+    output_file = page_file(page, output_dir)
+    tmp_file = f"{output_file}.tmp"
+
+    with open(tmp_file, "w") as f:
         print(f"Writing  {output_file}")
         json.dump(response_json, f, indent=2)
+
+    # Rename is atomic, so a crash never leaves a half written page behind
+    os.replace(tmp_file, output_file)
+    checkpoint.write(f"{page}\n")
+    checkpoint.flush()
+
+
+async def fetch_page(session, semaphore, page: int, checkpoint, shard: Shard = DEFAULT_SHARD) -> None:
+    async with semaphore:
+        response = await asyncio.to_thread(make_request, session, page * ROWS, filters=shard.filters)
+
+    print(page, response)
+    write_page(page, response.json(), checkpoint, shard.output_dir)
+
+
+async def harvest(max_in_flight: int, shard: Shard = DEFAULT_SHARD, **session_kwargs) -> int:
+    """Fetch every page not already on disk, returning the number of docs."""
+    os.makedirs(shard.output_dir, exist_ok=True)
+    session = make_session(max_in_flight, **session_kwargs)
+    done = read_checkpoint(shard.output_dir)
+    if done:
+        print(f"Resuming, {len(done)} pages already on disk")
+
+    with open(checkpoint_file(shard.output_dir), "a") as checkpoint:
+        # The first page tells us how many documents there are in total
+        if 0 in done:
+            with open(page_file(0, shard.output_dir)) as f:
+                first_page = json.load(f)
+        else:
+            response = await asyncio.to_thread(make_request, session, 0, filters=shard.filters)
+            print(0, response)
+            first_page = response.json()
+            write_page(0, first_page, checkpoint, shard.output_dir)
+
+        total_n = first_page["response"]["numFound"]
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        await asyncio.gather(
+            *(
+                fetch_page(session, semaphore, page, checkpoint, shard)
+                for page in range(1, ceil(total_n / ROWS))
+                if page not in done
+            )
+        )
+
+    # Everything is on disk, so the next run should start from scratch
+    os.remove(checkpoint_file(shard.output_dir))
+    session.close()
+
+    _, docs = load_corpus(shard.output_dir)
+    write_state(high_water_mark(docs), updated=[], deleted=[], state_file=shard.state_file)
+
+    return len(docs)
+
+
+def load_corpus(output_dir: str = output_dir):
+    """Read every page in output_dir, returning the first page and all docs."""
+    first_page = None
+    docs = []
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.endswith(".json"):
+            with open(join(output_dir, filename)) as f:
+                data = json.load(f)
+            if first_page is None:
+                first_page = data
+            docs += data["response"]["docs"]
+
+    return first_page, docs
+
+
+def high_water_mark(docs) -> str | None:
+    # Solr dates are ISO 8601 in UTC, so they sort correctly as strings
+    dates = [
+        doc[key]
+        for doc in docs
+        for key in ("artifact.updatedDate", "artifact.publishedDate")
+        if doc.get(key)
+    ]
+    return max(dates, default=None)
+
+
+def read_state(state_file: str = state_file) -> dict:
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def write_state(mark: str | None, updated: list[str], deleted: list[str], state_file: str = state_file) -> None:
+    state = {
+        "high_water_mark": mark,
+        # Downstream stages can use these to only redo what changed
+        "last_delta": {"updated": updated, "deleted": deleted},
+    }
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def fetch_all(session, extra_filters: tuple[str, ...], fields: str | None = None, filters=DEFAULT_SHARD.filters):
+    """Yield every document matching the filters, DELTA_ROWS at a time."""
+    start = 0
+    while True:
+        response = make_request(session, start, extra_filters, fields, rows=DELTA_ROWS, filters=filters)
+        print(start, response)
+        response_json = response.json()["response"]
+        yield from response_json["docs"]
+
+        start += DELTA_ROWS
+        if start >= response_json["numFound"]:
+            break
+
+
+def write_pages(first_page, docs, output_dir: str = output_dir) -> None:
+    """Re-split the corpus into pages of ROWS docs, replacing the old pages."""
+    n_pages = ceil(len(docs) / ROWS)
+    for page in range(n_pages):
+        start = page * ROWS
+        page_json = {
+            "responseHeader": first_page["responseHeader"],
+            "response": {
+                "numFound": len(docs),
+                "start": start,
+                "docs": docs[start:start + ROWS],
+            },
+        }
+        with open(page_file(page, output_dir), "w") as f:
+            json.dump(page_json, f, indent=2)
+
+    # Deletions can leave us with fewer pages than before
+    for filename in sorted(os.listdir(output_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext == ".json" and stem.isdigit() and int(stem) >= n_pages:
+            os.remove(join(output_dir, filename))
+
+
+def harvest_incremental(shard: Shard = DEFAULT_SHARD, **session_kwargs) -> int:
+    """Merge in the docs changed since the last run, returning how many changed."""
+    first_page, docs = load_corpus(shard.output_dir)
+    if first_page is None:
+        raise ValueError(f"No existing corpus in {shard.output_dir}, run a full harvest first")
+
+    mark = read_state(shard.state_file).get("high_water_mark") or high_water_mark(docs)
+    if mark is None:
+        # Empty or without a single dated doc, so there is nothing to count
+        # changes from; fetch the whole shard again instead
+        print("No high-water mark, fetching every document")
+        changed_filters = ()
+    else:
+        print(f"Fetching documents changed since {mark}")
+        changed_filters = (f"artifact.updatedDate:{{{mark} TO *] OR artifact.publishedDate:{{{mark} TO *]",)
+
+    # The whole point is to see what changed, so always revalidate
+    session = make_session(1, **{**session_kwargs, "ttl": 0})
+    changed = {doc["artifact.uuid"]: doc for doc in fetch_all(session, changed_filters, filters=shard.filters)}
+
+    # Updates never tell us what was removed, so compare the full uuid list,
+    # which is cheap as it is a single field per document
+    live_uuids = {doc["artifact.uuid"] for doc in fetch_all(session, (), fields="artifact.uuid", filters=shard.filters)}
+    session.close()
+
+    # Keep the existing order, replacing updated docs in place
+    merged = {}
+    deleted = []
+    for doc in docs:
+        uuid = doc["artifact.uuid"]
+        if uuid not in live_uuids:
+            deleted.append(uuid)
+            continue
+        merged[uuid] = changed.get(uuid, doc)
+    merged.update(changed)
+
+    print(f"{len(changed)} updated or new, {len(deleted)} deleted")
+    if changed or deleted:
+        write_pages(first_page, list(merged.values()), shard.output_dir)
+
+    # An empty shard has no mark until its first doc turns up
+    new_mark = max(filter(None, (mark, high_water_mark(changed.values()))), default=None)
+    write_state(new_mark, updated=sorted(changed), deleted=sorted(deleted), state_file=shard.state_file)
+
+    return len(changed) + len(deleted)
+
+
+# Characters the Solr query parser treats as syntax; escaped even inside a
+# quoted phrase, where only \ and " strictly have to be
+SOLR_SPECIAL = re.compile(r'([+\-!():^\[\]"{}~*?|&;/\\])')
+
+
+def solr_phrase(text: str) -> str:
+    """Quote text for a Solr filter, so it matches as written."""
+    return '"' + SOLR_SPECIAL.sub(r"\\\1", text) + '"'
+
+
+def slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def published_ranges(from_year: int, to_year: int) -> list[tuple[str, str]]:
+    """Return (name, filter) for publishedDate ranges covering every doc exactly once.
+
+    A range per year in between, one for everything before and after, and
+    one for docs without a publishedDate at all.
+    """
+    bounds = [f"{year}-01-01T00:00:00Z" for year in range(from_year, to_year + 2)]
+    ranges = [(f"before-{from_year}", f"artifact.publishedDate:[* TO {bounds[0]}}}")]
+    # Solr's [a TO b} includes a but not b, so neighbouring years never overlap
+    for year, start, end in zip(range(from_year, to_year + 1), bounds, bounds[1:]):
+        ranges.append((str(year), f"artifact.publishedDate:[{start} TO {end}}}"))
+    ranges.append((f"after-{to_year}", f"artifact.publishedDate:[{bounds[-1]} TO *]"))
+    ranges.append(("undated", "-artifact.publishedDate:[* TO *]"))
+
+    return ranges
+
+
+def patterns_overlap(a: str, b: str) -> bool:
+    """Whether some value matches both Solr wildcard patterns (* and ?)."""
+    seen = set()
+
+    def overlap(i: int, j: int) -> bool:
+        if (i, j) in seen:
+            return False
+        seen.add((i, j))
+        if i < len(a) and a[i] == "*" and (overlap(i + 1, j) or (j < len(b) and overlap(i, j + 1))):
+            return True
+        if j < len(b) and b[j] == "*" and (overlap(i, j + 1) or (i < len(a) and overlap(i + 1, j))):
+            return True
+        if i == len(a) or j == len(b):
+            return i == len(a) and j == len(b)
+        if a[i] == "*" or b[j] == "*":
+            return False
+        return (a[i] == "?" or b[j] == "?" or a[i] == b[j]) and overlap(i + 1, j + 1)
+
+    return overlap(0, 0)
+
+
+def plan_shards(owners, producers, years: tuple[int, int] | None = None) -> list[Shard]:
+    """One shard for every owner, producer and publishedDate range combination.
+
+    No producers means every producer. Only a doc credited to more than one
+    of the producers is in more than one shard; owner patterns that could
+    match the same owner are refused with a ValueError.
+    """
+    for i, owner in enumerate(owners):
+        for other in owners[i + 1 :]:
+            if patterns_overlap(owner, other):
+                raise ValueError(f"Owner patterns {owner} and {other} overlap, so their shards would too")
+
+    owner_parts = [(slug(owner), f"identifier.owner:{owner}") for owner in owners]
+    # Producer names hold spaces, commas and the odd bracket, so they are
+    # quoted; owners are patterns like NMK* and are left as they are
+    producer_parts = [
+        (slug(producer), f"artifact.producer:{solr_phrase(producer)}") for producer in producers
+    ] or [("all", None)]
+    date_parts = published_ranges(*years) if years else [(None, None)]
+
+    shards = []
+    for parts in product(owner_parts, producer_parts, date_parts):
+        name = "_".join(part_name for part_name, _ in parts if part_name)
+        filters = tuple(part_filter for _, part_filter in parts if part_filter)
+        shard_dir = join(shards_dir, name)
+        shards.append(Shard(name, filters, join(shard_dir, "raw_json/"), join(shard_dir, "harvest_state.json")))
+
+    return shards
+
+
+def shards_file() -> str:
+    return join(shards_dir, "shards.json")
+
+
+def read_shards() -> dict:
+    if not os.path.exists(shards_file()):
+        return {}
+    with open(shards_file()) as f:
+        return json.load(f)
+
+
+def run_shard(shard: Shard, max_in_flight: int, incremental: bool, session_kwargs: dict) -> int:
+    if incremental:
+        return harvest_incremental(shard, **session_kwargs)
+    return asyncio.run(harvest(max_in_flight, shard, **session_kwargs))
+
+
+def harvest_shards(shards, workers: int, max_in_flight: int, incremental: bool, **session_kwargs):
+    """Harvest the shards in worker processes, returning the docs done and (shard, error) pairs.
+
+    Every shard that worked is listed in data/shards/shards.json, for the
+    later stages to work through one by one.
+    """
+    os.makedirs(shards_dir, exist_ok=True)
+    listed = read_shards()
+    # Every process has its own throttle, so they share the ceiling between them
+    if session_kwargs.get("max_rps"):
+        session_kwargs = {**session_kwargs, "max_rps": session_kwargs["max_rps"] / min(workers, len(shards))}
+    n_docs = 0
+    errors = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_shard, shard, max_in_flight, incremental, session_kwargs): shard
+            for shard in shards
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                n = future.result()
+            except (requests.RequestException, OSError, ValueError) as e:
+                errors.append((shard.name, f"{type(e).__name__}: {e}"))
+                print(f"Shard {shard.name} FAILED", file=sys.stderr)
+                continue
+
+            n_docs += n
+            print(f"Shard {shard.name}: {n} docs {'changed' if incremental else 'harvested'}", file=sys.stderr)
+            listed[shard.name] = {"filters": list(shard.filters), "raw_json": shard.output_dir}
+
+    with open(shards_file(), "w") as f:
+        json.dump(listed, f, indent=2, sort_keys=True)
+
+    return n_docs, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download the Solr search results page by page.",
+        epilog=(
+            "Given --owners, --producers, --all-producers or --years, the collection is split into shards "
+            "harvested side by side into data/shards/<shard>/raw_json/. Run the later stages on each with "
+            "e.g. python pipeline.py --shard <shard>."
+        ),
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=8,
+        help="Number of pages to request concurrently.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch documents changed since the last harvest and merge them in.",
+    )
+    shards = parser.add_argument_group("shards")
+    shards.add_argument("--owners", nargs="+", help='Owner patterns to shard by, e.g. "NMK*" or "NMK-B".')
+    producers = shards.add_mutually_exclusive_group()
+    producers.add_argument("--producers", nargs="+", help='Producers to shard by, e.g. "Hans Gude".')
+    producers.add_argument("--producers-file", help="File with one producer per line, to shard by.")
+    producers.add_argument("--all-producers", action="store_true", help="Harvest every producer of the owners.")
+    shards.add_argument(
+        "--years",
+        nargs=2,
+        type=int,
+        metavar=("FROM", "TO"),
+        help="Also split every shard by the year the doc was published.",
+    )
+    shards.add_argument("--shard-workers", type=int, default=4, help="Shards harvested at the same time.")
+    add_cache_arguments(parser)
+    add_throttle_arguments(parser)
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    session_options = {**cache_options(args), **throttle_options(args)}
+    errors = []
+    with instrument.stage("01_nmk", args.profile) as timer:
+        if args.owners or args.producers or args.producers_file or args.all_producers or args.years:
+            producer_list = args.producers or [PRODUCER]
+            if args.producers_file:
+                with open(args.producers_file) as f:
+                    producer_list = [line.strip() for line in f if line.strip()]
+            elif args.all_producers:
+                producer_list = []
+
+            try:
+                shard_list = plan_shards(args.owners or [OWNER], producer_list, args.years)
+            except ValueError as e:
+                parser.error(str(e))
+            print(f"Harvesting {len(shard_list)} shards", file=sys.stderr)
+            timer.records, errors = harvest_shards(
+                shard_list, args.shard_workers, args.max_in_flight, args.incremental, **session_options
+            )
+        elif args.incremental:
+            timer.records = harvest_incremental(**session_options)
+        else:
+            timer.records = asyncio.run(harvest(args.max_in_flight, **session_options))
+
+    if args.report:
+        instrument.write_report(args.report)
+
+    for name, error in errors:
+        print(f"FAILED: {name}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} shards failed")
@@ -1,16 +1,31 @@
+import argparse
 import os
 import json
 
+import instrument
+from jsonl import is_jsonl, write_jsonl
+
 data_dir = "./data/raw_json"
 output_dir = "./data/combined_data"
 
-base_json = None
 
-for filename in sorted(os.listdir(data_dir)):
-    if filename.endswith(".json"):
-        with open(os.path.join(data_dir, filename)) as f:
-            data = json.load(f)
+def iter_pages(data_dir: str):
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(data_dir, filename)) as f:
+                yield json.load(f)
+
+
+def iter_docs(data_dir: str):
+    """Yield every doc one page at a time, without holding the whole corpus."""
+    for page in iter_pages(data_dir):
+        yield from page["response"]["docs"]
+
 
+def combine(data_dir: str):
+    base_json = None
+
+    for data in iter_pages(data_dir):
         # First file
         if base_json is None:
             base_json = data
@@ -20,7 +35,28 @@ for filename in sorted(os.listdir(data_dir)):
         new_docs = data["response"]["docs"]
         base_json["response"]["docs"] += new_docs
 
-output_path = os.path.join(output_dir, "combined.json")
+    return base_json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine the downloaded pages into a single file.")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(output_dir, "combined.json"),
+        help="Output file; use .jsonl or - (stdout) to stream one doc per line.",
+    )
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.stage("02_combiner", args.profile) as timer:
+        if is_jsonl(args.output):
+            timer.records = write_jsonl(args.output, iter_docs(args.data_dir))
+        else:
+            base_json = combine(args.data_dir)
+            timer.records = len(base_json["response"]["docs"])
+            with open(args.output, "w") as out:
+                json.dump(base_json, out, indent=2, sort_keys=True)
 
-with open(output_path, "w") as out:
-    json.dump(base_json, out, indent=2, sort_keys=True)
+    if args.report:
+        instrument.write_report(args.report)
@@ -1,5 +1,9 @@
+import argparse
 import json
 
+import instrument
+from jsonl import is_jsonl, read_docs, write_jsonl
+
 input_file = "./data/combined_data/combined.json"
 output_file = "./data/enriched_data/enriched.json"
 
@@ -17,10 +21,7 @@ def nasjolmuseet_link(identifier_id: str) -> str:
     return f"https://www.nasjonalmuseet.no/en/collection/object/{modifier_id}"
 
 
-with open(input_file) as f:
-    data = json.load(f)
-
-for doc in data["response"]["docs"]:
+def enrich_doc(doc):
     unique_id = doc.get("artifact.uniqueId")
     uuid = doc.get("artifact.uuid")
     identifier_id = doc.get("identifier.id")
@@ -29,5 +30,31 @@ for doc in data["response"]["docs"]:
     doc["uuid_link"] = uuid_link(uuid)
     doc["nasjonalmuseet_link"] = nasjolmuseet_link(identifier_id)
 
-with open(output_file, "w") as out:
-    json.dump(data, out, indent=2, sort_keys=True)
+    return doc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add museum links to every doc.")
+    parser.add_argument("--input", default=input_file, help="Combined .json, .jsonl or - (stdin).")
+    parser.add_argument("--output", default=output_file, help="Enriched .json, .jsonl or - (stdout).")
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    if is_jsonl(args.input) and not is_jsonl(args.output):
+        parser.error("JSONL input can only be written back out as JSONL")
+
+    with instrument.stage("03_enrich", args.profile) as timer:
+        if is_jsonl(args.output):
+            timer.records = write_jsonl(args.output, (enrich_doc(doc) for doc in read_docs(args.input)))
+        else:
+            with open(args.input) as f:
+                data = json.load(f)
+
+            for doc in timer.count(data["response"]["docs"]):
+                enrich_doc(doc)
+
+            with open(args.output, "w") as out:
+                json.dump(data, out, indent=2, sort_keys=True)
+
+    if args.report:
+        instrument.write_report(args.report)
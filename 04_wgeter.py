@@ -1,22 +1,177 @@
+import argparse
 import json
-import urllib.request
+import os
+import sys
+import textwrap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import join
+
+import instrument
+from http_cache import CachedSession, add_cache_arguments, cache_options
+from jsonl import is_jsonl, read_docs, write_jsonl
+from throttle import MAX_ATTEMPTS, Throttle, ThrottledSession, add_throttle_arguments, throttle_options
 
 input_file = "./data/enriched_data/enriched.json"
-output_file = "./data/uuid_enriched_data/uuid_enriched.json"
+output_dir = "./data/uuid_enriched_data/"
+output_file = join(output_dir, "uuid_enriched.json")
+# Every uuid_json is written here as soon as it arrives, which also lets an
+# interrupted run skip what it already fetched
+docs_dir = join(output_dir, "uuid_json")
+
+DOCS_PLACEHOLDER = "__DOCS_PLACEHOLDER__"
+
+
+def make_session(
+    workers: int,
+    max_rps: float | None = None,
+    min_concurrency: int = 1,
+    max_attempts: int = MAX_ATTEMPTS,
+    **cache_kwargs,
+) -> CachedSession:
+    # Share one keep-alive pool between all workers, one connection each.
+    # Cache hits never reach the throttle, only what goes to the network does
+    throttle = Throttle(workers, min_concurrency, max_rps, max_attempts, name="api.dimu.org")
+    return CachedSession(ThrottledSession(throttle), **cache_kwargs)
+
+
+def doc_file(uuid: str) -> str:
+    return join(docs_dir, f"{uuid}.json")
+
+
+def fetch_uuid_json(session: CachedSession, uuid_link: str, uuid: str) -> None:
+    response = session.get(uuid_link)
+    response.raise_for_status()
+
+    output_path = doc_file(uuid)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp_path, output_path)
+
+
+def fetch_all(docs, workers: int, **session_kwargs) -> None:
+    os.makedirs(docs_dir, exist_ok=True)
+    session = make_session(workers, **session_kwargs)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_uuid_json, session, doc["uuid_link"], doc["artifact.uuid"]): doc["artifact.uuid"]
+            for doc in docs
+            if not os.path.exists(doc_file(doc["artifact.uuid"]))
+        }
+        print(f"Fetching {len(futures)} of {len(docs)} documents", file=sys.stderr)
+
+        for i, future in enumerate(as_completed(futures)):
+            future.result()
+            print(i, futures[future], file=sys.stderr)
+
+    session.close()
+
+
+def fetch_stream(docs, workers: int, **session_kwargs):
+    """Yield docs with uuid_json attached, in input order, as they arrive.
+
+    Only a bounded window of docs is in flight, so this works on an endless
+    stream such as stdin.
+    """
+    os.makedirs(docs_dir, exist_ok=True)
+    session = make_session(workers, **session_kwargs)
+    window = deque()
+
+    def finish():
+        doc, future = window.popleft()
+        if future is not None:
+            future.result()
+        with open(doc_file(doc["artifact.uuid"])) as f:
+            doc["uuid_json"] = json.load(f)
+        return doc
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, doc in enumerate(docs):
+            uuid = doc["artifact.uuid"]
+            print(i, uuid, file=sys.stderr)
+            future = None
+            if not os.path.exists(doc_file(uuid)):
+                future = executor.submit(fetch_uuid_json, session, doc["uuid_link"], uuid)
+            window.append((doc, future))
+
+            if len(window) >= 4 * workers:
+                yield finish()
+
+        while window:
+            yield finish()
+
+    session.close()
+
+
+def write_output(data, output_path: str) -> None:
+    """Write data with each doc's uuid_json attached, one doc at a time.
+
+    The output is identical to json.dump(data, indent=2, sort_keys=True) with
+    every uuid_json in place, without ever holding more than one in memory.
+    """
+    docs = data["response"]["docs"]
+    data["response"]["docs"] = DOCS_PLACEHOLDER
+    envelope = json.dumps(data, indent=2, sort_keys=True)
+    data["response"]["docs"] = docs
+
+    before, after = envelope.split(f'"{DOCS_PLACEHOLDER}"')
+    # Docs are nested one level deeper than the line holding the placeholder
+    placeholder_line = before.rsplit("\n", 1)[1]
+    key_indent = placeholder_line[: len(placeholder_line) - len(placeholder_line.lstrip(" "))]
+    doc_indent = key_indent + "  "
+
+    with open(output_path, "w") as out:
+        out.write(before)
+        if not docs:
+            out.write("[]")
+        else:
+            out.write("[\n")
+            for i, doc in enumerate(docs):
+                with open(doc_file(doc["artifact.uuid"])) as f:
+                    doc["uuid_json"] = json.load(f)
+
+                if i:
+                    out.write(",\n")
+                out.write(textwrap.indent(json.dumps(doc, indent=2, sort_keys=True), doc_indent))
+
+                del doc["uuid_json"]
+            out.write(f"\n{key_indent}]")
+        out.write(after)
+
 
-with open(input_file) as f:
-    data = json.load(f)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the full artifact JSON for every document.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of documents to download concurrently.",
+    )
+    parser.add_argument("--input", default=input_file, help="Enriched .json, .jsonl or - (stdin).")
+    parser.add_argument("--output", default=output_file, help="Output .json, .jsonl or - (stdout).")
+    add_cache_arguments(parser)
+    add_throttle_arguments(parser)
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
 
-for i, doc in enumerate(data["response"]["docs"]):
-    uuid_link = doc.get("uuid_link")
-    uuid = doc.get("artifact.uuid")
+    if is_jsonl(args.input) and not is_jsonl(args.output):
+        parser.error("JSONL input can only be written back out as JSONL")
 
-    print(i, uuid)
-    with urllib.request.urlopen(uuid_link) as response:
-        contents = response.read()
+    session_options = {**cache_options(args), **throttle_options(args)}
+    with instrument.stage("04_wgeter", args.profile) as timer:
+        if is_jsonl(args.output):
+            docs = read_docs(args.input)
+            timer.records = write_jsonl(args.output, fetch_stream(docs, args.workers, **session_options))
+        else:
+            with open(args.input) as f:
+                data = json.load(f)
 
-    json_data = json.loads(contents)
-    doc["uuid_json"] = json_data
+            timer.records = len(data["response"]["docs"])
+            fetch_all(data["response"]["docs"], args.workers, **session_options)
+            os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+            write_output(data, args.output)
 
-with open(output_file, "w") as out:
-    json.dump(data, out, indent=2, sort_keys=True)
+    if args.report:
+        instrument.write_report(args.report)
@@ -1,13 +1,24 @@
 # Path -> Wikimedia Object
+import argparse
 import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from collections import namedtuple
+from collections import deque, namedtuple
+from itertools import islice
 from os import path
 
+import instrument
+import raw_store
+from artwork import Artwork
+from fast_dates import parse_dimu_timestamp
+from jsonl import read_docs
+
 output_manager = namedtuple("OutputManager", ["field_name", "parser"])
 
 def parse_generic_date(date_str: str) -> datetime:
-    return datetime.strptime(date_str, "%Y%m%d-%H%M%S-%f")
+    return parse_dimu_timestamp(date_str)
 
 
 def parse_art_date(date_str: str) -> str:
@@ -311,8 +322,61 @@ def unpack(data, paths):
     return current_data
 
 
-with open("./data/uuid_enriched_data/uuid_enriched.json", "r") as f:
-    json_data = json.load(f)
+def compile_mapping(mapping):
+    """Compile the mapping table into one function that extracts every field.
+
+    The returned function takes a doc and returns a list with the value of
+    each mapping entry, in order, or None where unpack() would have returned
+    None. Paths are merged into a tree so shared prefixes such as
+    ("uuid_json", "eventWrap") are looked up once per doc instead of once per
+    field, and the walk is generated as straight-line Python rather than
+    looping over each path.
+    """
+    # Each node is (children, indexes of the fields whose path ends here)
+    tree = ({}, [])
+    for index, paths in enumerate(mapping):
+        node = tree
+        for key in paths:
+            node = node[0].setdefault(key, ({}, []))
+        node[1].append(index)
+
+    lines = [
+        "def extract(doc):",
+        f"    values = [None] * {len(mapping)}",
+    ]
+    counter = 0
+
+    def emit(node, var: str, indent: str) -> None:
+        nonlocal counter
+        children, indexes = node
+        for index in indexes:
+            lines.append(f"{indent}values[{index}] = {var}")
+
+        for key, child in children.items():
+            counter += 1
+            child_var = f"v{counter}"
+            # Missing keys are common, and a sentinel is much cheaper than
+            # raising and catching KeyError like unpack() does
+            lines.append(f"{indent}{child_var} = {var}.get({key!r}, MISSING)")
+            lines.append(f"{indent}if {child_var} is not MISSING:")
+            emit(child, child_var, indent + "    ")
+
+    emit(tree, "doc", "    ")
+    lines.append("    return values")
+
+    namespace = {"MISSING": object()}
+    exec("\n".join(lines), namespace)
+
+    return namespace["extract"]
+
+
+def extract_batch(extract, docs):
+    """Run a compiled extractor over many docs."""
+    return [extract(doc) for doc in docs]
+
+
+input_file = "./data/uuid_enriched_data/uuid_enriched.json"
+output_dir = "./data/our_parsed_data/raw/"
 
 mapping = {
     ("identifier.id",): output_manager("national_museum_norway_artwork_id", parse_generic_string),
@@ -337,20 +401,131 @@ mapping = {
     ("uuid_json", "media", "pictures"): output_manager("picture", parse_picture),
 }
 
-output_dir = "./data/our_parsed_data/raw/"
 
-for doc in json_data["response"]["docs"]:
+extract_fields = compile_mapping(mapping)
+outputs = list(mapping.values())
+
+
+def time_parsers() -> None:
+    """Time the extraction and every parser in the mapping table, for --report."""
+    global extract_fields, outputs
+    extract_fields = instrument.timed("05_mapping.extract_fields", extract_fields)
+    outputs = [
+        output_manager(
+            output.field_name,
+            instrument.timed(f"05_mapping.{output.parser.__name__}({output.field_name})", output.parser),
+        )
+        for output in outputs
+    ]
+
+
+def map_doc(doc, links: dict | None = None) -> Artwork:
+    """Map one doc, adding its book or pages from links if it is in one."""
     doc_data = {}
-    for paths, output_tuple in mapping.items():
-        data = unpack(doc, paths)
+    for data, output_tuple in zip(extract_fields(doc), outputs):
         if data is None:
             continue
         doc_data[output_tuple.field_name] = output_tuple.parser(data)
+    if links is not None:
+        doc_data.update(links.get(doc.get("artifact.uuid"), {}))
+
+    artwork = Artwork.from_json(doc_data)
+
+    # Keep the raw data in the store and only reference it from the record
+    artwork.raw_data = doc
+    artwork.raw_data_ref = raw_store.put(doc)
 
-    # Add back the raw data, zzz to go to the end of the file
-    doc_data["zzz_raw_data"] = doc
+    return artwork
 
-    output_file = path.join(output_dir, f"{doc_data['uuid']}.json")
+
+def write_doc_data(artwork: Artwork, output_dir: str) -> None:
+    output_file = path.join(output_dir, f"{artwork.uuid}.json")
 
     with open(output_file, "w") as f:
-        f.write(json.dumps(doc_data, sort_keys=True, indent=2))
+        f.write(json.dumps(artwork.to_json(), sort_keys=True, indent=2))
+
+
+def map_chunk(docs, output_dir: str, links: dict | None = None):
+    """Map and write a chunk of docs in a worker process.
+
+    A bad record should not take the rest of the chunk down with it, so
+    failures are returned as (uuid, error) pairs instead of raised.
+    """
+    errors = []
+    for doc in docs:
+        try:
+            write_doc_data(map_doc(doc, links), output_dir)
+        except Exception as e:
+            errors.append((doc.get("artifact.uuid"), f"{type(e).__name__}: {e}"))
+
+    return errors
+
+
+def map_parallel(docs, output_dir: str, workers: int, chunk_size: int, links: dict | None = None):
+    """Fan docs out over a process pool, returning the errors in input order."""
+    errors = []
+    docs = iter(docs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Only keep a couple of chunks per worker queued so memory stays flat
+        pending = deque()
+        while chunk := list(islice(docs, chunk_size)):
+            chunk_links = None
+            if links is not None:
+                # Only send a worker the links its chunk needs
+                chunk_links = {doc["artifact.uuid"]: links[doc["artifact.uuid"]] for doc in chunk if doc["artifact.uuid"] in links}
+            pending.append(executor.submit(map_chunk, chunk, output_dir, chunk_links))
+            if len(pending) >= 2 * workers:
+                errors += pending.popleft().result()
+
+        while pending:
+            errors += pending.popleft().result()
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map the raw docs to our own per-artwork format.")
+    parser.add_argument("--input", default=input_file, help="uuid enriched .json, .jsonl or - (stdin).")
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to map with; 1 maps in this process.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=64, help="Docs sent to a worker at a time.")
+    parser.add_argument("--hierarchy", help="Link records to their sketchbook or other parent, from hierarchy.py.")
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    links = None
+    if args.hierarchy:
+        from hierarchy import read_hierarchy, record_links
+
+        links = record_links(read_hierarchy(args.hierarchy))
+
+    if args.report:
+        if args.workers == 1:
+            time_parsers()
+        else:
+            print("Parsers are only timed with --workers 1", file=sys.stderr)
+
+    errors = []
+    with instrument.stage("05_mapping", args.profile) as timer:
+        # read_docs streams JSONL, so only one doc is in memory at a time
+        docs = timer.count(read_docs(args.input))
+        if args.workers == 1:
+            for doc in docs:
+                write_doc_data(map_doc(doc, links), args.output_dir)
+        else:
+            errors = map_parallel(docs, args.output_dir, args.workers, args.chunk_size, links)
+
+    if args.report:
+        instrument.write_report(args.report)
+
+    for uuid, error in errors:
+        print(f"FAILED: {uuid}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} records failed to map")
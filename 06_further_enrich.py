@@ -1,7 +1,13 @@
 from datetime import datetime
+import argparse
+import hashlib
 import json
 import os
 
+import instrument
+from artwork import Artwork, CreationDate
+from fast_dates import classify_creation_dates, parse_iso_date
+
 
 def get_creation_date(from_date, to_date, descriptive_date):
     # Have to use the descriptive_date if it is all we have
@@ -10,8 +16,8 @@ def get_creation_date(from_date, to_date, descriptive_date):
         return {"range_of_dates": False, "created_at_date": output_date}
 
     # Otherwise figure out date precision
-    from_date_dt = datetime.strptime(from_date, "%Y-%m-%d")
-    to_date_dt = datetime.strptime(to_date, "%Y-%m-%d")
+    from_date_dt = parse_iso_date(from_date)
+    to_date_dt = parse_iso_date(to_date)
 
     from_day = from_date_dt.day
     from_month = from_date_dt.month
@@ -61,24 +67,195 @@ def get_creation_date(from_date, to_date, descriptive_date):
     return None
 
 
+def enrich_record(artwork: Artwork) -> Artwork:
+    # Set creation_date
+    creation_date = get_creation_date(artwork.from_date, artwork.to_date, artwork.descriptive_date)
+    artwork.creation_date = CreationDate.from_json(creation_date)
+
+    return artwork
+
+
+def enrich_records(artworks: list[Artwork]) -> list[Artwork]:
+    """Same as enrich_record, but works out all the dates in one batch."""
+    creation_dates = classify_creation_dates(
+        [artwork.from_date for artwork in artworks],
+        [artwork.to_date for artwork in artworks],
+        [artwork.descriptive_date for artwork in artworks],
+        get_creation_date,
+    )
+    for artwork, creation_date in zip(artworks, creation_dates):
+        artwork.creation_date = CreationDate.from_json(creation_date)
+
+    return artworks
+
+
 data_dir = "./data/our_parsed_data/raw/"
 output_dir = "./data/our_parsed_data/enriched/"
+# Kept next to, not in, output_dir since everything there is read as a record
+manifest_file = "./data/our_parsed_data/enrich_manifest.json"
+
+# Records enriched at a time, enough for the batch to pay off while
+# memory stays flat however many records there are
+CHUNK_SIZE = 1000
+
+# Everything that decides what an enriched record looks like
+CODE_FILES = ("06_further_enrich.py", "artwork.py", "fast_dates.py")
+
+
+def code_version() -> str:
+    digest = hashlib.sha256()
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for filename in CODE_FILES:
+        with open(os.path.join(code_dir, filename), "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_stat(path: str) -> list[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def output_unchanged(entry: dict, output_file: str) -> bool:
+    """Whether output_file is still what we wrote, only hashing it if its stat changed."""
+    if not os.path.exists(output_file):
+        return False
+
+    output_stat = file_stat(output_file)
+    if entry.get("output_stat") == output_stat:
+        return True
+
+    with open(output_file, "rb") as f:
+        unchanged = hash_bytes(f.read()) == entry["output_hash"]
+    if unchanged:
+        entry["output_stat"] = output_stat
+    return unchanged
 
-for filename in sorted(os.listdir(data_dir)):
-    if filename.endswith(".json"):
-        with open(os.path.join(data_dir, filename)) as f:
-            data = json.load(f)
 
-        # Set creation_date
-        descriptive_date = data.get("descriptive_date")
-        from_date = data.get("from_date")
-        to_date = data.get("to_date")
+def read_manifest(manifest_file: str = manifest_file) -> dict:
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
 
-        data["creation_date"] = get_creation_date(from_date, to_date, descriptive_date)
 
-        # Write output file
-        uuid = data["uuid"]
+def write_manifest(manifest: dict, manifest_file: str = manifest_file) -> None:
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def enrich_changed(
+    force: bool = False,
+    data_dir: str = data_dir,
+    output_dir: str = output_dir,
+    manifest_file: str = manifest_file,
+) -> int:
+    """Only enrich the records whose input or enrichment code changed.
+
+    The manifest maps each uuid to the hash of its input, the hash of its
+    output and the code version that produced it. An output that was edited
+    or truncated since is rebuilt, and outputs whose input has gone away are
+    removed. Returns the number of records enriched.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = read_manifest(manifest_file)
+    version = code_version()
+
+    artworks = []
+    input_hashes = {}
+    seen = set()
+    n_enriched = 0
+
+    def flush():
+        for artwork in enrich_records(artworks):
+            # Write output file
+            output = json.dumps(artwork.to_json(), indent=2, sort_keys=True)
+            output_file = os.path.join(output_dir, f"{artwork.uuid}.json")
+            with open(output_file, "w") as f:
+                f.write(output)
+
+            input_hash, input_stat = input_hashes.pop(artwork.uuid)
+            manifest[artwork.uuid] = {
+                "input_hash": input_hash,
+                "input_stat": input_stat,
+                "output_hash": hash_bytes(output.encode()),
+                "output_stat": file_stat(output_file),
+                "code_version": version,
+            }
+        artworks.clear()
+
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json"):
+            continue
+
+        # 05_mapping.py names every file after the record's uuid
+        uuid = filename.removesuffix(".json")
+        seen.add(uuid)
+        input_file = os.path.join(data_dir, filename)
+        entry = manifest.get(uuid)
+
+        # Checking size and mtime first saves hashing every unchanged file
+        input_stat = file_stat(input_file)
+        up_to_date = (
+            not force
+            and entry is not None
+            and entry["code_version"] == version
+            and output_unchanged(entry, os.path.join(output_dir, f"{uuid}.json"))
+        )
+        if up_to_date and entry["input_stat"] == input_stat:
+            continue
+
+        with open(input_file, "rb") as f:
+            data = f.read()
+        input_hash = hash_bytes(data)
+
+        if up_to_date and entry["input_hash"] == input_hash:
+            # Touched but not changed, remember the new mtime
+            entry["input_stat"] = input_stat
+            continue
+
+        input_hashes[uuid] = (input_hash, input_stat)
+        artworks.append(Artwork.from_json(json.loads(data)))
+        n_enriched += 1
+        if len(artworks) >= CHUNK_SIZE:
+            flush()
+
+    flush()
+    print(f"Enriched {n_enriched} changed records")
+
+    # Also outputs the manifest never knew about, e.g. from before it existed
+    outputs = {filename.removesuffix(".json") for filename in os.listdir(output_dir) if filename.endswith(".json")}
+    removed = sorted((set(manifest) | outputs) - seen)
+    print(f"Removing {len(removed)} records whose input is gone")
+    for uuid in removed:
         output_file = os.path.join(output_dir, f"{uuid}.json")
-        with open(output_file, "w") as f:
-            json.dump(data, f, indent=2, sort_keys=True)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        manifest.pop(uuid, None)
+
+    write_manifest(manifest, manifest_file)
+
+    return n_enriched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work out the creation date of every parsed record.")
+    parser.add_argument("--force", action="store_true", help="Re-enrich every record, changed or not.")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--manifest", default=manifest_file, help="Keep it outside --output-dir.")
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.stage("06_further_enrich", args.profile) as timer:
+        timer.records = enrich_changed(args.force, args.data_dir, args.output_dir, args.manifest)
 
+    if args.report:
+        instrument.write_report(args.report)
@@ -1,6 +1,15 @@
+import argparse
+import importlib
 import json
 import os
+import sys
 import textwrap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import instrument
+from artwork import Artwork, CreationDate, Location, Measurement
 
 
 # Template: https://commons.wikimedia.org/wiki/Template:Artwork
@@ -28,22 +37,22 @@ TEMPLATE = """
 {{{{Licensed-PD-Art|PD-old-auto-expired|cc-by-4.0|attribution=Nasjonalmuseet{photographer}|deathyear=1903}}}}
 
 [[Category:Drawings by Hans Gude in the Nasjonalmuseet for kunst, arkitektur og design]]
-[[Category:Images from Digitalt Museum, Norway]]
+[[Category:Images from Digitalt Museum, Norway]]{place_categories}
 
 <!-- Raw JSON data used to build this page. -->
 {raw_data}
 """
 
 
-def get_date(creation_date_json) -> str:
+def get_date(creation_date: CreationDate) -> str:
     # If date is exact, it's easy
-    if not creation_date_json["range_of_dates"]:
-        return creation_date_json["created_at_date"]
+    if not creation_date.range_of_dates:
+        return creation_date.created_at_date
 
     # Otherwise, it's a range, and needs the other date template
     # https://commons.wikimedia.org/wiki/Template:Other_date
-    start_date = creation_date_json["created_at_date_start"]
-    end_date = creation_date_json["created_at_date_end"]
+    start_date = creation_date.created_at_date_start
+    end_date = creation_date.created_at_date_end
 
     # Sometimes we just don't know the date, in which case the museum uses a
     # very large range ending at Gude's death year
@@ -85,13 +94,13 @@ def get_medium(techniques_json, materials_json) -> str:
     return "".join(final_list)
 
 
-def get_dimensions(measurements) -> str:
+def get_dimensions(measurements: dict[str, Measurement]) -> str:
     # The main art
     main_object = measurements["main_object"]
-    height = main_object["height"]
-    width = main_object["width"]
-    height_unit = main_object["height_unit"]
-    width_unit = main_object["width_unit"]
+    height = main_object.height
+    width = main_object.width
+    height_unit = main_object.height_unit
+    width_unit = main_object.width_unit
 
     if width_unit != height_unit:
         raise ValueError("Units don't match")
@@ -101,11 +110,11 @@ def get_dimensions(measurements) -> str:
     # Frame, if exists
     frame = measurements.get("frame")
     if frame is not None:
-        frame_height = frame["height"]
-        frame_width = frame["width"]
-        frame_height_unit = frame["height_unit"]
-        frame_width_unit = frame["width_unit"]
-        frame_depth = frame["depth"]
+        frame_height = frame.height
+        frame_width = frame.width
+        frame_height_unit = frame.height_unit
+        frame_width_unit = frame.width_unit
+        frame_depth = frame.depth
 
         if frame_height_unit != frame_width_unit:
             raise ValueError("Frame size units don't match")
@@ -117,20 +126,19 @@ def get_dimensions(measurements) -> str:
     return main_size_template
 
 
-def get_depicted_place(depicted_locations):
+def get_depicted_place(depicted_locations: list[Location] | None):
     # Sometimes we don't have locations
     if depicted_locations is None:
         return None
 
     output = []
     for location in depicted_locations:
-        coordinates = location.get("coordinates")
-        human_name = location.get("human_name")
+        coordinates = location.latitude is not None
+        human_name = location.human_name
         if coordinates:
-            lat, long = coordinates.split(", ")
             # 5 digits is meter accuracy, which is far higher than these coordinates are
-            lat = round(float(lat), 5)
-            long = round(float(long), 5)
+            lat = round(location.latitude, 5)
+            long = round(location.longitude, 5)
 
         if human_name and coordinates:
             output.append(
@@ -142,6 +150,18 @@ def get_depicted_place(depicted_locations):
     return "<br>".join(output)
 
 
+# The fixed parts of the title, worked out once instead of dedenting every
+# record. Only the first other language is indented, so several of them used
+# to stop dedent() from removing anything, and none used to leave a blank line.
+TITLE_BLOCK = """        {{{{Title
+          |1={primary_title}
+          |lang={primary_title_lanague}
+          {other_languages}
+        }}}}"""
+TITLE_TEMPLATE = textwrap.dedent(TITLE_BLOCK)
+TITLE_TEMPLATE_NO_OTHER_LANGUAGES = TITLE_TEMPLATE.replace("  {other_languages}", "")
+
+
 def get_title_and_description(titles):
     three_to_two_iso_code = {
         "deu": "de",
@@ -210,30 +230,61 @@ def get_title_and_description(titles):
     primary_title = title_dict.pop(primary_title_lanague)
     other_languages = "\n".join([f"|{lc}={title}" for lc, title in title_dict.items()])
 
-    output = textwrap.dedent(
-        f"""
-        {{{{Title
-          |1={primary_title}
-          |lang={primary_title_lanague}
-          {other_languages}
-        }}}}
-        """
-    ).strip("\n")
-
+    if not other_languages:
+        template = TITLE_TEMPLATE_NO_OTHER_LANGUAGES
+    elif "\n" in other_languages:
+        template = TITLE_BLOCK
+    else:
+        template = TITLE_TEMPLATE
+    output = template.format(
+        primary_title=primary_title,
+        primary_title_lanague=primary_title_lanague,
+        other_languages=other_languages,
+    )
 
     return output, output_description
 
 
+# Dedented once here rather than for every record
+SOURCES_TEMPLATE = textwrap.dedent(
+    """
+    * [{direct_image_link} Direct Image Link from the National Museum of Art, Architecture and Design]
+    * [{nasjonalmuseet_link} Image on the National Museum of Art, Architecture and Design]
+    * [{digitalt_museum_link} Image on the Digitalt Museum]
+    """
+).strip("\n")
+ACCESSION_NUMBER_TEMPLATE = textwrap.dedent(
+    """
+    * [https://www.wikidata.org/wiki/Property:P9121 National Museum Norway artwork ID]: [{nasjonalmuseet_link} {national_museum_norway_artwork_id}]
+    * [https://www.wikidata.org/wiki/Property:P7847 DigitaltMuseum ID]: [{digitalt_museum_link} {digitalt_museum_id}]
+    * DigitaltMuseum UUID: [https://api.dimu.org/artifact/uuid/{uuid} {uuid}]
+    """
+).strip("\n")
+# The subjects start at column 0, so this one was never dedented
+OTHER_FIELDS_TEMPLATE = """        {{{{Information field
+            |Name=Subjects
+            |Value={{{{en|Subjects from the National Museum of Art, Architecture and Design:
+{subject_str}}}}}
+        }}}}"""
+PART_OF_TEMPLATE = """        {{{{Information field
+            |Name=Part of
+            |Value={{{{en|{relation} [{digitalt_museum_link} {title}] ({identifier})}}}}
+        }}}}"""
+# How a record relates to its parent, by the kind hierarchy.py gave the parent
+PART_OF_RELATIONS = {
+    "sketchbook": "Page of the sketchbook",
+    "reverse": "Reverse of",
+}
+
+
 def get_sources(
     nasjonalmuseet_link: str, digitalt_museum_link: str, direct_image_link: str
 ) -> str:
-    output = textwrap.dedent(
-        f"""
-        * [{direct_image_link} Direct Image Link from the National Museum of Art, Architecture and Design]
-        * [{nasjonalmuseet_link} Image on the National Museum of Art, Architecture and Design]
-        * [{digitalt_museum_link} Image on the Digitalt Museum]
-        """
-    ).strip("\n")
+    output = SOURCES_TEMPLATE.format(
+        direct_image_link=direct_image_link,
+        nasjonalmuseet_link=nasjonalmuseet_link,
+        digitalt_museum_link=digitalt_museum_link,
+    )
 
     return output
 
@@ -245,13 +296,13 @@ def get_accession_number(
     digitalt_museum_link: str,
     uuid: str,
 ) -> str:
-    output = textwrap.dedent(
-        f"""
-        * [https://www.wikidata.org/wiki/Property:P9121 National Museum Norway artwork ID]: [{nasjonalmuseet_link} {national_museum_norway_artwork_id}]
-        * [https://www.wikidata.org/wiki/Property:P7847 DigitaltMuseum ID]: [{digitalt_museum_link} {digitalt_museum_id}]
-        * DigitaltMuseum UUID: [https://api.dimu.org/artifact/uuid/{uuid} {uuid}]
-        """
-    ).strip("\n")
+    output = ACCESSION_NUMBER_TEMPLATE.format(
+        national_museum_norway_artwork_id=national_museum_norway_artwork_id,
+        digitalt_museum_id=digitalt_museum_id,
+        nasjonalmuseet_link=nasjonalmuseet_link,
+        digitalt_museum_link=digitalt_museum_link,
+        uuid=uuid,
+    )
 
     return output
 
@@ -272,113 +323,315 @@ def get_other_fields(subjects: str) -> str:
         subject_str += "* " + subject + "\n"
     subject_str.strip("\n")
 
-    output = textwrap.dedent(
-        f"""
-        {{{{Information field
-            |Name=Subjects
-            |Value={{{{en|Subjects from the National Museum of Art, Architecture and Design:\n{subject_str}}}}}
-        }}}}
-        """
-    ).strip("\n")
+    output = OTHER_FIELDS_TEMPLATE.format(subject_str=subject_str)
 
     return output
 
 
+def get_part_of(part_of: dict | None) -> str:
+    if part_of is None:
+        return ""
+    return PART_OF_TEMPLATE.format(
+        relation=PART_OF_RELATIONS.get(part_of.get("kind"), "Part of"),
+        digitalt_museum_link=part_of["digitalt_museum_link"],
+        # A ] in the title would end the link early
+        title=(part_of["title"] or "Untitled").replace("[", "&#91;").replace("]", "&#93;"),
+        identifier=part_of["identifier"],
+    )
+
+
+def sort_keys(data):
+    """Recursively sort dict keys, the order a record has when read from disk."""
+    if isinstance(data, dict):
+        return {key: sort_keys(data[key]) for key in sorted(data)}
+    if isinstance(data, list):
+        return [sort_keys(value) for value in data]
+    return data
+
+
 def get_json_blob(raw_data: str) -> str:
-    code_template = textwrap.dedent(
-        f"""
-        <!--{raw_data}-->
-        """
-    ).strip("\n")
+    # repr() never contains a newline, so there is nothing to dedent
+    return f"<!--{raw_data}-->"
+
+
+def render(artwork: Artwork, place_categories=()) -> str:
+    # Creation_date
+    creation_date = artwork.creation_date
+    date = ""
+    if creation_date is not None and creation_date.range_of_dates is not None:
+        date = get_date(creation_date)
+
+    # Medium
+    medium = get_medium(artwork.techniques, artwork.materials)
+
+    # Size
+    dimensions = get_dimensions(artwork.measurements)
+
+    # Location
+    if artwork.locations is not None:
+        depicted_place = get_depicted_place(artwork.locations.get("depicted_location"))
+    else:
+        depicted_place = ""
+
+    # Title
+    title, description = get_title_and_description(artwork.titles)
+
+    # Source
+    nasjonalmuseet_link = artwork.nasjonalmuseet_link
+    digitalt_museum_link = artwork.digitalt_museum_link
+    direct_image_link = artwork.picture.direct_image_link
+
+    source = get_sources(nasjonalmuseet_link, digitalt_museum_link, direct_image_link)
+
+    # Accession number
+    uuid = artwork.uuid
+    national_museum_norway_artwork_id = artwork.national_museum_norway_artwork_id
+    digitalt_museum_id = artwork.digitalt_museum_id
+    accession_number = get_accession_number(
+        national_museum_norway_artwork_id,
+        digitalt_museum_id,
+        nasjonalmuseet_link,
+        digitalt_museum_link,
+        uuid,
+    )
+
+    # Credit line
+    credit_line = get_credit_line(artwork.acquistion_notes)
+
+    # Subjects, and the sketchbook or other artifact a record is part of
+    other_fields = "\n".join(
+        field for field in (get_other_fields(artwork.subjects), get_part_of(artwork.part_of)) if field
+    )
+
+    # Photographer
+    photographer = artwork.picture.photographer
+    if photographer is None:
+        photographer = ""
+    else:
+        photographer = "/" + photographer
+
+    # Categories of the depicted places, from places.py
+    place_categories = "".join(f"\n[[Category:{category}]]" for category in place_categories)
+
+    # raw_data
+    raw_data = get_json_blob(sort_keys(artwork.to_json(resolve_raw=True)))
+
+    # Template
+    wiki_template = TEMPLATE.format(
+        depicted_place=depicted_place,
+        date=date,
+        medium=medium,
+        dimensions=dimensions,
+        title=title,
+        description=description,
+        source=source,
+        accession_number=accession_number,
+        credit_line=credit_line,
+        other_fields=other_fields,
+        raw_data=raw_data,
+        photographer=photographer,
+        place_categories=place_categories,
+    )
+    return wiki_template
+
+
+def add_derivatives(artwork: Artwork, derivatives: dict | None) -> None:
+    # The sizes 09_derivatives.py keeps next to the records, not in them
+    if derivatives and artwork.picture is not None and artwork.uuid in derivatives:
+        artwork.picture.extra["derivatives"] = derivatives[artwork.uuid]
+
+
+def render_file(path: str, place_categories: dict | None = None, derivatives: dict | None = None) -> tuple[str, str]:
+    with open(path) as f:
+        artwork = Artwork.from_json(json.load(f))
+
+    add_derivatives(artwork, derivatives)
+    categories = place_categories.get(artwork.uuid, ()) if place_categories else ()
+    return artwork.uuid, render(artwork, categories)
+
+
+def render_docs(docs, place_categories: dict | None = None, derivatives: dict | None = None):
+    """Map, enrich and render docs from 04_wgeter.py, yielding (uuid, wikitext).
+
+    Saves running 05_mapping.py and 06_further_enrich.py over everything to
+    see what a change does to one page.
+    """
+    mapping = importlib.import_module("05_mapping")
+    further_enrich = importlib.import_module("06_further_enrich")
+    for doc in docs:
+        artwork = further_enrich.enrich_records([mapping.map_doc(doc)])[0]
+        add_derivatives(artwork, derivatives)
+        categories = place_categories.get(artwork.uuid, ()) if place_categories else ()
+        yield artwork.uuid, render(artwork, categories)
+
+
+def render_chunk(paths, place_categories: dict | None = None, derivatives: dict | None = None):
+    return [render_file(path, place_categories, derivatives) for path in paths]
+
+
+def render_parallel(
+    paths,
+    workers: int,
+    chunk_size: int,
+    place_categories: dict | None = None,
+    derivatives: dict | None = None,
+):
+    """Render over a process pool, yielding (uuid, wikitext) in input order."""
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Only keep a couple of chunks per worker queued so memory stays flat
+        pending = deque()
+        while chunk := list(islice(paths, chunk_size)):
+            pending.append(executor.submit(render_chunk, chunk, place_categories, derivatives))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_stdout(pages) -> None:
+    for uuid, wiki_template in pages:
+        print("-----------------------------------")
+        print(wiki_template)
 
-    return code_template
+
+def write_files(pages, output_dir: str) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    for uuid, wiki_template in pages:
+        with open(os.path.join(output_dir, f"{uuid}.wikitext"), "w") as f:
+            f.write(wiki_template)
+
+
+def bundle_index_file(bundle_file: str) -> str:
+    return f"{bundle_file}.index.json"
+
+
+def write_bundle(pages, bundle_file: str) -> None:
+    """Write every page into one file, plus an index of where each one is.
+
+    The index maps uuid to the [offset, length] of its page in bytes, so a
+    single page can be read back without going through the whole bundle.
+    """
+    index = {}
+    offset = 0
+    with open(bundle_file, "wb") as f:
+        for uuid, wiki_template in pages:
+            page = wiki_template.encode()
+            f.write(page)
+            index[uuid] = [offset, len(page)]
+            offset += len(page)
+
+    with open(bundle_index_file(bundle_file), "w") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+
+def read_bundle_page(bundle_file: str, uuid: str) -> str:
+    with open(bundle_index_file(bundle_file)) as f:
+        offset, length = json.load(f)[uuid]
+    with open(bundle_file, "rb") as f:
+        f.seek(offset)
+        return f.read(length).decode()
 
 
 data_dir = "./data/our_parsed_data/enriched/"
 
-for filename in sorted(os.listdir(data_dir)):
-    if filename.endswith(".json"):
-        with open(os.path.join(data_dir, filename)) as f:
-            data = json.load(f)
-
-        # Creation_date
-        date_json = data.get("creation_date")
-        date = ""
-        if date_json:
-            date = get_date(date_json)
-
-        # Medium
-        techniques_json = data.get("techniques")
-        materials_json = data.get("materials")
-        medium = get_medium(techniques_json, materials_json)
-
-        # Size
-        measurements_json = data.get("measurements")
-        dimensions = get_dimensions(measurements_json)
-
-        # Location
-        locations_json = data.get("locations")
-        if locations_json is not None:
-            locations_json = locations_json.get("depicted_location")
-            depicted_place = get_depicted_place(locations_json)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the enriched records as Commons wikitext.")
+    parser.add_argument("--data-dir", default=data_dir)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--output-dir", help="Write one <uuid>.wikitext file per record instead of printing.")
+    output.add_argument("--bundle", help="Write every page to this one file, with an index next to it.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to render with; 1 renders in this process.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=64, help="Records sent to a worker at a time.")
+    parser.add_argument(
+        "--place-categories",
+        nargs="?",
+        const="./data/places.json",
+        help="Add the categories places.py assign found for the depicted places.",
+    )
+    parser.add_argument(
+        "--derivatives",
+        default="./data/derivatives.json",
+        help="Sizes of the images made by 09_derivatives.py, added to the records when the file exists.",
+    )
+    records = parser.add_mutually_exclusive_group()
+    records.add_argument("--book", metavar="UUID", help="Only render this sketchbook and its pages, in page order.")
+    records.add_argument("--uuid", nargs="+", help="Only render these records.")
+    parser.add_argument(
+        "--source",
+        help="With --uuid, map and render the docs straight from this 04_wgeter.py .json or .jsonl output.",
+    )
+    parser.add_argument("--hierarchy", default="./data/hierarchy.json", help="Sketchbooks from hierarchy.py, for --book.")
+    instrument.add_report_arguments(parser)
+    args = parser.parse_args()
+
+    if args.source and not args.uuid:
+        parser.error("--source only works with --uuid")
+
+    place_categories = None
+    if args.place_categories:
+        # Only needed here, and it pulls in NumPy
+        from places import read_place_categories
+
+        place_categories = read_place_categories(args.place_categories)
+
+    derivatives = None
+    if os.path.exists(args.derivatives):
+        # Only needed here, and it pulls in Pillow
+        derivatives = importlib.import_module("09_derivatives").read_derivatives(args.derivatives)
+
+    if args.book:
+        from hierarchy import book_pages, read_hierarchy, sketchbooks
+
+        books = sketchbooks(read_hierarchy(args.hierarchy))
+        if args.book not in books:
+            parser.error(f"{args.book} is not a sketchbook in {args.hierarchy}")
+        paths = [os.path.join(args.data_dir, f"{uuid}.json") for uuid in book_pages(books, args.book)]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print(f"Skipping {len(missing)} pages that are not in {args.data_dir}", file=sys.stderr)
+            paths = [path for path in paths if path not in missing]
+    elif args.source:
+        from doc_index import DocIndex
+
+        # Only the asked for docs are parsed, found through the file's offset index
+        with DocIndex(args.source) as source:
+            missing = [uuid for uuid in args.uuid if uuid not in source]
+            if missing:
+                parser.error(f"Not in {args.source}: {', '.join(missing)}")
+            docs = [source.get(uuid) for uuid in args.uuid]
+    elif args.uuid:
+        paths = [os.path.join(args.data_dir, f"{uuid}.json") for uuid in args.uuid]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            parser.error(f"No such records: {', '.join(missing)}")
+    else:
+        paths = [
+            os.path.join(args.data_dir, filename)
+            for filename in sorted(os.listdir(args.data_dir))
+            if filename.endswith(".json")
+        ]
+    with instrument.stage("07_to_art_template", args.profile) as timer:
+        if args.source:
+            pages = render_docs(docs, place_categories, derivatives)
+        elif args.workers == 1:
+            pages = (render_file(path, place_categories, derivatives) for path in paths)
         else:
-            depicted_place = ""
-
-        # Title
-        titles_json = data.get("titles")
-        title, description = get_title_and_description(titles_json)
-
-        # Source
-        nasjonalmuseet_link = data["nasjonalmuseet_link"]
-        digitalt_museum_link = data["digitalt_museum_link"]
-        direct_image_link = data["picture"]["direct_image_link"]
-
-        source = get_sources(nasjonalmuseet_link, digitalt_museum_link, direct_image_link)
-
-        # Accession number
-        uuid = data["uuid"]
-        national_museum_norway_artwork_id = data["national_museum_norway_artwork_id"]
-        digitalt_museum_id = data["digitalt_museum_id"]
-        accession_number = get_accession_number(
-            national_museum_norway_artwork_id,
-            digitalt_museum_id,
-            nasjonalmuseet_link,
-            digitalt_museum_link,
-            uuid,
-        )
-
-        # Credit line
-        acquistion_notes = data.get("acquistion_notes")
-        credit_line = get_credit_line(acquistion_notes)
-
-        # Subjects
-        subjects = data.get("subjects")
-        other_fields = get_other_fields(subjects)
-
-        # Photographer
-        photographer = data["picture"].get("photographer")
-        if photographer is None:
-            photographer = ""
+            pages = render_parallel(paths, args.workers, args.chunk_size, place_categories, derivatives)
+        pages = timer.count(pages)
+
+        if args.output_dir:
+            write_files(pages, args.output_dir)
+        elif args.bundle:
+            write_bundle(pages, args.bundle)
         else:
-            photographer = "/" + photographer
-
-        # raw_data
-        raw_data = get_json_blob(data)
-
-        # Template
-        wiki_template = TEMPLATE.format(
-            depicted_place=depicted_place,
-            date=date,
-            medium=medium,
-            dimensions=dimensions,
-            title=title,
-            description=description,
-            source=source,
-            accession_number=accession_number,
-            credit_line=credit_line,
-            other_fields=other_fields,
-            raw_data=raw_data,
-            photographer=photographer,
-        )
-        print("-----------------------------------")
-        print(wiki_template)
+            write_stdout(pages)
+
+    if args.report:
+        instrument.write_report(args.report)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import join
+
+import requests
+
+from artwork import Artwork
+from throttle import Throttle, ThrottledSession, TokenBucket, add_throttle_arguments, throttle_options
+
+data_dir = "./data/our_parsed_data/enriched/"
+output_dir = "./data/images/"
+
+# Where parse_picture in 05_mapping.py points direct_image_link
+IMAGE_HOST = "https://ms01.nasjonalmuseet.no"
+# Never hold more than this of an image in memory
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = (10, 60)
+
+# TIFF tags and field types needed to find the image size
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+TIFF_INTEGER_FORMATS = {3: "H", 4: "I", 16: "Q"}
+
+
+def make_session(workers: int, **throttle_kwargs) -> ThrottledSession:
+    # Not cached, the images are far too big
+    return ThrottledSession(Throttle(workers, name="images", **throttle_kwargs))
+
+
+def image_file(output_dir: str, uuid: str) -> str:
+    return join(output_dir, f"{uuid}.tif")
+
+
+def image_url(direct_image_link: str, image_host: str) -> str:
+    if direct_image_link.startswith(IMAGE_HOST):
+        return image_host + direct_image_link[len(IMAGE_HOST):]
+    return direct_image_link
+
+
+def tiff_dimensions(f) -> tuple[int, int]:
+    """Read (width, height) from the first image directory of a TIFF file."""
+    f.seek(0)
+    header = f.read(16)
+    if header[:2] == b"II":
+        byte_order = "<"
+    elif header[:2] == b"MM":
+        byte_order = ">"
+    else:
+        raise ValueError("Not a TIFF file")
+
+    (version,) = struct.unpack_from(byte_order + "H", header, 2)
+    if version == 42:
+        (ifd_offset,) = struct.unpack_from(byte_order + "I", header, 4)
+        count_format, entry_format = "H", "HHI4s"
+    elif version == 43:
+        # BigTIFF, for images over 4 GB
+        (ifd_offset,) = struct.unpack_from(byte_order + "Q", header, 8)
+        count_format, entry_format = "Q", "HHQ8s"
+    else:
+        raise ValueError(f"Unknown TIFF version {version}")
+
+    f.seek(ifd_offset)
+    count_size = struct.calcsize(byte_order + count_format)
+    entry_size = struct.calcsize(byte_order + entry_format)
+    (n_entries,) = struct.unpack(byte_order + count_format, f.read(count_size))
+    entries = f.read(n_entries * entry_size)
+
+    size = {}
+    for i in range(n_entries):
+        tag, field_type, _, value = struct.unpack_from(byte_order + entry_format, entries, i * entry_size)
+        if tag in (IMAGE_WIDTH, IMAGE_LENGTH) and field_type in TIFF_INTEGER_FORMATS:
+            # Values that fit are stored left aligned in the value field
+            size[tag] = struct.unpack_from(byte_order + TIFF_INTEGER_FORMATS[field_type], value)[0]
+
+    if len(size) != 2:
+        raise ValueError("TIFF has no image size")
+
+    return size[IMAGE_WIDTH], size[IMAGE_LENGTH]
+
+
+def download_image(session, url: str, path: str, width: int, height: int, limit: TokenBucket | None) -> None:
+    """Stream url to path, carrying on from a .part file left by an earlier try.
+
+    The finished file only gets its real name once its TIFF header matches
+    the picture width and height from the museum.
+    """
+    part_path = f"{path}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    # Range offsets count the bytes as sent, so ask for them uncompressed
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        # 416 means there is nothing left after offset, the .part is complete
+        if response.status_code != 416:
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The server ignored the range, start again from the beginning
+                offset = 0
+
+            expected_size = None
+            if "Content-Length" in response.headers:
+                expected_size = offset + int(response.headers["Content-Length"])
+
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if limit is not None:
+                        limit.consume(len(chunk))
+                    f.write(chunk)
+
+            # Keep a short file around, the next run picks up where it stopped
+            size = os.path.getsize(part_path)
+            if expected_size is not None and size != expected_size:
+                raise IOError(f"Got {size} of {expected_size} bytes")
+
+    with open(part_path, "rb") as f:
+        try:
+            dimensions = tiff_dimensions(f)
+        except (ValueError, struct.error) as e:
+            dimensions = e
+
+    if dimensions != (width, height):
+        # Resuming a wrong file would never fix it, so start over next time
+        os.remove(part_path)
+        raise ValueError(f"Expected a {width}x{height} TIFF, got {dimensions}")
+
+    os.replace(part_path, path)
+
+
+def load_pictures(data_dir: str, image_host: str):
+    """Return (uuid, url, width, height) for every record with a picture."""
+    pictures = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".json"):
+            with open(join(data_dir, filename)) as f:
+                artwork = Artwork.from_json(json.load(f))
+
+            picture = artwork.picture
+            if picture is not None:
+                url = image_url(picture.direct_image_link, image_host)
+                pictures.append((artwork.uuid, url, picture.width, picture.height))
+
+    return pictures
+
+
+def download_all(pictures, output_dir: str, workers: int, limit: TokenBucket | None, **throttle_kwargs) -> list:
+    """Download every picture not already on disk, returning (uuid, error) pairs."""
+    os.makedirs(output_dir, exist_ok=True)
+    session = make_session(workers, **throttle_kwargs)
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_image, session, url, image_file(output_dir, uuid), width, height, limit): uuid
+            for uuid, url, width, height in pictures
+            if not os.path.exists(image_file(output_dir, uuid))
+        }
+        print(f"Downloading {len(futures)} of {len(pictures)} images", file=sys.stderr)
+
+        for i, future in enumerate(as_completed(futures)):
+            uuid = futures[future]
+            try:
+                future.result()
+            except (requests.RequestException, IOError, ValueError) as e:
+                errors.append((uuid, f"{type(e).__name__}: {e}"))
+                print(i, uuid, "FAILED", file=sys.stderr)
+            else:
+                print(i, uuid, file=sys.stderr)
+
+    session.close()
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the full resolution TIFF of every record.")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--workers", type=int, default=4, help="Images downloaded at the same time.")
+    parser.add_argument("--max-mbps", type=float, help="Cap on the total download speed, in megabytes per second.")
+    parser.add_argument("--image-host", default=IMAGE_HOST, help="Fetch from this host instead, e.g. a local test server.")
+    add_throttle_arguments(parser)
+    args = parser.parse_args()
+
+    limit = TokenBucket(args.max_mbps * 1_000_000) if args.max_mbps else None
+
+    pictures = load_pictures(args.data_dir, args.image_host)
+    errors = download_all(pictures, args.output_dir, args.workers, limit, **throttle_options(args))
+    for uuid, error in errors:
+        print(f"FAILED: {uuid}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} images failed to download")
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import ceil
+from os.path import join
+
+from PIL import Image
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows; workers then run without a memory limit
+    resource = None
+
+data_dir = "./data/our_parsed_data/enriched/"
+image_dir = "./data/images/"
+output_dir = "./data/derivatives/"
+# The sizes of every uuid's derivatives. Kept out of the enriched records,
+# which 06_further_enrich.py owns and rewrites whenever their input changes
+derivatives_file = "./data/derivatives.json"
+
+JPEG_QUALITY = 90
+# TIFF tags
+BITS_PER_SAMPLE = 258
+PLANAR_CONFIGURATION = 284
+CHUNKY = 1
+
+# Huge images are exactly what this stage is for, so don't warn about them
+Image.MAX_IMAGE_PIXELS = None
+
+
+def limit_memory(memory_budget: int) -> None:
+    """Cap the address space of a worker, so a bad image fails alone."""
+    if resource is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_budget, hard))
+
+
+def jpeg_file(output_dir: str, uuid: str) -> str:
+    return join(output_dir, "jpeg", f"{uuid}.jpg")
+
+
+def thumbnail_file(output_dir: str, uuid: str) -> str:
+    return join(output_dir, "thumbnail", f"{uuid}.jpg")
+
+
+def is_up_to_date(path: str, source: str) -> bool:
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def target_size(width: int, height: int, max_size: int) -> tuple[int, int]:
+    scale = min(1, max_size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def save_jpeg(image: Image.Image, path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, format="JPEG", quality=JPEG_QUALITY)
+    os.replace(tmp_path, path)
+
+
+def raw_tiles(image) -> list | None:
+    """The strips or tiles of an uncompressed TIFF page, None if it is compressed."""
+    if not image.tile or image.tag_v2.get(PLANAR_CONFIGURATION, CHUNKY) != CHUNKY:
+        return None
+    if any(tile[0] != "raw" or tile[3][2] != 1 for tile in image.tile):
+        return None
+    return image.tile
+
+
+def tile_row_bytes(image, tile) -> int:
+    x0, _, x1, _ = tile[1]
+    stride = tile[3][1]
+    # Tiles sticking out past the right edge carry their stride, as their
+    # rows are wider in the file than in the image
+    return stride or ceil((x1 - x0) * sum(image.tag_v2[BITS_PER_SAMPLE]) / 8)
+
+
+def reduce_in_bands(image, path: str, factor: int, band_bytes: int, tiles) -> Image.Image:
+    """Shrink an uncompressed TIFF by factor, decoding a band of rows at a time.
+
+    Every band is put together from the rows of the strips or tiles it
+    overlaps, read straight from their offsets, so only one band of the
+    full image is ever in memory. Bands are a multiple of factor rows high,
+    so reducing them one by one gives the same pixels as reducing the whole
+    image at once.
+    """
+    width, height = image.size
+    row_bytes = ceil(width * sum(image.tag_v2[BITS_PER_SAMPLE]) / 8)
+    band_rows = max(factor, band_bytes // row_bytes // factor * factor)
+
+    reduced = Image.new("RGB", (ceil(width / factor), ceil(height / factor)))
+    with open(path, "rb") as f:
+        for y in range(0, height, band_rows):
+            rows = min(band_rows, height - y)
+            band = Image.new(image.mode, (width, rows))
+            for tile in tiles:
+                _, (x0, y0, x1, y1), offset, (rawmode, stride, orientation) = tile
+                top, bottom = max(y0, y), min(y1, y + rows)
+                if top >= bottom:
+                    continue
+
+                # Only the rows of the tile that fall in this band
+                tile_bytes = tile_row_bytes(image, tile)
+                f.seek(offset + (top - y0) * tile_bytes)
+                data = f.read((bottom - top) * tile_bytes)
+                part = Image.frombuffer(image.mode, (x1 - x0, bottom - top), data, "raw", rawmode, stride, orientation)
+                band.paste(part, (x0, top - y))
+
+            reduced.paste(band.convert("RGB").reduce(factor), (0, y // factor))
+
+    return reduced
+
+
+def open_smallest_page(image, size: tuple[int, int]):
+    """Switch to the smallest page at least size big, for pyramid TIFFs."""
+    best = None
+    for page in range(getattr(image, "n_frames", 1)):
+        image.seek(page)
+        if image.size[0] >= size[0] and image.size[1] >= size[1]:
+            if best is None or image.size[0] < best[1][0]:
+                best = (page, image.size)
+
+    image.seek(best[0] if best is not None else 0)
+
+
+def make_jpeg(tiff_path: str, path: str, max_size: int, memory_budget: int) -> None:
+    with Image.open(tiff_path) as image:
+        size = target_size(*image.size, max_size)
+        open_smallest_page(image, size)
+        width, height = image.size
+        # Reduce by a whole factor first, then resample the rest of the way
+        factor = max(1, min(width // size[0], height // size[1]))
+
+        tiles = raw_tiles(image)
+        if tiles is not None:
+            reduced = reduce_in_bands(image, tiff_path, factor, memory_budget // 8, tiles)
+        else:
+            # Compressed pages can only be decoded whole
+            needed = width * height * 4
+            if needed > memory_budget // 2:
+                raise MemoryError(f"Decoding this {width}x{height} TIFF needs about {needed // 2**20} MB")
+            reduced = image.convert("RGB").reduce(factor)
+
+    if reduced.size != size:
+        reduced = reduced.resize(size, Image.LANCZOS)
+    save_jpeg(reduced, path)
+
+
+def make_thumbnail(jpeg_path: str, path: str, max_size: int) -> None:
+    with Image.open(jpeg_path) as image:
+        # Lets the JPEG decoder skip straight to a lower resolution
+        image.draft("RGB", (max_size, max_size))
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        save_jpeg(image, path)
+
+
+def image_dimensions(path: str) -> dict:
+    # Only reads the header
+    with Image.open(path) as image:
+        width, height = image.size
+    return {"width": width, "height": height}
+
+
+def make_derivatives(uuid: str, tiff_path: str, output_dir: str, jpeg_size: int, thumbnail_size: int, memory_budget: int) -> dict:
+    """Make whichever derivatives are missing or older than their source."""
+    jpeg_path = jpeg_file(output_dir, uuid)
+    if not is_up_to_date(jpeg_path, tiff_path):
+        make_jpeg(tiff_path, jpeg_path, jpeg_size, memory_budget)
+
+    thumbnail_path = thumbnail_file(output_dir, uuid)
+    if not is_up_to_date(thumbnail_path, jpeg_path):
+        make_thumbnail(jpeg_path, thumbnail_path, thumbnail_size)
+
+    return {"jpeg": image_dimensions(jpeg_path), "thumbnail": image_dimensions(thumbnail_path)}
+
+
+def read_derivatives(path: str = derivatives_file) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_derivatives(derivatives: dict, path: str = derivatives_file) -> None:
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(derivatives, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, path)
+
+
+def derive_all(
+    data_dir: str,
+    image_dir: str,
+    output_dir: str,
+    workers: int,
+    jpeg_size: int,
+    thumbnail_size: int,
+    memory_budget: int,
+    derivatives_file: str = derivatives_file,
+) -> list:
+    """Make the derivatives of every downloaded image, returning (uuid, error) pairs.
+
+    Their sizes go in derivatives_file, for 07_to_art_template.py.
+    """
+    os.makedirs(join(output_dir, "jpeg"), exist_ok=True)
+    os.makedirs(join(output_dir, "thumbnail"), exist_ok=True)
+
+    uuids = [
+        filename.removesuffix(".json")
+        for filename in sorted(os.listdir(data_dir))
+        if filename.endswith(".json") and os.path.exists(join(image_dir, filename.replace(".json", ".tif")))
+    ]
+    print(f"Checking derivatives of {len(uuids)} images", file=sys.stderr)
+
+    derivatives = {}
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_memory, initargs=(memory_budget,)) as executor:
+        futures = {
+            executor.submit(
+                make_derivatives,
+                uuid,
+                join(image_dir, f"{uuid}.tif"),
+                output_dir,
+                jpeg_size,
+                thumbnail_size,
+                memory_budget,
+            ): uuid
+            for uuid in uuids
+        }
+
+        for i, future in enumerate(as_completed(futures)):
+            uuid = futures[future]
+            try:
+                derivatives[uuid] = future.result()
+            except (OSError, ValueError, MemoryError) as e:
+                errors.append((uuid, f"{type(e).__name__}: {e}"))
+                print(i, uuid, "FAILED", file=sys.stderr)
+            else:
+                print(i, uuid, file=sys.stderr)
+
+    # Only what exists now, a failed image has no derivatives to speak of
+    write_derivatives(derivatives, derivatives_file)
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make upload JPEGs and thumbnails of the downloaded TIFFs.")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--image-dir", default=image_dir)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--derivatives-file", default=derivatives_file, help="Where to write their sizes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--jpeg-size", type=int, default=4000, help="Longest side of the upload JPEG, in pixels.")
+    parser.add_argument("--thumbnail-size", type=int, default=320, help="Longest side of the thumbnail, in pixels.")
+    parser.add_argument("--memory-mb", type=int, default=2048, help="Address space each worker may use.")
+    args = parser.parse_args()
+
+    errors = derive_all(
+        args.data_dir,
+        args.image_dir,
+        args.output_dir,
+        args.workers,
+        args.jpeg_size,
+        args.thumbnail_size,
+        args.memory_mb * 2**20,
+        args.derivatives_file,
+    )
+    for uuid, error in errors:
+        print(f"FAILED: {uuid}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} images failed")
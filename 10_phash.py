@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import sys
+from os.path import join
+
+from PIL import Image
+
+thumbnail_dir = "./data/derivatives/thumbnail/"
+hash_file = "./data/phashes.json"
+report_file = "./data/duplicates.json"
+
+# An 8x8 bit hash; each bit compares a pixel with its right neighbour, so one
+# extra column is read
+HASH_SIZE = 8
+# Bits two hashes may differ by and still count as the same image
+MAX_DISTANCE = 6
+
+
+def dhash(path: str) -> int:
+    """64 bit difference hash of an image, robust to scaling and recompression."""
+    with Image.open(path) as image:
+        image.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        # One byte per pixel in mode L
+        pixels = small.tobytes()
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            right = pixels[row * (HASH_SIZE + 1) + column + 1]
+            value = (value << 1) | (left > right)
+
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree, finds every hash within a Hamming distance.
+
+    Each child hangs off its parent by their distance, so by the triangle
+    inequality a search only has to follow children whose distance is within
+    max_distance of the query's distance to the parent.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item) -> None:
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, object]]:
+        """Return (distance, item) for everything within max_distance of value."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found += [(distance, item) for item in items]
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+        return sorted(found, key=lambda found_item: (found_item[0], str(found_item[1])))
+
+
+def read_hashes(hash_file: str) -> dict:
+    if not os.path.exists(hash_file):
+        return {}
+    with open(hash_file) as f:
+        return json.load(f)
+
+
+def hash_thumbnails(thumbnail_dir: str, hash_file: str) -> dict[str, int]:
+    """Hash every thumbnail, reusing the stored hash when it has not changed."""
+    stored = read_hashes(hash_file)
+    hashes = {}
+    for filename in sorted(os.listdir(thumbnail_dir)):
+        if not filename.endswith(".jpg"):
+            continue
+
+        uuid = filename.removesuffix(".jpg")
+        mtime = os.stat(join(thumbnail_dir, filename)).st_mtime_ns
+        entry = stored.get(uuid)
+        if entry is None or entry["mtime"] != mtime:
+            entry = {"hash": f"{dhash(join(thumbnail_dir, filename)):016x}", "mtime": mtime}
+        hashes[uuid] = entry
+
+    tmp_file = f"{hash_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, hash_file)
+
+    return {uuid: int(entry["hash"], 16) for uuid, entry in hashes.items()}
+
+
+def read_commons_hashes(path: str) -> list[tuple[int, str]]:
+    """Read "<16 hex digit dHash> <file name>" lines, hashed the same way as dhash()."""
+    commons = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                value, name = line.split(maxsplit=1)
+                commons.append((int(value, 16), name))
+
+    return commons
+
+
+def find_duplicates(hashes: dict[str, int], commons, max_distance: int) -> dict:
+    tree = BKTree()
+    for uuid, value in hashes.items():
+        tree.add(value, uuid)
+
+    # Each pair once, closest first
+    corpus = set()
+    for uuid, value in hashes.items():
+        for distance, other in tree.search(value, max_distance):
+            if other != uuid:
+                corpus.add((distance, *sorted((uuid, other))))
+
+    on_commons = [
+        (distance, uuid, name)
+        for value, name in commons
+        for distance, uuid in tree.search(value, max_distance)
+    ]
+
+    return {
+        "corpus": [[a, b, distance] for distance, a, b in sorted(corpus)],
+        "commons": [[uuid, name, distance] for distance, uuid, name in sorted(on_commons)],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate images by perceptual hash.")
+    parser.add_argument("--thumbnail-dir", default=thumbnail_dir)
+    parser.add_argument("--hash-file", default=hash_file)
+    parser.add_argument("--output", default=report_file)
+    parser.add_argument("--commons-hashes", help='File of "<hash> <file name>" lines for images already on Commons.')
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help="Differing bits still counted as a duplicate.")
+    args = parser.parse_args()
+
+    hashes = hash_thumbnails(args.thumbnail_dir, args.hash_file)
+    commons = read_commons_hashes(args.commons_hashes) if args.commons_hashes else []
+    duplicates = find_duplicates(hashes, commons, args.max_distance)
+
+    with open(args.output, "w") as f:
+        json.dump(duplicates, f, indent=2)
+
+    print(f"{len(hashes)} images, {len(commons)} Commons hashes", file=sys.stderr)
+    print(f"{len(duplicates['corpus'])} near-duplicate pairs in the corpus", file=sys.stderr)
+    print(f"{len(duplicates['commons'])} images already on Commons", file=sys.stderr)
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import join
+
+import requests
+
+from artwork import Artwork
+from throttle import Throttle, ThrottledSession, add_throttle_arguments, throttle_options
+
+data_dir = "./data/our_parsed_data/enriched/"
+pages_dir = "./data/wikitext/"
+image_dir = "./data/derivatives/jpeg/"
+journal_file = "./data/upload_journal.jsonl"
+duplicates_file = "./data/duplicates.json"
+
+API_URL = "https://commons.wikimedia.org/w/api.php"
+# Wikimedia asks every client to identify itself
+USER_AGENT = "nmk-hans-gude-upload/1.0 (python-requests)"
+IMAGE_EXTENSIONS = (".jpg", ".tif")
+COMMENT = "Hans Gude artwork from the Nasjonalmuseet for kunst, arkitektur og design"
+# Ask the servers to refuse edits while replication lags by more than this
+MAXLAG = 5
+# Used when a busy or rate limited answer does not say how long to wait
+DEFAULT_RETRY_AFTER = 5
+MAX_ATTEMPTS = 10
+TIMEOUT = (10, 300)
+
+# Characters MediaWiki does not allow in page titles
+TITLE_FORBIDDEN = re.compile(r"[#<>\[\]|{}/:]")
+# Where to look for a title when a record has no display title, in the order
+# 07_to_art_template.py picks the primary one
+TITLE_LANGUAGES = ("nor", "nob", "ger", "deu", "eng", "fra")
+TITLE_STATUSES = ("current", "original")
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, error: dict | None = None):
+        super().__init__(message)
+        # The API's error object, when there is one
+        self.error = error or {}
+
+
+class MediaWikiClient:
+    def __init__(self, api_url: str, workers: int, maxlag: int = MAXLAG, **throttle_kwargs):
+        self.api_url = api_url
+        self.maxlag = maxlag
+        self.csrf_token = None
+
+        # One cookie jar for the login. The throttle is shared by every upload
+        # thread, as maxlag and rate limits are about the whole wiki
+        self.throttle = Throttle(workers, name="commons", **throttle_kwargs)
+        self.session = ThrottledSession(self.throttle, timeout=TIMEOUT)
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def call(self, data: dict, files=None, idempotent: bool = True) -> dict:
+        """POST to the API, waiting out maxlag and rate limits.
+
+        The session already retries 429 answers, and timeouts and 5xx
+        answers too when the call is idempotent; these are the errors the API
+        reports in an otherwise good answer.
+        """
+        data = {**data, "format": "json", "maxlag": self.maxlag}
+        for _ in range(MAX_ATTEMPTS):
+            response = self.session.post(self.api_url, data=data, files=files, retry=idempotent)
+            response.raise_for_status()
+            retry_after = float(response.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+
+            result = response.json()
+            error = result.get("error")
+            if error is not None and error["code"] in ("maxlag", "ratelimited"):
+                self.throttle.pause(retry_after)
+                continue
+            if error is not None:
+                raise UploadError(f"{error['code']}: {error.get('info')}", error)
+
+            return result
+
+        raise UploadError(f"Still told to wait after {MAX_ATTEMPTS} attempts")
+
+    def login(self, username: str, password: str) -> None:
+        """Log in with a bot password and fetch the token uploads need."""
+        result = self.call({"action": "query", "meta": "tokens", "type": "login"})
+        login_token = result["query"]["tokens"]["logintoken"]
+
+        result = self.call({"action": "login", "lgname": username, "lgpassword": password, "lgtoken": login_token})
+        if result["login"]["result"] != "Success":
+            raise UploadError(f"Login failed: {result['login']}")
+
+        result = self.call({"action": "query", "meta": "tokens", "type": "csrf"})
+        self.csrf_token = result["query"]["tokens"]["csrftoken"]
+
+    def upload_chunk(self, filename: str, size: int, offset: int, chunk: bytes, filekey: str | None) -> dict:
+        data = {
+            "action": "upload",
+            "filename": filename,
+            "filesize": size,
+            "offset": offset,
+            "stash": 1,
+            # Warnings are checked when the stashed file is published
+            "ignorewarnings": 1,
+            "token": self.csrf_token,
+        }
+        if filekey is not None:
+            data["filekey"] = filekey
+
+        # Not retried blindly: the wiki may have stored a chunk we never heard
+        # back about. The job fails instead, and the next run picks the stash
+        # up again from the journal, at whatever offset the wiki says it got to
+        files = {"chunk": (filename, chunk, "application/octet-stream")}
+        return self.call(data, files=files, idempotent=False)["upload"]
+
+    def publish(self, filename: str, filekey: str, text: str, comment: str) -> dict:
+        data = {
+            "action": "upload",
+            "filename": filename,
+            "filekey": filekey,
+            "text": text,
+            "comment": comment,
+            "token": self.csrf_token,
+        }
+        return self.call(data, idempotent=False)["upload"]
+
+
+class Journal:
+    """Append-only JSONL log of upload progress, read back to resume a run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def read(self) -> dict:
+        """Return the last entry for every uuid, ignoring failures."""
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    # A line cut short by a crash is the only one that can be broken
+                    if not line.endswith("\n"):
+                        continue
+                    entry = json.loads(line)
+                    # A failure should not lose how far the stash had got
+                    if entry["status"] != "failed":
+                        entries[entry["uuid"]] = entry
+
+        return entries
+
+    def write(self, **entry) -> None:
+        with self.lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def file_title(artwork: Artwork) -> str:
+    """The display title, or else the first catalogued title."""
+    if artwork.display_title:
+        return artwork.display_title
+
+    titles = artwork.titles or {}
+    for language in (*TITLE_LANGUAGES, *sorted(titles)):
+        statuses = titles.get(language, {})
+        for status in (*TITLE_STATUSES, *sorted(statuses)):
+            if statuses.get(status):
+                return statuses[status][0]
+
+    raise UploadError(f"{artwork.uuid} has no title to name the file after")
+
+
+def commons_filename(artwork: Artwork, extension: str) -> str:
+    if not artwork.national_museum_norway_artwork_id:
+        raise UploadError(f"{artwork.uuid} has no accession number to name the file after")
+    title = TITLE_FORBIDDEN.sub("-", file_title(artwork))
+    accession_number = TITLE_FORBIDDEN.sub("-", artwork.national_museum_norway_artwork_id)
+    return f"Hans Gude - {title} - {accession_number}{extension}"
+
+
+def find_image(image_dir: str, uuid: str) -> str | None:
+    for extension in IMAGE_EXTENSIONS:
+        path = join(image_dir, f"{uuid}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_commons_duplicates(path: str) -> set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {uuid for uuid, _, _ in json.load(f)["commons"]}
+
+
+def load_jobs(data_dir: str, pages_dir: str, image_dir: str, skip: set[str]):
+    """Pair every rendered page with its image, as (uuid, filename, image, page) jobs."""
+    jobs = []
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json"):
+            continue
+
+        uuid = filename.removesuffix(".json")
+        page_path = join(pages_dir, f"{uuid}.wikitext")
+        image_path = find_image(image_dir, uuid)
+        if uuid in skip or image_path is None or not os.path.exists(page_path):
+            continue
+
+        with open(join(data_dir, filename)) as f:
+            artwork = Artwork.from_json(json.load(f))
+        extension = os.path.splitext(image_path)[1]
+        try:
+            upload_name = commons_filename(artwork, extension)
+        except UploadError as e:
+            print(f"Skipping {uuid}: {e}", file=sys.stderr)
+            continue
+        jobs.append((uuid, upload_name, image_path, page_path))
+
+    return jobs
+
+
+def upload_one(client: MediaWikiClient, journal: Journal, job, chunk_size: int, comment: str, resume: dict | None) -> None:
+    uuid, filename, image_path, page_path = job
+    size = os.path.getsize(image_path)
+    with open(page_path) as f:
+        text = f.read()
+
+    # Carry on with a stashed upload if the last run got part way
+    filekey = None
+    offset = 0
+    if resume is not None and resume["status"] == "stashing" and resume["size"] == size:
+        filekey = resume["filekey"]
+        offset = resume["offset"]
+
+    with open(image_path, "rb") as f:
+        while offset < size:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            try:
+                upload = client.upload_chunk(filename, size, offset, chunk, filekey)
+            except UploadError as e:
+                if filekey is None or resume is None:
+                    raise
+                if "offset" in e.error:
+                    # The wiki got a chunk the last run never heard back about
+                    offset = int(e.error["offset"])
+                else:
+                    # The stash expired since the last run, start from scratch
+                    filekey = None
+                    offset = 0
+                resume = None
+                continue
+
+            filekey = upload["filekey"]
+            offset = int(upload.get("offset", size))
+            journal.write(uuid=uuid, status="stashing", filename=filename, filekey=filekey, offset=offset, size=size)
+
+    upload = client.publish(filename, filekey, text, comment)
+    if upload["result"] != "Success":
+        raise UploadError(f"{upload['result']}: {upload.get('warnings')}")
+
+    journal.write(uuid=uuid, status="uploaded", filename=upload.get("filename", filename))
+
+
+def upload_all(client: MediaWikiClient, journal: Journal, jobs, workers: int, chunk_size: int, comment: str) -> list:
+    """Upload every job not uploaded yet, returning (uuid, error) pairs."""
+    done = journal.read()
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(upload_one, client, journal, job, chunk_size, comment, done.get(job[0])): job[0]
+            for job in jobs
+            if done.get(job[0], {}).get("status") != "uploaded"
+        }
+        print(f"Uploading {len(futures)} of {len(jobs)} files", file=sys.stderr)
+
+        for i, future in enumerate(as_completed(futures)):
+            uuid = futures[future]
+            try:
+                future.result()
+            except (requests.RequestException, UploadError, OSError) as e:
+                error = f"{type(e).__name__}: {e}"
+                journal.write(uuid=uuid, status="failed", error=error)
+                errors.append((uuid, error))
+                print(i, uuid, "FAILED", file=sys.stderr)
+            else:
+                print(i, uuid, file=sys.stderr)
+
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Upload every rendered page with its image to Commons.",
+        epilog="Log in with a bot password from the MEDIAWIKI_USER and MEDIAWIKI_PASSWORD environment variables.",
+    )
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--pages-dir", default=pages_dir, help="Pages from 07_to_art_template.py --output-dir.")
+    parser.add_argument("--image-dir", default=image_dir, help="Where to find <uuid>.jpg or <uuid>.tif.")
+    parser.add_argument("--journal", default=journal_file)
+    parser.add_argument("--api-url", default=API_URL, help="Upload somewhere else, e.g. a local test wiki.")
+    parser.add_argument("--workers", type=int, default=3, help="Files uploaded at the same time.")
+    parser.add_argument("--chunk-mb", type=float, default=5)
+    parser.add_argument("--maxlag", type=int, default=MAXLAG)
+    parser.add_argument("--comment", default=COMMENT)
+    parser.add_argument(
+        "--include-duplicates",
+        action="store_true",
+        help="Also upload images 10_phash.py found already on Commons.",
+    )
+    add_throttle_arguments(parser)
+    args = parser.parse_args()
+
+    username = os.environ.get("MEDIAWIKI_USER")
+    password = os.environ.get("MEDIAWIKI_PASSWORD")
+    if not username or not password:
+        sys.exit("Set MEDIAWIKI_USER and MEDIAWIKI_PASSWORD to a bot password first")
+
+    skip = set() if args.include_duplicates else read_commons_duplicates(duplicates_file)
+    jobs = load_jobs(args.data_dir, args.pages_dir, args.image_dir, skip)
+
+    client = MediaWikiClient(args.api_url, args.workers, args.maxlag, **throttle_options(args))
+    client.login(username, password)
+    errors = upload_all(client, Journal(args.journal), jobs, args.workers, int(args.chunk_mb * 2**20), args.comment)
+    for uuid, error in errors:
+        print(f"FAILED: {uuid}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} uploads failed")
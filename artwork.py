@@ -0,0 +1,300 @@
+"""Compact record model for a single artwork, shared by stages 05 to 07.
+
+Every class uses __slots__, so a record costs a fraction of the equivalent
+nest of dicts, and the small vocabularies that repeat across the corpus
+(languages, units, place types, techniques, ...) are interned so each
+distinct string is only stored once. from_json/to_json convert to and from
+the dicts that 05_mapping.py writes, losslessly.
+
+The raw source doc usually lives in raw_store.py and is only loaded the first
+time raw_data is accessed.
+"""
+from sys import intern
+
+import raw_store
+
+
+def intern_list(values):
+    return [intern(value) for value in values]
+
+
+def drop_none(data: dict) -> dict:
+    return {key: value for key, value in data.items() if value is not None}
+
+
+class Measurement:
+    __slots__ = ("height", "height_unit", "width", "width_unit", "depth", "depth_unit")
+
+    def __init__(self, height=None, height_unit=None, width=None, width_unit=None, depth=None, depth_unit=None):
+        self.height = height
+        self.height_unit = height_unit
+        self.width = width
+        self.width_unit = width_unit
+        self.depth = depth
+        self.depth_unit = depth_unit
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Measurement":
+        return cls(
+            height=data.get("height"),
+            height_unit=intern(data["height_unit"]) if "height_unit" in data else None,
+            width=data.get("width"),
+            width_unit=intern(data["width_unit"]) if "width_unit" in data else None,
+            depth=data.get("depth"),
+            depth_unit=intern(data["depth_unit"]) if "depth_unit" in data else None,
+        )
+
+    def to_json(self) -> dict:
+        return drop_none({slot: getattr(self, slot) for slot in self.__slots__})
+
+
+class PlaceName:
+    __slots__ = ("name", "level", "place_type")
+
+    def __init__(self, name: str, level: int, place_type: str):
+        self.name = name
+        self.level = level
+        self.place_type = place_type
+
+    @classmethod
+    def from_json(cls, data: dict) -> "PlaceName":
+        # Place names repeat a lot too; Norway alone shows up hundreds of times
+        return cls(intern(data["name"]), data["level"], intern(data["place_type"]))
+
+    def to_json(self) -> dict:
+        return {"name": self.name, "level": self.level, "place_type": self.place_type}
+
+
+def parse_coordinates(coordinates: str | None) -> tuple[float | None, float | None]:
+    """Split the museum's "lat, long" string into floats."""
+    if not coordinates:
+        return None, None
+    lat, long = coordinates.split(", ")
+    return float(lat), float(long)
+
+
+class Location:
+    __slots__ = ("human_name", "place_names", "coordinates", "place_accuracy", "latitude", "longitude")
+
+    def __init__(self, human_name: str, place_names: list[PlaceName], coordinates=None, place_accuracy=None):
+        self.human_name = human_name
+        self.place_names = place_names
+        self.coordinates = coordinates
+        self.place_accuracy = place_accuracy
+        # Parsed once, here, for every stage that needs numbers; only the
+        # string is written out
+        self.latitude, self.longitude = parse_coordinates(coordinates)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Location":
+        place_accuracy = data.get("place_accuracy")
+        return cls(
+            human_name=data["human_name"],
+            place_names=[PlaceName.from_json(place_name) for place_name in data["place_names"]],
+            coordinates=data.get("coordinates"),
+            place_accuracy=intern(place_accuracy) if place_accuracy is not None else None,
+        )
+
+    def to_json(self) -> dict:
+        return drop_none(
+            {
+                "human_name": self.human_name,
+                "place_names": [place_name.to_json() for place_name in self.place_names],
+                "coordinates": self.coordinates,
+                "place_accuracy": self.place_accuracy,
+            }
+        )
+
+
+class Picture:
+    __slots__ = ("index", "width", "height", "direct_image_link", "photographer", "extra")
+
+    def __init__(self, index, width, height, direct_image_link, photographer=None, extra=None):
+        self.index = index
+        self.width = width
+        self.height = height
+        self.direct_image_link = direct_image_link
+        self.photographer = photographer
+        # Anything else the museum sends along with the picture
+        self.extra = extra if extra is not None else {}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Picture":
+        extra = dict(data)
+        return cls(
+            index=extra.pop("index"),
+            width=extra.pop("width"),
+            height=extra.pop("height"),
+            direct_image_link=extra.pop("direct_image_link"),
+            photographer=extra.pop("photographer", None),
+            extra=extra,
+        )
+
+    def to_json(self) -> dict:
+        output = {
+            "index": self.index,
+            "width": self.width,
+            "height": self.height,
+            "direct_image_link": self.direct_image_link,
+        }
+        if self.photographer is not None:
+            output["photographer"] = self.photographer
+        output.update(self.extra)
+
+        return output
+
+
+class CreationDate:
+    """The output of 06_further_enrich.get_creation_date().
+
+    A range_of_dates of None means the date could not be worked out, which
+    is stored as null in the JSON.
+    """
+
+    __slots__ = ("range_of_dates", "created_at_date", "created_at_date_start", "created_at_date_end")
+
+    def __init__(self, range_of_dates=None, created_at_date=None, created_at_date_start=None, created_at_date_end=None):
+        self.range_of_dates = range_of_dates
+        self.created_at_date = created_at_date
+        self.created_at_date_start = created_at_date_start
+        self.created_at_date_end = created_at_date_end
+
+    @classmethod
+    def from_json(cls, data: dict | None) -> "CreationDate":
+        if data is None:
+            return cls()
+        return cls(**data)
+
+    def to_json(self) -> dict | None:
+        if self.range_of_dates is None:
+            return None
+        return drop_none({slot: getattr(self, slot) for slot in self.__slots__})
+
+
+# Plain values copied straight across; the rest need converting
+SIMPLE_FIELDS = (
+    "national_museum_norway_artwork_id",
+    "uuid",
+    "digitalt_museum_id",
+    "digitalt_museum_link",
+    "nasjonalmuseet_link",
+    "digital_item_created_at",
+    "acquistion_notes",
+    "descriptive_date",
+    "from_date",
+    "to_date",
+    "display_title",
+    "material_comment",
+    # Set by 05_mapping.py --hierarchy for sketchbooks and their pages
+    "part_of",
+    "child_uuids",
+)
+VOCABULARY_FIELDS = ("subjects", "techniques", "materials")
+RAW_DATA_KEY = "zzz_raw_data"
+RAW_DATA_REF_KEY = "zzz_raw_data_ref"
+
+
+class Artwork:
+    __slots__ = SIMPLE_FIELDS + VOCABULARY_FIELDS + (
+        "measurements",
+        "titles",
+        "locations",
+        "picture",
+        "creation_date",
+        "raw_data_ref",
+        "_raw_data",
+        "extra",
+    )
+
+    def __init__(self, raw_data=None, **fields):
+        for slot in self.__slots__:
+            setattr(self, slot, fields.get(slot))
+        self._raw_data = raw_data
+        if self.extra is None:
+            self.extra = {}
+
+    @property
+    def raw_data(self):
+        # Most stages never look at the raw doc, so only load it when asked
+        if self._raw_data is None and self.raw_data_ref is not None:
+            self._raw_data = raw_store.get(self.raw_data_ref)
+        return self._raw_data
+
+    @raw_data.setter
+    def raw_data(self, raw_data) -> None:
+        self._raw_data = raw_data
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Artwork":
+        data = dict(data)
+        artwork = cls(**{field: data.pop(field, None) for field in SIMPLE_FIELDS})
+
+        for field in VOCABULARY_FIELDS:
+            values = data.pop(field, None)
+            if values is not None:
+                setattr(artwork, field, intern_list(values))
+
+        measurements = data.pop("measurements", None)
+        if measurements is not None:
+            artwork.measurements = {
+                intern(kind): Measurement.from_json(measurement) for kind, measurement in measurements.items()
+            }
+
+        titles = data.pop("titles", None)
+        if titles is not None:
+            artwork.titles = {
+                intern(language): {intern(status): list(values) for status, values in statuses.items()}
+                for language, statuses in titles.items()
+            }
+
+        locations = data.pop("locations", None)
+        if locations is not None:
+            artwork.locations = {
+                intern(role): [Location.from_json(location) for location in role_locations]
+                for role, role_locations in locations.items()
+            }
+
+        picture = data.pop("picture", None)
+        if picture is not None:
+            artwork.picture = Picture.from_json(picture)
+
+        # Only present once 06_further_enrich.py has run, but may then be null
+        if "creation_date" in data:
+            artwork.creation_date = CreationDate.from_json(data.pop("creation_date"))
+
+        # Older files embed the raw doc instead of referencing the store
+        artwork.raw_data = data.pop(RAW_DATA_KEY, None)
+        artwork.raw_data_ref = data.pop(RAW_DATA_REF_KEY, None)
+        artwork.extra = data
+
+        return artwork
+
+    def to_json(self, resolve_raw: bool = False) -> dict:
+        """Convert back to a dict, embedding the raw doc only if resolve_raw."""
+        output = {}
+        for field in SIMPLE_FIELDS + VOCABULARY_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                output[field] = value
+
+        if self.measurements is not None:
+            output["measurements"] = {kind: measurement.to_json() for kind, measurement in self.measurements.items()}
+        if self.titles is not None:
+            output["titles"] = self.titles
+        if self.locations is not None:
+            output["locations"] = {
+                role: [location.to_json() for location in role_locations]
+                for role, role_locations in self.locations.items()
+            }
+        if self.picture is not None:
+            output["picture"] = self.picture.to_json()
+        if self.creation_date is not None:
+            output["creation_date"] = self.creation_date.to_json()
+
+        output.update(self.extra)
+        if self.raw_data_ref is not None and not resolve_raw:
+            output[RAW_DATA_REF_KEY] = self.raw_data_ref
+        elif self.raw_data is not None:
+            output[RAW_DATA_KEY] = self.raw_data
+
+        return output
@@ -0,0 +1,136 @@
+"""Compare fast_dates.py with the strptime based date handling it replaced.
+
+Checks that every date in the corpus gives exactly the same result both ways,
+then times them. Run from the repository root:
+
+    python benchmarks/bench_dates.py
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_dates
+from artwork import Artwork
+
+further_enrich = importlib.import_module("06_further_enrich")
+
+data_dir = "./data/our_parsed_data/enriched/"
+
+
+def load_dates(data_dir: str):
+    timestamps = []
+    creation_inputs = []
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(data_dir, filename)) as f:
+            artwork = Artwork.from_json(json.load(f))
+
+        uuid_json = artwork.raw_data["uuid_json"]
+        timestamps.append(uuid_json["createdDate"])
+        for event in uuid_json["eventWrap"].get("events", []):
+            timespan = event.get("timespan", {})
+            timestamps += [timespan[key] for key in ("fromDate", "toDate") if key in timespan]
+
+        creation_inputs.append((artwork.from_date, artwork.to_date, artwork.descriptive_date))
+
+    return timestamps, creation_inputs
+
+
+def strptime_timestamp(date_str: str) -> datetime:
+    return datetime.strptime(date_str, fast_dates.DIMU_FORMAT)
+
+
+def strptime_iso_date(date_str: str) -> datetime:
+    return datetime.strptime(date_str, fast_dates.ISO_DATE_FORMAT)
+
+
+def reference_creation_dates(creation_inputs):
+    """get_creation_date() as it was, calling strptime for every record."""
+    further_enrich.parse_iso_date = strptime_iso_date
+    try:
+        return [further_enrich.get_creation_date(*inputs) for inputs in creation_inputs]
+    finally:
+        further_enrich.parse_iso_date = fast_dates.parse_iso_date
+
+
+def per_record_creation_dates(creation_inputs):
+    return [further_enrich.get_creation_date(*inputs) for inputs in creation_inputs]
+
+
+def batch_creation_dates(creation_inputs):
+    from_dates, to_dates, descriptive_dates = zip(*creation_inputs)
+    return fast_dates.classify_creation_dates(
+        from_dates, to_dates, descriptive_dates, further_enrich.get_creation_date
+    )
+
+
+def best_time(function, repeat: int, number: int) -> float:
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+
+    timestamps, creation_inputs = load_dates(args.data_dir)
+
+    if [strptime_timestamp(t) for t in timestamps] != [fast_dates.parse_dimu_timestamp(t) for t in timestamps]:
+        sys.exit("parse_dimu_timestamp does not match strptime")
+    reference = reference_creation_dates(creation_inputs)
+    if per_record_creation_dates(creation_inputs) != reference:
+        sys.exit("get_creation_date with parse_iso_date does not match strptime")
+    if batch_creation_dates(creation_inputs) != reference:
+        sys.exit("classify_creation_dates does not match get_creation_date")
+
+    print(f"{len(timestamps)} timestamps ({len(set(timestamps))} distinct), {len(creation_inputs)} records")
+    print(f"numpy batch path: {'yes' if fast_dates.np is not None else 'no, not installed'}")
+
+    def cold_timestamps():
+        # Clear the memo first so this measures parsing, not just lookups
+        fast_dates.parse_dimu_timestamp.cache_clear()
+        return [fast_dates.parse_dimu_timestamp(t) for t in timestamps]
+
+    def cold_per_record():
+        fast_dates.parse_iso_date.cache_clear()
+        return per_record_creation_dates(creation_inputs)
+
+    def cold_batch():
+        fast_dates.parse_iso_date.cache_clear()
+        return batch_creation_dates(creation_inputs)
+
+    groups = (
+        (
+            "dimu timestamps",
+            (
+                ("strptime", lambda: [strptime_timestamp(t) for t in timestamps]),
+                ("sliced", cold_timestamps),
+                ("memoized", lambda: [fast_dates.parse_dimu_timestamp(t) for t in timestamps]),
+            ),
+        ),
+        (
+            "creation dates",
+            (
+                ("strptime", lambda: reference_creation_dates(creation_inputs)),
+                ("sliced", cold_per_record),
+                ("memoized", lambda: per_record_creation_dates(creation_inputs)),
+                ("batch", cold_batch),
+            ),
+        ),
+    )
+    for group, functions in groups:
+        print(group)
+        baseline = None
+        for name, function in functions:
+            best = best_time(function, args.repeat, args.number)
+            baseline = baseline or best
+            print(f"  {name:>10}: {best * 1e3:8.3f} ms  {baseline / best:6.2f}x")
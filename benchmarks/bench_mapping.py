@@ -0,0 +1,69 @@
+"""Compare the compiled mapping extractor in 05_mapping.py with unpack().
+
+Run from the repository root:
+
+    python benchmarks/bench_mapping.py
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artwork import Artwork
+
+mapping_module = importlib.import_module("05_mapping")
+
+# The uuid_json of every doc is only kept around as the parsed records' raw data
+data_dir = "./data/our_parsed_data/raw/"
+
+
+def load_docs(data_dir: str):
+    docs = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(data_dir, filename)) as f:
+                docs.append(Artwork.from_json(json.load(f)).raw_data)
+
+    return docs
+
+
+def unpack_all(docs):
+    paths_list = list(mapping_module.mapping)
+    return [[mapping_module.unpack(doc, paths) for paths in paths_list] for doc in docs]
+
+
+def compiled_all(docs):
+    extract = mapping_module.extract_fields
+    return [extract(doc) for doc in docs]
+
+
+def compiled_batch(docs):
+    return mapping_module.extract_batch(mapping_module.extract_fields, docs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+
+    docs = load_docs(args.data_dir)
+    if unpack_all(docs) != compiled_all(docs):
+        sys.exit("Compiled extractor does not match unpack()")
+
+    print(f"{len(docs)} docs, {len(mapping_module.mapping)} fields, best of {args.repeat}")
+    baseline = None
+    for name, function in (
+        ("unpack loop", unpack_all),
+        ("compiled", compiled_all),
+        ("compiled batch", compiled_batch),
+    ):
+        best = min(timeit.repeat(lambda: function(docs), repeat=args.repeat, number=args.number)) / args.number
+        baseline = baseline or best
+        per_doc = best / len(docs) * 1e6
+        print(f"{name:>15}: {best * 1e3:8.2f} ms  {per_doc:6.2f} us/doc  {baseline / best:5.2f}x")
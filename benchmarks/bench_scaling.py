@@ -0,0 +1,245 @@
+"""Time and memory-profile the stages on synthetic corpora of growing size.
+
+For each size a corpus is generated once, see synthetic_corpus.py, and run
+through the functions the numbered scripts use. Each reads its input from
+disk and writes its output there, like the script does:
+
+    combine         02_combiner.iter_docs over the Solr pages
+    combine_whole   02_combiner.combine, the whole corpus as one document
+    enrich          03_enrich.enrich_doc on every doc, joined with its uuid_json
+    map             05_mapping.map_doc and write_doc_data, raw docs into the raw store
+    further_enrich  06_further_enrich.enrich_records, --batch-size records at a time
+    render          07_to_art_template.render_file into a bundle
+
+Every function runs once for wall and CPU time and once more under
+tracemalloc for its peak Python memory. Results are saved in
+benchmarks/results/ and compared with the last saved run of the same size,
+so a stage that got slower per record or needs more memory stands out.
+Run from the repository root:
+
+    python benchmarks/bench_scaling.py
+    python benchmarks/bench_scaling.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from glob import glob
+from itertools import islice
+from os.path import join
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrument
+from artwork import Artwork
+from jsonl import read_jsonl
+from synthetic_corpus import corpus_exists, load_templates, read_response_header, write_corpus
+
+combiner = importlib.import_module("02_combiner")
+enrich = importlib.import_module("03_enrich")
+mapping = importlib.import_module("05_mapping")
+further_enrich = importlib.import_module("06_further_enrich")
+to_art_template = importlib.import_module("07_to_art_template")
+
+data_dir = "./data/our_parsed_data/raw/"
+raw_json_dir = "./data/raw_json/"
+corpus_dir = "./benchmarks/corpus/"
+results_dir = "./benchmarks/results/"
+
+SIZES = (1_000, 10_000)
+# combine_whole holds every doc at once, which does not fit in memory for long
+WHOLE_LIMIT = 100_000
+BATCH_SIZE = 10_000
+# Flag a stage that takes this much longer per record than last time
+SLOWER = 1.2
+
+
+def fresh_dir(path: str) -> str:
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def fetched_docs():
+    """The 04_wgeter.py output: every Solr doc enriched and with its uuid_json."""
+    for doc, uuid_json in zip(combiner.iter_docs("raw_json"), read_jsonl("uuid_json.jsonl")):
+        doc = enrich.enrich_doc(doc)
+        doc["uuid_json"] = uuid_json
+        yield doc
+
+
+def bench_combine(timer) -> None:
+    for _ in timer.count(combiner.iter_docs("raw_json")):
+        pass
+
+
+def bench_combine_whole(timer) -> None:
+    timer.records = len(combiner.combine("raw_json")["response"]["docs"])
+
+
+def bench_enrich(timer) -> None:
+    for _ in timer.count(fetched_docs()):
+        pass
+
+
+def bench_map(timer) -> None:
+    fresh_dir("data/raw_store")
+    output_dir = fresh_dir("records")
+    for doc in timer.count(fetched_docs()):
+        mapping.write_doc_data(mapping.map_doc(doc), output_dir)
+
+
+def record_paths(directory: str) -> list[str]:
+    return sorted(glob(join(directory, "*.json")))
+
+
+def bench_further_enrich(timer, batch_size: int) -> None:
+    output_dir = fresh_dir("enriched")
+    paths = iter(record_paths("records"))
+    while batch := list(islice(paths, batch_size)):
+        artworks = []
+        for path in batch:
+            with open(path) as f:
+                artworks.append(Artwork.from_json(json.load(f)))
+
+        for artwork in further_enrich.enrich_records(artworks):
+            with open(join(output_dir, f"{artwork.uuid}.json"), "w") as f:
+                f.write(json.dumps(artwork.to_json(), indent=2, sort_keys=True))
+        timer.records += len(artworks)
+
+
+def bench_render(timer) -> None:
+    pages = (to_art_template.render_file(path) for path in record_paths("enriched"))
+    to_art_template.write_bundle(timer.count(pages), "pages.wikitext")
+
+
+def run_bench(name: str, function, memory: bool) -> dict:
+    with instrument.stage(name) as timer:
+        function(timer)
+    result = timer.to_json()
+    del result["name"]
+
+    if memory:
+        # A second run, as tracing slows everything down a lot
+        tracemalloc.start()
+        function(instrument.StageTimer(name))
+        result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+
+    return result
+
+
+def run_size(n: int, templates, response_header, batch_size: int, whole_limit: int, memory: bool) -> dict:
+    size_dir = join(corpus_dir, str(n))
+    if not corpus_exists(size_dir):
+        start = time.perf_counter()
+        write_corpus(size_dir, templates, n, response_header)
+        print(f"Generated {n} records in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    benches = [("combine", bench_combine)]
+    if n <= whole_limit:
+        benches.append(("combine_whole", bench_combine_whole))
+    benches += [
+        ("enrich", bench_enrich),
+        ("map", bench_map),
+        ("further_enrich", lambda timer: bench_further_enrich(timer, batch_size)),
+        ("render", bench_render),
+    ]
+
+    # Stages write wherever the scripts would, which is now inside the corpus
+    cwd = os.getcwd()
+    os.chdir(size_dir)
+    try:
+        results = {}
+        for name, function in benches:
+            results[name] = run_bench(name, function, memory)
+            print(n, name, results[name], file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(results_dir: str, n: int) -> tuple[str, dict] | None:
+    """The newest saved run that has this size."""
+    for path in sorted(glob(join(results_dir, "*.json")), reverse=True):
+        with open(path) as f:
+            saved = json.load(f)
+        if str(n) in saved["sizes"]:
+            return os.path.basename(path), saved["sizes"][str(n)]
+    return None
+
+
+def per_record(result: dict) -> float | None:
+    return result["wall_s"] / result["records"] if result["records"] else None
+
+
+def compare(n: int, results: dict, previous) -> None:
+    if previous is None:
+        print(f"{n} records, nothing saved to compare with")
+    else:
+        print(f"{n} records, compared with {previous[0]}")
+
+    for name, result in results.items():
+        line = f"  {name:>15}: {result['wall_s']:9.3f} s  {result['records_per_s'] or 0:10.0f} records/s"
+        if "peak_mb" in result:
+            line += f"  {result['peak_mb']:8.1f} MB"
+
+        before = previous[1].get(name) if previous is not None else None
+        if before is not None and per_record(before) and per_record(result):
+            ratio = per_record(result) / per_record(before)
+            line += f"  {ratio:5.2f}x time"
+            if "peak_mb" in result and before.get("peak_mb"):
+                line += f"  {result['peak_mb'] / before['peak_mb']:5.2f}x memory"
+            if ratio > SLOWER:
+                line += "  SLOWER"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--data-dir", default=data_dir, help="Real records to copy.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Records per enrich_records call.")
+    parser.add_argument("--whole-limit", type=int, default=WHOLE_LIMIT, help="Largest size to run combine_whole on.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc runs.")
+    parser.add_argument("--no-save", action="store_true", help="Only compare, do not save the results.")
+    args = parser.parse_args()
+
+    templates = load_templates(raw_json_dir, args.data_dir)
+    response_header = read_response_header(raw_json_dir)
+
+    saved = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "batch_size": args.batch_size,
+        "sizes": {},
+    }
+    for n in args.sizes:
+        results = run_size(n, templates, response_header, args.batch_size, args.whole_limit, not args.no_memory)
+        compare(n, results, previous_results(results_dir, n))
+        saved["sizes"][str(n)] = results
+
+    if not args.no_save:
+        os.makedirs(results_dir, exist_ok=True)
+        path = join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{saved['commit'] or 'nocommit'}.json")
+        with open(path, "w") as f:
+            json.dump(saved, f, indent=2)
+        print(f"Saved {path}")
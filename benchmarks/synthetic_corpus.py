@@ -0,0 +1,140 @@
+"""Generate a synthetic corpus of any size, shaped like the real one.
+
+Every synthetic record is a copy of one of the real records with its own
+uuid, identifier, DigitaltMuseum id and creation timestamp, so the stages
+see exactly the shapes and values they meet in the real data. Solr pages go
+in raw_json/ like 01_nmk.py writes them, and the uuid_json of every doc goes
+in uuid_json.jsonl, one per line in the same order as the pages.
+
+    python benchmarks/synthetic_corpus.py 100000 --output-dir benchmarks/corpus/100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import uuid as uuid_module
+from datetime import timedelta
+from os.path import join
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artwork import Artwork
+from fast_dates import parse_dimu_timestamp
+
+# The uuid_json of every doc is only kept around as the parsed records' raw data
+data_dir = "./data/our_parsed_data/raw/"
+raw_json_dir = "./data/raw_json/"
+
+# Bigger than 01_nmk.py's pages, so a million records is not a million files
+PAGE_SIZE = 1000
+
+
+def load_templates(raw_json_dir: str, data_dir: str) -> list[tuple]:
+    """Return (solr doc JSON, uuid_json JSON, uuid, identifier, unique id, created) per real record."""
+    uuid_jsons = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".json"):
+            with open(join(data_dir, filename)) as f:
+                doc = Artwork.from_json(json.load(f)).raw_data
+            uuid_jsons[doc["artifact.uuid"]] = doc["uuid_json"]
+
+    # The Solr docs come from the pages, as 05_mapping.py changes some fields in place
+    templates = []
+    for filename in sorted(os.listdir(raw_json_dir)):
+        if not filename.endswith(".json"):
+            continue
+        with open(join(raw_json_dir, filename)) as f:
+            docs = json.load(f)["response"]["docs"]
+
+        for doc in docs:
+            uuid_json = uuid_jsons.get(doc["artifact.uuid"])
+            if uuid_json is None:
+                continue
+            templates.append(
+                (
+                    json.dumps(doc, sort_keys=True),
+                    json.dumps(uuid_json, sort_keys=True),
+                    doc["artifact.uuid"],
+                    json.dumps(doc["identifier.id"])[1:-1],
+                    doc["artifact.uniqueId"],
+                    uuid_json.get("createdDate"),
+                )
+            )
+
+    return templates
+
+
+def synthetic_docs(templates, n: int, seed: int = 0):
+    """Yield (solr doc JSON, uuid_json JSON) for n records, the same ones for the same seed."""
+    rng = random.Random(seed)
+    for i in range(n):
+        solr_json, uuid_json, uuid, identifier, unique_id, created = templates[i % len(templates)]
+        new_uuid = str(uuid_module.UUID(int=rng.getrandbits(128), version=4)).upper()
+        new_identifier = f"{identifier}-S{i}"
+        new_unique_id = f"9{i:011d}"
+
+        replacements = [(uuid, new_uuid), (identifier, new_identifier), (unique_id, new_unique_id)]
+        if created is not None:
+            # Real records were digitised one by one, so no two share a timestamp
+            new_created = parse_dimu_timestamp(created) + timedelta(seconds=i)
+            fraction = created.rsplit("-", 1)[1]
+            replacements.append((created, new_created.strftime("%Y%m%d-%H%M%S-") + fraction))
+
+        for old, new in replacements:
+            solr_json = solr_json.replace(old, new)
+            uuid_json = uuid_json.replace(old, new)
+
+        yield solr_json, uuid_json
+
+
+def read_response_header(raw_json_dir: str) -> dict:
+    with open(join(raw_json_dir, sorted(os.listdir(raw_json_dir))[0])) as f:
+        return json.load(f)["responseHeader"]
+
+
+def write_corpus(output_dir: str, templates, n: int, response_header: dict, page_size: int = PAGE_SIZE, seed: int = 0) -> None:
+    """Write the Solr pages and uuid_json.jsonl, never holding more than a page."""
+    pages_dir = join(output_dir, "raw_json")
+    os.makedirs(pages_dir, exist_ok=True)
+    header = json.dumps(response_header)
+
+    docs = synthetic_docs(templates, n, seed)
+    uuid_json_path = join(output_dir, "uuid_json.jsonl")
+    with open(f"{uuid_json_path}.tmp", "w") as uuid_json_file:
+        for page, start in enumerate(range(0, n, page_size)):
+            solr_docs = []
+            for _ in range(min(page_size, n - start)):
+                solr_json, uuid_json = next(docs)
+                solr_docs.append(solr_json)
+                uuid_json_file.write(uuid_json + "\n")
+
+            # The docs are JSON already, so only the envelope is built here
+            with open(join(pages_dir, f"{page:05}.json"), "w") as f:
+                f.write(
+                    f'{{"responseHeader": {header}, "response": {{"numFound": {n}, "start": {start}, "docs": [\n'
+                    + ",\n".join(solr_docs)
+                    + "\n]}}\n"
+                )
+
+    # Only now is the corpus complete, see corpus_exists()
+    os.replace(f"{uuid_json_path}.tmp", uuid_json_path)
+
+
+def corpus_exists(output_dir: str) -> bool:
+    return os.path.exists(join(output_dir, "uuid_json.jsonl"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("n", type=int, help="Number of records.")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--raw-json-dir", default=raw_json_dir)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    templates = load_templates(args.raw_json_dir, args.data_dir)
+    write_corpus(args.output_dir, templates, args.n, read_response_header(args.raw_json_dir), args.page_size, args.seed)
+    print(f"Wrote {args.n} records from {len(templates)} templates to {args.output_dir}", file=sys.stderr)
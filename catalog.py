@@ -0,0 +1,282 @@
+"""Queryable SQLite catalog of the enriched artworks.
+
+Build it from the output of 06_further_enrich.py, then ask questions without
+reading every file again:
+
+    python catalog.py build
+    python catalog.py query --technique oil --material canvas --place Sogn --measurement frame
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+from artwork import Artwork
+
+data_dir = "./data/our_parsed_data/enriched/"
+db_file = "./data/catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE artworks (
+    uuid TEXT PRIMARY KEY,
+    national_museum_norway_artwork_id TEXT,
+    digitalt_museum_id TEXT,
+    display_title TEXT,
+    descriptive_date TEXT,
+    from_date TEXT,
+    to_date TEXT,
+    range_of_dates INTEGER,
+    created_at_date TEXT,
+    created_at_date_start TEXT,
+    created_at_date_end TEXT,
+    acquistion_notes TEXT,
+    material_comment TEXT,
+    nasjonalmuseet_link TEXT,
+    digitalt_museum_link TEXT,
+    picture_index INTEGER,
+    picture_width INTEGER,
+    picture_height INTEGER,
+    direct_image_link TEXT,
+    photographer TEXT
+);
+CREATE TABLE titles (
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    language TEXT NOT NULL,
+    status TEXT NOT NULL,
+    title TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE techniques (
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    position INTEGER NOT NULL,
+    technique TEXT NOT NULL
+);
+CREATE TABLE materials (
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    position INTEGER NOT NULL,
+    material TEXT NOT NULL
+);
+CREATE TABLE subjects (
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    subject TEXT NOT NULL
+);
+CREATE TABLE measurements (
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    kind TEXT NOT NULL,
+    height REAL,
+    height_unit TEXT,
+    width REAL,
+    width_unit TEXT,
+    depth REAL,
+    depth_unit TEXT
+);
+CREATE TABLE locations (
+    id INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL REFERENCES artworks (uuid),
+    role TEXT NOT NULL,
+    human_name TEXT,
+    latitude REAL,
+    longitude REAL,
+    place_accuracy TEXT
+);
+CREATE TABLE place_names (
+    location_id INTEGER NOT NULL REFERENCES locations (id),
+    level INTEGER,
+    place_type TEXT,
+    name TEXT NOT NULL COLLATE NOCASE
+);
+
+CREATE INDEX titles_uuid ON titles (uuid);
+CREATE INDEX titles_title ON titles (title);
+CREATE INDEX techniques_technique ON techniques (technique, uuid);
+CREATE INDEX materials_material ON materials (material, uuid);
+CREATE INDEX subjects_subject ON subjects (subject, uuid);
+CREATE INDEX measurements_kind ON measurements (kind, uuid);
+CREATE INDEX locations_uuid ON locations (uuid, role);
+CREATE INDEX place_names_name ON place_names (name);
+CREATE INDEX place_names_location ON place_names (location_id);
+"""
+
+
+def insert_artwork(db: sqlite3.Connection, artwork: Artwork) -> None:
+    uuid = artwork.uuid
+    creation_date = artwork.creation_date
+    has_date = creation_date is not None and creation_date.range_of_dates is not None
+    picture = artwork.picture
+
+    db.execute(
+        "INSERT INTO artworks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            uuid,
+            artwork.national_museum_norway_artwork_id,
+            artwork.digitalt_museum_id,
+            artwork.display_title,
+            artwork.descriptive_date,
+            artwork.from_date,
+            artwork.to_date,
+            creation_date.range_of_dates if has_date else None,
+            creation_date.created_at_date if has_date else None,
+            creation_date.created_at_date_start if has_date else None,
+            creation_date.created_at_date_end if has_date else None,
+            artwork.acquistion_notes,
+            artwork.material_comment,
+            artwork.nasjonalmuseet_link,
+            artwork.digitalt_museum_link,
+            picture.index if picture else None,
+            picture.width if picture else None,
+            picture.height if picture else None,
+            picture.direct_image_link if picture else None,
+            picture.photographer if picture else None,
+        ),
+    )
+
+    db.executemany(
+        "INSERT INTO titles VALUES (?, ?, ?, ?)",
+        [
+            (uuid, language, status, title)
+            for language, statuses in (artwork.titles or {}).items()
+            for status, titles in statuses.items()
+            for title in titles
+        ],
+    )
+    db.executemany(
+        "INSERT INTO techniques VALUES (?, ?, ?)",
+        [(uuid, position, technique) for position, technique in enumerate(artwork.techniques or [])],
+    )
+    db.executemany(
+        "INSERT INTO materials VALUES (?, ?, ?)",
+        [(uuid, position, material) for position, material in enumerate(artwork.materials or [])],
+    )
+    db.executemany(
+        "INSERT INTO subjects VALUES (?, ?)",
+        [(uuid, subject) for subject in artwork.subjects or []],
+    )
+    db.executemany(
+        "INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (uuid, kind, m.height, m.height_unit, m.width, m.width_unit, m.depth, m.depth_unit)
+            for kind, m in (artwork.measurements or {}).items()
+        ],
+    )
+
+    for role, locations in (artwork.locations or {}).items():
+        for location in locations:
+            cursor = db.execute(
+                "INSERT INTO locations (uuid, role, human_name, latitude, longitude, place_accuracy) VALUES (?, ?, ?, ?, ?, ?)",
+                (uuid, role, location.human_name, location.latitude, location.longitude, location.place_accuracy),
+            )
+            db.executemany(
+                "INSERT INTO place_names VALUES (?, ?, ?, ?)",
+                [
+                    (cursor.lastrowid, place_name.level, place_name.place_type, place_name.name)
+                    for place_name in location.place_names
+                ],
+            )
+
+
+def build_catalog(data_dir: str = data_dir, db_file: str = db_file) -> int:
+    """Rebuild the catalog from scratch, returning the number of artworks."""
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    db = sqlite3.connect(db_file)
+    db.executescript(SCHEMA)
+
+    n = 0
+    with db:
+        for filename in sorted(os.listdir(data_dir)):
+            if filename.endswith(".json"):
+                with open(os.path.join(data_dir, filename)) as f:
+                    insert_artwork(db, Artwork.from_json(json.load(f)))
+                n += 1
+
+    db.execute("ANALYZE")
+    db.close()
+
+    return n
+
+
+def find_artworks(
+    db: sqlite3.Connection,
+    technique: str | None = None,
+    material: str | None = None,
+    subject: str | None = None,
+    place: str | None = None,
+    measurement: str | None = None,
+    title: str | None = None,
+) -> list[sqlite3.Row]:
+    """Return the artworks matching every given filter.
+
+    technique, material, subject and measurement (e.g. "frame") must match
+    exactly. place matches the start of any depicted place name and title the
+    start of any title, both ignoring case, so "Sogn" finds "Sognefjorden".
+    """
+    conditions = []
+    params = []
+
+    if technique is not None:
+        conditions.append("EXISTS (SELECT 1 FROM techniques t WHERE t.uuid = a.uuid AND t.technique = ?)")
+        params.append(technique)
+    if material is not None:
+        conditions.append("EXISTS (SELECT 1 FROM materials m WHERE m.uuid = a.uuid AND m.material = ?)")
+        params.append(material)
+    if subject is not None:
+        conditions.append("EXISTS (SELECT 1 FROM subjects s WHERE s.uuid = a.uuid AND s.subject = ?)")
+        params.append(subject)
+    if measurement is not None:
+        conditions.append("EXISTS (SELECT 1 FROM measurements me WHERE me.uuid = a.uuid AND me.kind = ?)")
+        params.append(measurement)
+    if place is not None:
+        conditions.append(
+            "a.uuid IN ("
+            "SELECT l.uuid FROM place_names p JOIN locations l ON l.id = p.location_id "
+            "WHERE p.name LIKE ? AND l.role = 'depicted_location')"
+        )
+        params.append(f"{place}%")
+    if title is not None:
+        conditions.append("a.uuid IN (SELECT ti.uuid FROM titles ti WHERE ti.title LIKE ?)")
+        params.append(f"{title}%")
+
+    query = "SELECT a.* FROM artworks a"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY a.national_museum_norway_artwork_id"
+
+    db.row_factory = sqlite3.Row
+    return db.execute(query, params).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the SQLite artwork catalog.")
+    parser.add_argument("--db", default=db_file)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Rebuild the catalog from the enriched records.")
+    build_parser.add_argument("--data-dir", default=data_dir)
+
+    query_parser = subparsers.add_parser("query", help="List the artworks matching every filter.")
+    query_parser.add_argument("--technique", help='e.g. "oil"')
+    query_parser.add_argument("--material", help='e.g. "canvas"')
+    query_parser.add_argument("--subject", help='e.g. "waterfall"')
+    query_parser.add_argument("--place", help="Start of a depicted place name.")
+    query_parser.add_argument("--measurement", help='Measured part, e.g. "frame"')
+    query_parser.add_argument("--title", help="Start of any title.")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n = build_catalog(args.data_dir, args.db)
+        print(f"Wrote {n} artworks to {args.db}")
+    else:
+        with sqlite3.connect(args.db) as db:
+            rows = find_artworks(
+                db,
+                technique=args.technique,
+                material=args.material,
+                subject=args.subject,
+                place=args.place,
+                measurement=args.measurement,
+                title=args.title,
+            )
+        for row in rows:
+            print(row["uuid"], row["national_museum_norway_artwork_id"], row["display_title"], sep="\t")
+        print(f"{len(rows)} artworks")
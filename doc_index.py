@@ -0,0 +1,194 @@
+"""Read single docs out of combined, enriched or uuid enriched files by uuid.
+
+Next to a .json or .jsonl file of docs sits an index, <file>.index, that
+maps every artifact.uuid to the byte offset and length of its doc.
+A lookup then memory maps the file and only parses that one doc, instead of
+json.load-ing everything. The index is built on first use and rebuilt
+whenever the file has changed since, so it never has to be kept up to date
+by hand:
+
+    python doc_index.py data/combined_data/combined.json    # build it now
+    python read.py --uuid F7A76FBC-66E5-46DF-8B3F-D6ADE2439D04
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+
+from jsonl import is_jsonl
+
+WHITESPACE = re.compile(r"\s*")
+
+
+def index_file(path: str) -> str:
+    # Not .json, or the stages that read every .json file in a directory
+    # would take it for a page of docs
+    return f"{path}.index"
+
+
+def doc_uuid(doc: dict) -> str | None:
+    # Solr docs have artifact.uuid, the pipeline's mapped records just uuid
+    return doc.get("artifact.uuid", doc.get("uuid"))
+
+
+def skip_whitespace(text: str, i: int) -> int:
+    return WHITESPACE.match(text, i).end()
+
+
+def expect(text: str, i: int, char: str) -> int:
+    i = skip_whitespace(text, i)
+    if text[i : i + 1] != char:
+        raise ValueError(f"Expected {char!r} at character {i}, found {text[i:i + 20]!r}")
+    return i + 1
+
+
+def member_value(decoder: json.JSONDecoder, text: str, i: int, key: str) -> int:
+    """Return where the value of key starts, in the object whose "{" ends at i."""
+    while True:
+        i = skip_whitespace(text, i)
+        if text[i : i + 1] == "}":
+            raise ValueError(f"No {key!r} in the object ending at character {i}")
+
+        name, i = decoder.raw_decode(text, i)
+        i = skip_whitespace(text, expect(text, i, ":"))
+        if name == key:
+            return i
+
+        # Only the small envelope fields get skipped like this
+        _, i = decoder.raw_decode(text, i)
+        i = skip_whitespace(text, i)
+        if text[i : i + 1] == ",":
+            i += 1
+
+
+def json_spans(data: bytes):
+    """Yield (uuid, offset, length) for every doc in a Solr style JSON document.
+
+    Only one doc is decoded at a time, while walking response.docs.
+    """
+    text = data.decode()
+    decoder = json.JSONDecoder()
+    i = member_value(decoder, text, expect(text, 0, "{"), "response")
+    i = member_value(decoder, text, expect(text, i, "{"), "docs")
+    i = skip_whitespace(text, expect(text, i, "["))
+
+    # Offsets in the index are in bytes, which only equal characters in ASCII
+    ascii = text.isascii()
+    last_char = last_byte = 0
+
+    def byte_offset(char: int) -> int:
+        nonlocal last_char, last_byte
+        if ascii:
+            return char
+        last_byte += len(text[last_char:char].encode())
+        last_char = char
+        return last_byte
+
+    if text[i : i + 1] == "]":
+        return
+    while True:
+        doc, end = decoder.raw_decode(text, i)
+        start = byte_offset(i)
+        yield doc_uuid(doc), start, byte_offset(end) - start
+
+        i = skip_whitespace(text, end)
+        if text[i : i + 1] == "]":
+            return
+        i = skip_whitespace(text, expect(text, i, ","))
+
+
+def jsonl_spans(f):
+    """Yield (uuid, offset, length) for every line of a JSONL file opened in binary."""
+    offset = 0
+    for line in f:
+        doc = line.strip()
+        if doc:
+            yield doc_uuid(json.loads(doc)), offset + len(line) - len(line.lstrip()), len(doc)
+        offset += len(line)
+
+
+def source_stamp(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def build_index(path: str) -> dict:
+    """Index every doc in path and write the index next to it."""
+    docs = {}
+    count = 0
+    stamp = source_stamp(path)
+    with open(path, "rb") as f:
+        if is_jsonl(path):
+            spans = jsonl_spans(f)
+        else:
+            spans = json_spans(f.read())
+        for uuid, offset, length in spans:
+            count += 1
+            if uuid is not None:
+                docs[uuid] = [offset, length]
+
+    index = {"source": stamp, "count": count, "docs": docs}
+    tmp_file = f"{index_file(path)}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file(path))
+
+    return index
+
+
+def load_index(path: str) -> dict:
+    """Return the index of path, building it if it is missing or out of date."""
+    if os.path.exists(index_file(path)):
+        with open(index_file(path)) as f:
+            index = json.load(f)
+        if index.get("source") == source_stamp(path):
+            return index
+
+    return build_index(path)
+
+
+class DocIndex:
+    """Random access by uuid into a .json or .jsonl file of docs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        index = load_index(path)
+        self.count = index["count"]
+        self.docs = index["docs"]
+
+        self.file = open(path, "rb")
+        # mmap refuses empty files, and there is nothing to read in one anyway
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.docs else b""
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, uuid: str) -> bool:
+        return uuid in self.docs
+
+    def get(self, uuid: str) -> dict:
+        offset, length = self.docs[uuid]
+        return json.loads(self.data[offset : offset + length])
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the uuid offset index of .json or .jsonl doc files.")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        index = build_index(path)
+        print(f"Indexed {len(index['docs'])} of {index['count']} docs in {path}", file=sys.stderr)
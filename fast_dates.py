@@ -0,0 +1,174 @@
+"""Fast parsing of the fixed date formats used by stages 05 and 06.
+
+datetime.strptime re-interprets its format string on every call, which makes
+it one of the slowest things in the mapping and enrichment loops. Both formats
+here are fixed width, so they are sliced directly, and the results are
+memoized because the same dates show up again and again. Anything that does
+not look exactly like the expected layout falls back to strptime, so the
+results (and errors) always match it.
+
+classify_creation_dates() is a batch version of
+06_further_enrich.get_creation_date() that uses NumPy, if it is installed, to
+work out the date precision of many records at once.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DIMU_FORMAT = "%Y%m%d-%H%M%S-%f"
+ISO_DATE_FORMAT = "%Y-%m-%d"
+
+
+def is_ascii_digits(string: str) -> bool:
+    # str.isdigit() is also true for things like superscripts, which int() rejects
+    return string.isascii() and string.isdigit()
+
+
+@lru_cache(maxsize=65536)
+def parse_dimu_timestamp(date_str: str) -> datetime:
+    """Parse "20140524-010136-522280", the format of the dimu.org API dates."""
+    fraction = date_str[16:]
+    if (
+        len(date_str) >= 17
+        and date_str[8] == "-"
+        and date_str[15] == "-"
+        and is_ascii_digits(date_str[:8])
+        and is_ascii_digits(date_str[9:15])
+        and len(fraction) <= 6
+        and is_ascii_digits(fraction)
+    ):
+        return datetime(
+            int(date_str[0:4]),
+            int(date_str[4:6]),
+            int(date_str[6:8]),
+            int(date_str[9:11]),
+            int(date_str[11:13]),
+            int(date_str[13:15]),
+            # %f reads the digits as the start of a six digit fraction
+            int(fraction.ljust(6, "0")),
+        )
+
+    return datetime.strptime(date_str, DIMU_FORMAT)
+
+
+@lru_cache(maxsize=65536)
+def parse_iso_date(date_str: str) -> datetime:
+    """Parse "1867-01-01", the format 05_mapping.py writes dates in."""
+    if (
+        len(date_str) == 10
+        and date_str[4] == "-"
+        and date_str[7] == "-"
+        and is_ascii_digits(date_str[:4])
+        and is_ascii_digits(date_str[5:7])
+        and is_ascii_digits(date_str[8:])
+    ):
+        return datetime(int(date_str[:4]), int(date_str[5:7]), int(date_str[8:]))
+
+    return datetime.strptime(date_str, ISO_DATE_FORMAT)
+
+
+# Precision classes, in the order get_creation_date() checks them
+UNKNOWN, EXACT_DATE, EXACT_MONTH, MONTH_RANGE, EXACT_YEAR, YEAR_RANGE = range(6)
+
+
+def classify_creation_dates(from_dates, to_dates, descriptive_dates, get_creation_date) -> list:
+    """Return get_creation_date(from, to, descriptive) for every record.
+
+    Records with both dates in canonical ISO form and a descriptive date are
+    classified together as arrays; everything else, and everything when
+    NumPy is missing, goes through get_creation_date one at a time.
+    """
+    n = len(from_dates)
+    output = [None] * n
+
+    batch = []
+    for i in range(n):
+        from_date = from_dates[i]
+        to_date = to_dates[i]
+        if (
+            np is not None
+            and from_date is not None
+            and to_date is not None
+            and len(from_date) == 10
+            and len(to_date) == 10
+            # get_creation_date only looks at it for some dates, and its
+            # answer, or error, without one is left to it
+            and descriptive_dates[i] is not None
+        ):
+            batch.append(i)
+        else:
+            output[i] = get_creation_date(from_date, to_date, descriptive_dates[i])
+
+    if not batch:
+        return output
+
+    try:
+        from_dt = np.array([from_dates[i] for i in batch], dtype="datetime64[D]")
+        to_dt = np.array([to_dates[i] for i in batch], dtype="datetime64[D]")
+    except ValueError:
+        # Not quite ISO after all, let strptime sort it out
+        for i in batch:
+            output[i] = get_creation_date(from_dates[i], to_dates[i], descriptive_dates[i])
+        return output
+
+    def split(dates):
+        months = dates.astype("datetime64[M]")
+        year = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        month = months.astype(np.int64) % 12 + 1
+        day = (dates - months).astype(np.int64) + 1
+        return year, month, day
+
+    from_year, from_month, from_day = split(from_dt)
+    to_year, to_month, to_day = split(to_dt)
+
+    descriptive = [descriptive_dates[i] for i in batch]
+    starts_with_first = np.array([date.startswith("1.") for date in descriptive], dtype=bool)
+    mentions_january = np.array(["januar" in date.lower() for date in descriptive], dtype=bool)
+
+    # Same rules as get_creation_date(), see there for why
+    day_is_null = (from_day == 1) & (to_day == 1) & ~starts_with_first
+    month_is_null = (from_month == 1) & (to_month == 1) & day_is_null & ~mentions_january
+
+    day_is_precise = (from_day == to_day) & ~day_is_null
+    month_is_precise = (from_month == to_month) & ~month_is_null
+    year_is_precise = from_year == to_year
+
+    precision = np.select(
+        [
+            day_is_precise & month_is_precise & year_is_precise,
+            month_is_precise & year_is_precise,
+            ~month_is_precise & ~month_is_null & day_is_null & year_is_precise,
+            year_is_precise & month_is_null & day_is_null,
+            ~year_is_precise,
+        ],
+        [EXACT_DATE, EXACT_MONTH, MONTH_RANGE, EXACT_YEAR, YEAR_RANGE],
+        default=UNKNOWN,
+    )
+
+    for j, i in enumerate(batch):
+        kind = precision[j]
+        # strftime("%Y") does not zero pad, so neither does str()
+        if kind == EXACT_DATE:
+            output[i] = {"range_of_dates": False, "created_at_date": to_dates[i]}
+        elif kind == EXACT_MONTH:
+            output[i] = {"range_of_dates": False, "created_at_date": f"{to_year[j]}-{to_month[j]:02d}"}
+        elif kind == MONTH_RANGE:
+            output[i] = {
+                "range_of_dates": True,
+                "created_at_date_start": f"{from_year[j]}-{from_month[j]:02d}",
+                "created_at_date_end": f"{to_year[j]}-{to_month[j]:02d}",
+            }
+        elif kind == EXACT_YEAR:
+            output[i] = {"range_of_dates": False, "created_at_date": f"{to_year[j]}"}
+        elif kind == YEAR_RANGE:
+            output[i] = {
+                "range_of_dates": True,
+                "created_at_date_start": f"{from_year[j]}",
+                "created_at_date_end": f"{to_year[j]}",
+            }
+
+    return output
@@ -0,0 +1,203 @@
+"""Sketchbooks and their pages, as one parent/child graph of artifacts.
+
+A parent is an artifact with artifact.hasChildren set and its children listed
+in uuid_json.childArtifacts; the children themselves do not point back at it.
+One pass over the 04 output collects every parent with its children in order.
+
+Not every parent is a book. Many paintings have a single child, the
+photograph of their reverse (NG.M.04248 and NG.M.04248-R), so every parent
+gets a kind: "sketchbook" for an object named Skissebok with several pages,
+"reverse" when the children are only the parent's own back, and "part" for
+anything else. Sketchbook pages that are not in our own harvest, e.g.
+because they are catalogued without Gude as the producer, are fetched with
+04's pooled session so their titles can be shown too.
+
+    python hierarchy.py                     # write data/hierarchy.json
+    python 05_mapping.py --hierarchy data/hierarchy.json
+    python 07_to_art_template.py --book F7A76FBC-66E5-46DF-8B3F-D6ADE2439D04
+"""
+import argparse
+import importlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from http_cache import add_cache_arguments, cache_options
+from jsonl import read_docs
+from throttle import add_throttle_arguments, throttle_options
+
+enrich = importlib.import_module("03_enrich")
+wgeter = importlib.import_module("04_wgeter")
+
+input_file = wgeter.output_file
+hierarchy_file = "./data/hierarchy.json"
+
+# The museum's object name for a sketchbook
+SKETCHBOOK_NAMES = ("skissebok",)
+# What follows the parent's identifier in the identifier of its reverse,
+# e.g. NG.M.04248-R, NG.M.00467.R or NG.K&H.1999.0268VERSO
+REVERSE = re.compile(r"[-. ]?(r|verso)", re.IGNORECASE)
+
+
+def uuid_json_title(uuid_json: dict) -> str | None:
+    titles = uuid_json.get("titles") or []
+    return titles[0].get("title") if titles else None
+
+
+def is_reverse(parent_identifier: str | None, child_identifier: str | None) -> bool:
+    if not parent_identifier or not child_identifier or not child_identifier.startswith(parent_identifier):
+        return False
+    return REVERSE.fullmatch(child_identifier[len(parent_identifier):]) is not None
+
+
+def parent_kind(doc: dict, children: list) -> str:
+    names = {(name.get("name") or "").strip().lower() for name in (doc.get("uuid_json") or {}).get("names") or []}
+    if names & set(SKETCHBOOK_NAMES) and len(children) > 1:
+        return "sketchbook"
+    if children and all(is_reverse(doc.get("identifier.id"), child.get("identifier")) for child in children):
+        return "reverse"
+    return "part"
+
+
+def build_hierarchy(docs) -> dict:
+    """Return {parent uuid: parent} for every doc with children, in one pass."""
+    books = {}
+    titles = {}
+    for doc in docs:
+        uuid = doc["artifact.uuid"]
+        titles[uuid] = doc.get("artifact.ingress.title")
+        children = (doc.get("uuid_json") or {}).get("childArtifacts") or []
+        if not doc.get("artifact.hasChildren") and not children:
+            continue
+
+        books[uuid] = {
+            "kind": parent_kind(doc, children),
+            "identifier": doc.get("identifier.id"),
+            "title": doc.get("artifact.ingress.title"),
+            "digitalt_museum_link": doc.get("digitaltmuseum_link"),
+            "children": [
+                {
+                    "uuid": child["uuid"],
+                    "identifier": child.get("identifier"),
+                    "sort": child.get("sort"),
+                }
+                for child in sorted(children, key=lambda child: (child.get("sort") is None, child.get("sort")))
+            ],
+        }
+
+    # Only known once every doc has been seen
+    for book in books.values():
+        for child in book["children"]:
+            child["in_corpus"] = child["uuid"] in titles
+            child["title"] = titles.get(child["uuid"])
+
+    return books
+
+
+def fetch_children(books: dict, workers: int, **session_kwargs) -> list:
+    """Fetch the sketchbook pages missing from the corpus, returning (uuid, error) pairs."""
+    children = {
+        child["uuid"]: child for book in books.values() if book["kind"] == "sketchbook" for child in book["children"]
+    }
+    os.makedirs(wgeter.docs_dir, exist_ok=True)
+    session = wgeter.make_session(workers, **session_kwargs)
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(wgeter.fetch_uuid_json, session, enrich.uuid_link(uuid), uuid): uuid
+            for uuid, child in children.items()
+            if not child["in_corpus"] and not os.path.exists(wgeter.doc_file(uuid))
+        }
+        print(f"Fetching {len(futures)} of {len(children)} pages", file=sys.stderr)
+
+        for i, future in enumerate(as_completed(futures)):
+            uuid = futures[future]
+            try:
+                future.result()
+            except requests.RequestException as e:
+                errors.append((uuid, f"{type(e).__name__}: {e}"))
+                print(i, uuid, "FAILED", file=sys.stderr)
+            else:
+                print(i, uuid, file=sys.stderr)
+
+    session.close()
+
+    return errors
+
+
+def add_titles(books: dict) -> None:
+    """Title the pages from outside the corpus that fetch_children got."""
+    for book in books.values():
+        for child in book["children"]:
+            if not child["in_corpus"] and os.path.exists(wgeter.doc_file(child["uuid"])):
+                with open(wgeter.doc_file(child["uuid"])) as f:
+                    child["title"] = uuid_json_title(json.load(f))
+
+
+def read_hierarchy(path: str = hierarchy_file) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_links(books: dict) -> dict[str, dict]:
+    """Return the part_of and child_uuids fields of every record with a parent or children."""
+    links = {}
+    for book_uuid, book in books.items():
+        part_of = {
+            "uuid": book_uuid,
+            "kind": book["kind"],
+            "identifier": book["identifier"],
+            "title": book["title"],
+            "digitalt_museum_link": book["digitalt_museum_link"],
+        }
+        links.setdefault(book_uuid, {})["child_uuids"] = [child["uuid"] for child in book["children"]]
+        for child in book["children"]:
+            links.setdefault(child["uuid"], {})["part_of"] = part_of
+
+    return links
+
+
+def sketchbooks(books: dict) -> dict:
+    return {uuid: book for uuid, book in books.items() if book["kind"] == "sketchbook"}
+
+
+def book_pages(books: dict, book_uuid: str) -> list[str]:
+    """The book's own uuid followed by its pages, in page order."""
+    return [book_uuid] + [child["uuid"] for child in books[book_uuid]["children"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find every sketchbook and its pages.")
+    parser.add_argument("--input", default=input_file, help="uuid enriched .json or .jsonl from 04_wgeter.py.")
+    parser.add_argument("--output", default=hierarchy_file)
+    parser.add_argument("--workers", type=int, default=8, help="Pages to download concurrently.")
+    parser.add_argument("--no-fetch", action="store_true", help="Only use pages already in the corpus.")
+    add_cache_arguments(parser)
+    add_throttle_arguments(parser)
+    args = parser.parse_args()
+
+    books = build_hierarchy(read_docs(args.input))
+    session_options = {**cache_options(args), **throttle_options(args)}
+    errors = [] if args.no_fetch else fetch_children(books, args.workers, **session_options)
+    add_titles(books)
+
+    with open(args.output, "w") as f:
+        json.dump(books, f, indent=2, sort_keys=True)
+
+    books_only = sketchbooks(books)
+    n_children = sum(len(book["children"]) for book in books_only.values())
+    n_in_corpus = sum(child["in_corpus"] for book in books_only.values() for child in book["children"])
+    print(
+        f"{len(books_only)} sketchbooks with {n_children} pages, {n_in_corpus} of them in the corpus",
+        file=sys.stderr,
+    )
+    print(f"{len(books) - len(books_only)} other artifacts with children", file=sys.stderr)
+    for uuid, error in errors:
+        print(f"FAILED: {uuid}: {error}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} pages failed to download")
@@ -0,0 +1,220 @@
+"""On-disk cache for the api.dimu.org calls made by 01_nmk.py and 04_wgeter.py.
+
+Responses are stored in SQLite keyed by method and full request URL. Fresh
+entries are served without touching the network, stale ones are revalidated
+with If-None-Match/If-Modified-Since so unchanged artifacts only cost a 304,
+and offline mode replays the cache without any network access at all.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+
+import instrument
+
+DEFAULT_CACHE_FILE = "./data/http_cache.sqlite"
+# Serve cached responses without revalidating for a day
+DEFAULT_TTL = 24 * 60 * 60
+# Drop entries nobody asked for in a month
+DEFAULT_MAX_IDLE = 30 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status_code INTEGER NOT NULL,
+    content BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+class OfflineCacheMiss(Exception):
+    """Raised in offline mode when a request has never been cached."""
+
+
+class CachedResponse:
+    """The subset of requests.Response that the pipeline uses."""
+
+    def __init__(self, url: str, status_code: int, content: bytes, from_cache: bool):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.from_cache = from_cache
+
+    def __repr__(self) -> str:
+        cached = " cached" if self.from_cache else ""
+        return f"<Response [{self.status_code}]{cached}>"
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} error for url: {self.url}", response=self)
+
+
+def cache_key(method: str, url: str) -> str:
+    return hashlib.sha256(f"{method} {url}".encode()).hexdigest()
+
+
+class CachedSession:
+    """Wrap a requests.Session so get/post go through the cache first.
+
+    Safe to share between threads; the database is only touched under a lock
+    and network calls happen outside of it.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        cache_file: str = DEFAULT_CACHE_FILE,
+        ttl: float = DEFAULT_TTL,
+        max_idle: float = DEFAULT_MAX_IDLE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False,
+    ):
+        self.session = session
+        self.ttl = ttl
+        self.max_idle = max_idle
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def get(self, url: str, params=None) -> CachedResponse:
+        return self.request("GET", url, params)
+
+    def post(self, url: str, params=None) -> CachedResponse:
+        return self.request("POST", url, params)
+
+    def request(self, method: str, url: str, params=None) -> CachedResponse:
+        # Let requests build the final URL so the key matches what is sent
+        full_url = requests.Request(method, url, params=params).prepare().url
+        key = cache_key(method, full_url)
+        now = time.time()
+
+        with self._lock:
+            entry = self._db.execute(
+                "SELECT status_code, content, etag, last_modified, fetched_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if entry is not None:
+                self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._db.commit()
+
+        if entry is not None:
+            status_code, content, etag, last_modified, fetched_at = entry
+            if self.offline or now - fetched_at < self.ttl:
+                instrument.report.add_request(full_url, None, status_code)
+                return CachedResponse(full_url, status_code, content, from_cache=True)
+        elif self.offline:
+            raise OfflineCacheMiss(f"Not in the cache: {method} {full_url}")
+
+        headers = {}
+        if entry is not None:
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        start = time.perf_counter()
+        response = self.session.request(method, full_url, headers=headers)
+        instrument.report.add_request(full_url, time.perf_counter() - start, response.status_code)
+
+        # Unchanged, so the copy we have is good for another ttl
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self._db.execute("UPDATE responses SET fetched_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            return CachedResponse(full_url, status_code, content, from_cache=True)
+
+        if response.ok:
+            self._store(key, full_url, response, now)
+
+        return CachedResponse(full_url, response.status_code, response.content, from_cache=False)
+
+    def _store(self, key: str, url: str, response: requests.Response, now: float) -> None:
+        content = response.content
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    response.status_code,
+                    content,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    now,
+                    now,
+                    len(content),
+                ),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop idle entries, then least recently used ones until under max_bytes."""
+        self._db.execute("DELETE FROM responses WHERE last_access < ?", (now - self.max_idle,))
+
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        to_remove = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            to_remove.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", to_remove)
+
+    def close(self) -> None:
+        self.session.close()
+        with self._lock:
+            self._db.close()
+
+
+def add_cache_arguments(parser) -> None:
+    """Add the cache options shared by every networked script."""
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only replay responses from the cache, never touch the network.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_TTL,
+        help="Seconds a cached response is used before it is revalidated.",
+    )
+    parser.add_argument(
+        "--cache-file",
+        default=DEFAULT_CACHE_FILE,
+        help="SQLite file holding the cached responses.",
+    )
+
+
+def cache_options(args) -> dict:
+    """Turn the parsed cache arguments into CachedSession keyword arguments."""
+    return {"cache_file": args.cache_file, "ttl": args.cache_ttl, "offline": args.offline}
@@ -0,0 +1,213 @@
+"""Where the time goes: stage timers, parser timers, HTTP latency and memory.
+
+Everything is recorded into one report per process. A script times itself
+as a stage and, given --report, writes the report as JSON when it is done:
+
+    python 05_mapping.py --report data/reports/map.json
+    python 05_mapping.py --profile data/reports/map.prof   # cProfile the stage
+    python pipeline.py --report data/reports/run.json --profile map
+
+The report holds, per stage, the wall and CPU time (worker processes
+included), records done and records per second; per timed function, the
+calls and time spent; per host, a histogram of request latencies, counting
+cache hits separately; per throttle, its retries and how far it throttled
+down; and the peak resident memory.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows; the report then has no child CPU time or peak memory
+    resource = None
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class StageTimer:
+    def __init__(self, name: str):
+        self.name = name
+        self.records = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def count(self, records):
+        """Pass records through, counting them."""
+        for record in records:
+            self.records += 1
+            yield record
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+            "records": self.records,
+            "records_per_s": round(self.records / self.wall, 3) if self.wall else None,
+        }
+
+
+class Report:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = []
+        # name -> [calls, wall, cpu]
+        self.functions = {}
+        # host -> {"requests", "cached", "errors", "wall_s", "max_s", "buckets"}
+        self.http = {}
+        self.throttles = []
+
+    def add_throttle(self, throttle) -> None:
+        with self.lock:
+            self.throttles.append(throttle)
+
+    def add_function(self, name: str, wall: float, cpu: float) -> None:
+        with self.lock:
+            totals = self.functions.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+
+    def add_request(self, url: str, seconds: float | None, status_code: int) -> None:
+        host = urlsplit(url).netloc
+        with self.lock:
+            stats = self.http.get(host)
+            if stats is None:
+                stats = self.http[host] = {
+                    "requests": 0,
+                    "cached": 0,
+                    "errors": 0,
+                    "wall_s": 0.0,
+                    "max_s": 0.0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+
+            if seconds is None:
+                stats["cached"] += 1
+                return
+
+            stats["requests"] += 1
+            stats["errors"] += status_code >= 400
+            stats["wall_s"] += seconds
+            stats["max_s"] = max(stats["max_s"], seconds)
+            stats["buckets"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def to_json(self) -> dict:
+        with self.lock:
+            throttles = list(self.throttles)
+            http = {}
+            for host, stats in self.http.items():
+                bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["inf"]
+                http[host] = {
+                    "requests": stats["requests"],
+                    "cached": stats["cached"],
+                    "errors": stats["errors"],
+                    "wall_s": round(stats["wall_s"], 6),
+                    "max_s": round(stats["max_s"], 6),
+                    "mean_s": round(stats["wall_s"] / stats["requests"], 6) if stats["requests"] else None,
+                    # Requests that took at most this many seconds
+                    "histogram": dict(zip(bounds, stats["buckets"])),
+                }
+
+            return {
+                "argv": sys.argv,
+                "stages": [stage.to_json() for stage in self.stages],
+                "functions": {
+                    name: {"calls": calls, "wall_s": round(wall, 6), "cpu_s": round(cpu, 6)}
+                    for name, (calls, wall, cpu) in sorted(self.functions.items())
+                },
+                "http": http,
+                # Where every throttle.Throttle ended up and how often it backed off
+                "throttles": [throttle.to_json() for throttle in throttles],
+                "peak_rss_mb": peak_rss_mb(),
+            }
+
+
+report = Report()
+
+
+def children_cpu() -> float:
+    # Worker processes only count once they have exited and been waited for
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb() -> dict | None:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20, 1),
+        "largest_child": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20, 1),
+    }
+
+
+def make_parent_dir(path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+@contextmanager
+def stage(name: str, profile: str | None = None):
+    """Time a stage, optionally under cProfile written to the profile file.
+
+    Count the records it handles on the yielded StageTimer.
+    """
+    timer = StageTimer(name)
+    profiler = cProfile.Profile() if profile else None
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time() + children_cpu()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield timer
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            make_parent_dir(profile)
+            profiler.dump_stats(profile)
+        timer.wall = time.perf_counter() - start_wall
+        timer.cpu = time.process_time() + children_cpu() - start_cpu
+        with report.lock:
+            report.stages.append(timer)
+
+
+def timed(name: str, function):
+    """Wrap function so every call adds to its total in the report."""
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            report.add_function(name, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+
+    return wrapper
+
+
+def write_report(path: str) -> None:
+    make_parent_dir(path)
+    with open(path, "w") as f:
+        json.dump(report.to_json(), f, indent=2)
+
+
+def add_report_arguments(parser) -> None:
+    """Add the options shared by every numbered script."""
+    parser.add_argument("--report", help="Write timings, HTTP latencies and peak memory to this JSON file.")
+    parser.add_argument("--profile", help="Run the stage under cProfile and write the stats to this file.")
@@ -0,0 +1,63 @@
+"""Newline-delimited JSON, one artwork per line, for streaming between stages.
+
+Any path ending in .jsonl, or "-" for stdin/stdout, is treated as JSONL, so
+stages can be chained with pipes and start working before the previous stage
+is done:
+
+    python 02_combiner.py --output - | python 03_enrich.py --input - --output - | ...
+"""
+import json
+import os
+import sys
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+
+def is_jsonl(path: str) -> bool:
+    return path == "-" or path.endswith(".jsonl")
+
+
+@contextmanager
+def open_stream(path: str, mode: str):
+    """Open path, or stdin/stdout if it is "-"."""
+    if path == "-":
+        yield sys.stdin if "r" in mode else sys.stdout
+        return
+
+    if "w" in mode:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    with open(path, mode) as f:
+        yield f
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open_stream(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_jsonl(path: str, records: Iterable[dict]) -> int:
+    """Write one record per line, returning how many were written."""
+    n = 0
+    with open_stream(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True))
+            f.write("\n")
+            n += 1
+
+    return n
+
+
+def read_docs(path: str) -> Iterator[dict]:
+    """Yield docs from either a JSONL file or a Solr style JSON document."""
+    if is_jsonl(path):
+        yield from read_jsonl(path)
+        return
+
+    with open(path) as f:
+        data = json.load(f)
+    yield from data["response"]["docs"]
@@ -0,0 +1,230 @@
+"""Run the numbered stages in one process, like a small `make`.
+
+Records are handed from stage to stage in memory instead of going through
+each script's own files. Every stage's output is also kept as JSONL under
+data/pipeline/, together with a fingerprint of the stage's code, settings and
+inputs. On the next run a stage whose fingerprint still matches is skipped and
+its saved output is only read back if a later stage actually needs it.
+
+    python pipeline.py                  # run whatever is out of date
+    python pipeline.py --force fetch    # refetch even if nothing changed
+    python pipeline.py --until map      # stop after the mapping stage
+    python pipeline.py --report data/pipeline/report.json --profile map
+    python pipeline.py --shard nmk_hans-gude   # a shard from 01_nmk.py --producers
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+from collections import namedtuple
+
+import instrument
+from artwork import Artwork
+from http_cache import add_cache_arguments, cache_options
+from jsonl import read_jsonl, write_jsonl
+from throttle import add_throttle_arguments, throttle_options
+
+pipeline_dir = "./data/pipeline/"
+fingerprint_file = os.path.join(pipeline_dir, "fingerprints.json")
+raw_json_dir = "./data/raw_json/"
+
+# run gets the settings and one record list per dependency, and returns records.
+# record_type is the class the records are held as in memory, or None for dicts
+Stage = namedtuple("Stage", ["name", "deps", "sources", "run", "record_type"])
+
+
+def stage_module(name: str):
+    # The scripts start with a digit, so they can't be imported normally
+    return importlib.import_module(name)
+
+
+def run_combine(settings):
+    return list(stage_module("02_combiner").iter_docs(raw_json_dir))
+
+
+def run_enrich(settings, docs):
+    enrich_doc = stage_module("03_enrich").enrich_doc
+    return [enrich_doc(doc) for doc in docs]
+
+
+def run_fetch(settings, docs):
+    wgeter = stage_module("04_wgeter")
+    return list(wgeter.fetch_stream(docs, settings["workers"], **settings["cache"], **settings["throttle"]))
+
+
+def run_map(settings, docs):
+    map_doc = stage_module("05_mapping").map_doc
+    return [map_doc(doc) for doc in docs]
+
+
+def run_further_enrich(settings, records):
+    return stage_module("06_further_enrich").enrich_records(records)
+
+
+def run_render(settings, records):
+    render = stage_module("07_to_art_template").render
+    return [{"uuid": record.uuid, "wikitext": render(record)} for record in records]
+
+
+STAGES = [
+    Stage("combine", [], ["02_combiner.py", "jsonl.py"], run_combine, None),
+    Stage("enrich", ["combine"], ["03_enrich.py"], run_enrich, None),
+    Stage("fetch", ["enrich"], ["04_wgeter.py", "http_cache.py", "jsonl.py", "throttle.py"], run_fetch, None),
+    Stage("map", ["fetch"], ["05_mapping.py", "artwork.py", "fast_dates.py", "jsonl.py", "raw_store.py"], run_map, Artwork),
+    Stage("further_enrich", ["map"], ["06_further_enrich.py", "artwork.py", "fast_dates.py"], run_further_enrich, Artwork),
+    Stage("render", ["further_enrich"], ["07_to_art_template.py", "artwork.py"], run_render, None),
+]
+
+
+def hash_files(paths) -> str:
+    digest = hashlib.sha256()
+    for file_path in paths:
+        digest.update(file_path.encode())
+        with open(file_path, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def external_inputs(stage: Stage) -> list[str]:
+    """Files a stage reads from outside the pipeline."""
+    if stage.name == "combine":
+        return [
+            os.path.join(raw_json_dir, filename)
+            for filename in sorted(os.listdir(raw_json_dir))
+            if filename.endswith(".json")
+        ]
+    return []
+
+
+def fingerprint(stage: Stage, settings, dep_fingerprints: list[str]) -> str:
+    digest = hashlib.sha256()
+    digest.update(stage.name.encode())
+    digest.update(hash_files(stage.sources).encode())
+    digest.update(hash_files(external_inputs(stage)).encode())
+    # Only the settings that change a stage's output belong in here
+    if stage.name == "fetch":
+        digest.update(json.dumps(settings["cache"]["offline"]).encode())
+    for dep_fingerprint in dep_fingerprints:
+        digest.update(dep_fingerprint.encode())
+
+    return digest.hexdigest()
+
+
+def output_file(stage: Stage) -> str:
+    return os.path.join(pipeline_dir, f"{stage.name}.jsonl")
+
+
+def profile_file(stage: Stage) -> str:
+    return os.path.join(pipeline_dir, f"{stage.name}.prof")
+
+
+def run_pipeline(settings, force=(), until: str | None = None, profile: str | None = None) -> None:
+    os.makedirs(pipeline_dir, exist_ok=True)
+    old_fingerprints = {}
+    if os.path.exists(fingerprint_file):
+        with open(fingerprint_file) as f:
+            old_fingerprints = json.load(f)
+
+    stages = STAGES
+    if until is not None:
+        stages = STAGES[: [stage.name for stage in STAGES].index(until) + 1]
+
+    fingerprints = {}
+    # Records of stages that have run, or been loaded back, in this process
+    records = {}
+    # A forced stage can produce new output without its fingerprint changing
+    ran = set()
+
+    def get_records(name: str):
+        if name not in records:
+            stage = next(stage for stage in STAGES if stage.name == name)
+            print(f"Loading {name} from {output_file(stage)}")
+            records[name] = list(read_jsonl(output_file(stage)))
+            if stage.record_type is not None:
+                records[name] = [stage.record_type.from_json(record) for record in records[name]]
+        return records[name]
+
+    # STAGES is already in dependency order
+    for stage in stages:
+        fingerprints[stage.name] = fingerprint(stage, settings, [fingerprints[dep] for dep in stage.deps])
+
+        up_to_date = (
+            stage.name not in force
+            and not ran.intersection(stage.deps)
+            and old_fingerprints.get(stage.name) == fingerprints[stage.name]
+            and os.path.exists(output_file(stage))
+        )
+        if up_to_date:
+            print(f"Skipping {stage.name}, up to date")
+            continue
+
+        print(f"Running {stage.name}")
+        inputs = [get_records(dep) for dep in stage.deps]
+        with instrument.stage(stage.name, profile_file(stage) if stage.name == profile else None) as timer:
+            records[stage.name] = stage.run(settings, *inputs)
+            timer.records = len(records[stage.name])
+        ran.add(stage.name)
+
+        # Stages may modify their input records in place, so the output has
+        # to be on disk before the next stage gets hold of it
+        to_write = records[stage.name]
+        if stage.record_type is not None:
+            to_write = (record.to_json() for record in to_write)
+        write_jsonl(output_file(stage), to_write)
+
+        # Save as we go, so a crash does not redo the stages that finished
+        old_fingerprints[stage.name] = fingerprints[stage.name]
+        with open(fingerprint_file, "w") as f:
+            json.dump(old_fingerprints, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    stage_names = [stage.name for stage in STAGES]
+
+    parser = argparse.ArgumentParser(description="Run every stage of the pipeline that is out of date.")
+    parser.add_argument(
+        "--force",
+        action="append",
+        default=[],
+        choices=stage_names,
+        help="Rerun this stage even if it is up to date; may be repeated.",
+    )
+    parser.add_argument("--until", choices=stage_names, help="Stop after this stage.")
+    parser.add_argument(
+        "--shard",
+        help="Run on a shard 01_nmk.py harvested into data/shards/<shard>/, keeping its output there.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of documents to download concurrently.",
+    )
+    parser.add_argument("--report", help="Write timings, HTTP latencies and peak memory to this JSON file.")
+    parser.add_argument(
+        "--profile",
+        choices=stage_names,
+        help="Run this stage under cProfile, writing the stats next to its output.",
+    )
+    add_cache_arguments(parser)
+    add_throttle_arguments(parser)
+    args = parser.parse_args()
+
+    if args.shard:
+        shard_dir = os.path.join("./data/shards/", args.shard)
+        raw_json_dir = os.path.join(shard_dir, "raw_json/")
+        pipeline_dir = os.path.join(shard_dir, "pipeline/")
+        fingerprint_file = os.path.join(pipeline_dir, "fingerprints.json")
+        if not os.path.isdir(raw_json_dir):
+            parser.error(f"No shard harvested in {shard_dir}")
+
+    if args.report:
+        stage_module("05_mapping").time_parsers()
+
+    settings = {"workers": args.workers, "cache": cache_options(args), "throttle": throttle_options(args)}
+    run_pipeline(settings, force=args.force, until=args.until, profile=args.profile)
+
+    if args.report:
+        instrument.write_report(args.report)
@@ -0,0 +1,263 @@
+"""Country, region and category for every depicted place, from its coordinates.
+
+Every coordinate in the corpus goes into one NumPy array and is matched
+against a local gazetteer, a CSV of named points with the country, region
+and Commons category each stands for:
+
+    name,latitude,longitude,country,region,category
+
+The gazetteer is bucketed into a grid of cells a degree across, so finding
+the nearest place only computes distances to the points in the cells around
+a coordinate, for all coordinates in a cell at once.
+
+Seeding the gazetteer from the corpus only gives each place its name,
+coordinates, country and region. Which Commons category a place stands for
+is left for a person to fill in, once per place; until then assign matches
+places but finds no categories for 07_to_art_template.py --place-categories.
+Seeding again keeps what was filled in and only adds new places.
+
+    python places.py build-gazetteer   # seed it from the places we already know
+    # fill in the category column of data/gazetteer.csv by hand
+    python places.py assign            # write data/places.json
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from math import ceil
+
+import numpy as np
+
+from artwork import Artwork
+
+data_dir = "./data/our_parsed_data/enriched/"
+gazetteer_file = "./data/gazetteer.csv"
+places_file = "./data/places.json"
+
+GAZETTEER_FIELDS = ("name", "latitude", "longitude", "country", "region", "category")
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.19
+CELL_DEGREES = 1.0
+# Further away than this and a gazetteer entry is not the same place
+MAX_DISTANCE_KM = 25.0
+
+
+def location_points(locations) -> np.ndarray:
+    """Turn the locations' coordinates into an (n, 2) array, NaN where missing."""
+    output = np.full((len(locations), 2), np.nan)
+    for i, location in enumerate(locations):
+        if location.latitude is not None:
+            output[i] = location.latitude, location.longitude
+
+    return output
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in km, broadcasting like any NumPy operation."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GridIndex:
+    """Nearest neighbour search over points bucketed into lat/long cells."""
+
+    def __init__(self, points: np.ndarray, cell_degrees: float = CELL_DEGREES):
+        self.points = points
+        self.cell_degrees = cell_degrees
+        self.n_lon_cells = round(360 / cell_degrees)
+
+        rows, columns = self.cells_of(points)
+        cells = {}
+        for i, cell in enumerate(zip(rows.tolist(), columns.tolist())):
+            cells.setdefault(cell, []).append(i)
+        self.cells = {cell: np.array(members) for cell, members in cells.items()}
+
+    def cells_of(self, points: np.ndarray):
+        rows = np.floor((points[:, 0] + 90) / self.cell_degrees).astype(np.int64)
+        columns = np.floor((points[:, 1] + 180) / self.cell_degrees).astype(np.int64) % self.n_lon_cells
+        return rows, columns
+
+    def candidates(self, row: int, column: int, max_km: float) -> np.ndarray:
+        """Every point in the cells that can hold something within max_km of this cell."""
+        lat_ring = ceil(max_km / KM_PER_DEGREE / self.cell_degrees)
+        # A degree of longitude shrinks towards the poles, so look wider there
+        south = row * self.cell_degrees - 90
+        furthest_lat = max(abs(south), abs(south + self.cell_degrees)) + lat_ring * self.cell_degrees
+        if furthest_lat >= 90:
+            # Across a pole any longitude can be close
+            lon_ring = self.n_lon_cells // 2
+        else:
+            lon_ring = ceil(max_km / (KM_PER_DEGREE * np.cos(np.radians(furthest_lat))) / self.cell_degrees)
+            lon_ring = min(lon_ring, self.n_lon_cells // 2)
+        columns = {(column + d_column) % self.n_lon_cells for d_column in range(-lon_ring, lon_ring + 1)}
+
+        found = []
+        for d_row in range(-lat_ring, lat_ring + 1):
+            for cell_column in sorted(columns):
+                cell = self.cells.get((row + d_row, cell_column))
+                if cell is not None:
+                    found.append(cell)
+
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def nearest(self, queries: np.ndarray, max_km: float):
+        """Return (index, distance) of the closest point to each query.
+
+        Queries that are NaN or have nothing within max_km get index -1 and
+        distance inf.
+        """
+        indices = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf)
+
+        valid = np.flatnonzero(~np.isnan(queries).any(axis=1))
+        if len(valid) == 0 or len(self.points) == 0:
+            return indices, distances
+
+        rows, columns = self.cells_of(queries[valid])
+        keys, inverse = np.unique(np.stack([rows, columns], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for i, (row, column) in enumerate(keys):
+            candidates = self.candidates(int(row), int(column), max_km)
+            if len(candidates) == 0:
+                continue
+
+            group = valid[inverse == i]
+            # Every query in the cell against every candidate in one go
+            d = haversine(
+                queries[group, 0, None],
+                queries[group, 1, None],
+                self.points[None, candidates, 0],
+                self.points[None, candidates, 1],
+            )
+            best = d.argmin(axis=1)
+            best_distances = d[np.arange(len(group)), best]
+            close = best_distances <= max_km
+            indices[group[close]] = candidates[best[close]]
+            distances[group[close]] = best_distances[close]
+
+        return indices, distances
+
+
+def read_gazetteer(path: str) -> list[dict]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def load_locations(data_dir: str):
+    """Return (uuid, location) for every depicted location in the corpus."""
+    locations = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(data_dir, filename)) as f:
+                artwork = Artwork.from_json(json.load(f))
+            for location in (artwork.locations or {}).get("depicted_location", []):
+                locations.append((artwork.uuid, location))
+
+    return locations
+
+
+def build_gazetteer(data_dir: str, path: str) -> int:
+    """Add every named, placed location in the corpus to the gazetteer, returning how many were new.
+
+    Country and region come from the museum's own place names. The category
+    is left empty, for someone to fill in once per place. Rows already in the
+    gazetteer are kept as they are.
+    """
+    existing = {row["name"]: row for row in read_gazetteer(path)} if os.path.exists(path) else {}
+    rows = dict(existing)
+    for _, location in load_locations(data_dir):
+        if location.latitude is None or location.human_name in rows:
+            continue
+
+        names = {place_name.level: place_name.name for place_name in location.place_names}
+        rows[location.human_name] = {
+            "name": location.human_name,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+            "country": names.get(1, ""),
+            "region": names.get(2, ""),
+            "category": "",
+        }
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, GAZETTEER_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows[name] for name in sorted(rows))
+
+    return len(rows) - len(existing)
+
+
+def assign_places(locations, gazetteer: list[dict], max_km: float) -> dict[str, list[dict]]:
+    """Match every location to its nearest gazetteer entry, all in one pass."""
+    points = np.array([[float(row["latitude"]), float(row["longitude"])] for row in gazetteer]).reshape(-1, 2)
+    index = GridIndex(points)
+    queries = location_points([location for _, location in locations])
+    indices, distances = index.nearest(queries, max_km)
+
+    places = {}
+    for (uuid, _), i, distance in zip(locations, indices, distances):
+        if i < 0:
+            continue
+        row = gazetteer[i]
+        places.setdefault(uuid, []).append(
+            {
+                "name": row["name"],
+                "country": row["country"],
+                "region": row["region"],
+                "category": row["category"],
+                "distance_km": round(float(distance), 3),
+            }
+        )
+
+    return places
+
+
+def read_place_categories(path: str = places_file) -> dict[str, list[str]]:
+    """Return the distinct non-empty categories of every uuid in places.json."""
+    with open(path) as f:
+        places = json.load(f)
+
+    return {
+        uuid: list(dict.fromkeys(place["category"] for place in uuid_places if place["category"]))
+        for uuid, uuid_places in places.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match depicted places to a gazetteer.")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--gazetteer", default=gazetteer_file)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "build-gazetteer",
+        help="Add the places the corpus names to the gazetteer; their categories are filled in by hand.",
+    )
+
+    assign_parser = subparsers.add_parser("assign", help="Find the gazetteer place of every depicted location.")
+    assign_parser.add_argument("--output", default=places_file)
+    assign_parser.add_argument("--max-km", type=float, default=MAX_DISTANCE_KM)
+
+    args = parser.parse_args()
+
+    if args.command == "build-gazetteer":
+        n = build_gazetteer(args.data_dir, args.gazetteer)
+        print(f"Added {n} places to {args.gazetteer}, fill in their category column by hand next")
+    else:
+        gazetteer = read_gazetteer(args.gazetteer)
+        uncategorised = sum(not row["category"] for row in gazetteer)
+        if uncategorised:
+            print(
+                f"{uncategorised} of {len(gazetteer)} places in {args.gazetteer} have no category yet, "
+                "fill them in by hand to get categories for them",
+                file=sys.stderr,
+            )
+        locations = load_locations(args.data_dir)
+        places = assign_places(locations, gazetteer, args.max_km)
+        with open(args.output, "w") as f:
+            json.dump(places, f, indent=2, sort_keys=True)
+
+        matched = sum(len(uuid_places) for uuid_places in places.values())
+        print(f"Matched {matched} of {len(locations)} depicted locations in {len(places)} records")
@@ -0,0 +1,84 @@
+"""Content-addressed store for the raw docs behind each parsed artwork.
+
+Instead of embedding the whole source doc as zzz_raw_data in every parsed
+file, 05_mapping.py stores it once here, gzipped and keyed by the SHA-256 of
+its canonical JSON, and the record only keeps a "sha256:..." reference.
+Identical docs are only ever stored once.
+
+Parsed files written before the store existed can be converted with:
+
+    python raw_store.py data/our_parsed_data/raw data/our_parsed_data/enriched
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+
+store_dir = "./data/raw_store/"
+
+REF_PREFIX = "sha256:"
+
+
+def canonical_json(doc) -> bytes:
+    return json.dumps(doc, sort_keys=True, separators=(",", ":")).encode()
+
+
+def ref_path(ref: str, store_dir: str = store_dir) -> str:
+    digest = ref.removeprefix(REF_PREFIX)
+    # Fan out over subdirectories so no single directory gets huge
+    return os.path.join(store_dir, digest[:2], f"{digest}.json.gz")
+
+
+def put(doc, store_dir: str = store_dir) -> str:
+    """Store doc if it is not already there and return its reference."""
+    data = canonical_json(doc)
+    ref = REF_PREFIX + hashlib.sha256(data).hexdigest()
+
+    path = ref_path(ref, store_dir)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Several mapping workers may store the same doc at once
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    return ref
+
+
+def get(ref: str, store_dir: str = store_dir):
+    with gzip.open(ref_path(ref, store_dir), "rb") as f:
+        return json.loads(f.read())
+
+
+def migrate_dir(data_dir: str, store_dir: str = store_dir) -> int:
+    """Move embedded raw docs in data_dir into the store, returning how many."""
+    n = 0
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json"):
+            continue
+
+        file_path = os.path.join(data_dir, filename)
+        with open(file_path) as f:
+            data = json.load(f)
+        if "zzz_raw_data" not in data:
+            continue
+
+        data["zzz_raw_data_ref"] = put(data.pop("zzz_raw_data"), store_dir)
+        with open(file_path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        n += 1
+
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded zzz_raw_data into the raw store.")
+    parser.add_argument("data_dirs", nargs="+", help="Directories of parsed artwork JSON files.")
+    parser.add_argument("--store-dir", default=store_dir)
+    args = parser.parse_args()
+
+    for data_dir in args.data_dirs:
+        n = migrate_dir(data_dir, args.store_dir)
+        print(f"Moved {n} raw docs out of {data_dir}")
@@ -1,6 +1,21 @@
+import argparse
 import json
 
-with open("./data/combined_data/combined.json") as f:
-    json_data = json.load(f)
+from doc_index import DocIndex
 
-print(len(json_data["response"]["docs"]))
+parser = argparse.ArgumentParser(description="Count the docs in a file, or print one of them.")
+parser.add_argument(
+    "--file",
+    default="./data/combined_data/combined.json",
+    help="Combined, enriched or uuid enriched .json or .jsonl.",
+)
+parser.add_argument("--uuid", nargs="+", help="Print these docs instead of counting.")
+args = parser.parse_args()
+
+with DocIndex(args.file) as index:
+    if not args.uuid:
+        print(len(index))
+    for uuid in args.uuid or ():
+        if uuid not in index:
+            parser.exit(1, f"{uuid} is not in {args.file}\n")
+        print(json.dumps(index.get(uuid), indent=2, sort_keys=True))
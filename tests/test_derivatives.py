@@ -0,0 +1,117 @@
+import importlib
+import struct
+
+import pytest
+
+from artwork import Artwork, Picture
+
+Image = pytest.importorskip("PIL.Image")
+
+derivatives = importlib.import_module("09_derivatives")
+art_template = importlib.import_module("07_to_art_template")
+
+
+def noise_image(width, height):
+    # Every pixel different, so a misplaced row or tile shows up
+    data = bytes((x * 7 + y * 13 + c * 101) % 256 for y in range(height) for x in range(width) for c in range(3))
+    return Image.frombytes("RGB", (width, height), data)
+
+
+def write_tiled_tiff(path, image, tile_size):
+    """An uncompressed RGB TIFF in tile_size square tiles, which Pillow can not write itself."""
+    width, height = image.size
+    tiles = []
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            # Edge tiles are padded out to the full tile size, like libtiff does
+            tile = Image.new("RGB", (tile_size, tile_size))
+            tile.paste(image.crop((x, y, min(x + tile_size, width), min(y + tile_size, height))))
+            tiles.append(tile.tobytes())
+
+    entries = 11
+    ifd_offset = 8
+    bits_offset = ifd_offset + 2 + entries * 12 + 4
+    offsets_offset = bits_offset + 6
+    counts_offset = offsets_offset + 4 * len(tiles)
+    data_offset = counts_offset + 4 * len(tiles)
+    tile_offsets = [data_offset + i * len(tiles[0]) for i in range(len(tiles))]
+
+    def entry(tag, field_type, count, value):
+        fmt = "<HHI" + ("HH" if field_type == 3 and count == 1 else "I")
+        return struct.pack(fmt, tag, field_type, count, *((value, 0) if fmt.endswith("HH") else (value,)))
+
+    with open(path, "wb") as f:
+        f.write(b"II*\x00" + struct.pack("<I", ifd_offset))
+        f.write(struct.pack("<H", entries))
+        f.write(entry(256, 4, 1, width))
+        f.write(entry(257, 4, 1, height))
+        f.write(entry(258, 3, 3, bits_offset))
+        f.write(entry(259, 3, 1, 1))
+        f.write(entry(262, 3, 1, 2))
+        f.write(entry(277, 3, 1, 3))
+        f.write(entry(284, 3, 1, 1))
+        f.write(entry(322, 4, 1, tile_size))
+        f.write(entry(323, 4, 1, tile_size))
+        f.write(entry(324, 4, len(tiles), offsets_offset))
+        f.write(entry(325, 4, len(tiles), counts_offset))
+        f.write(struct.pack("<I", 0))
+        f.write(struct.pack("<3H", 8, 8, 8))
+        f.write(struct.pack(f"<{len(tiles)}I", *tile_offsets))
+        f.write(struct.pack(f"<{len(tiles)}I", *[len(tile) for tile in tiles]))
+        for tile in tiles:
+            f.write(tile)
+
+
+def reduce_banded(path, factor, band_bytes):
+    with Image.open(path) as image:
+        tiles = derivatives.raw_tiles(image)
+        assert tiles is not None
+        return derivatives.reduce_in_bands(image, path, factor, band_bytes, tiles), len(tiles)
+
+
+@pytest.mark.parametrize("factor", [1, 3, 4])
+def test_multi_strip_tiff(tmp_path, factor):
+    path = str(tmp_path / "strips.tif")
+    original = noise_image(301, 257)
+    # 16 rows per strip, like libtiff writes by default for big images
+    original.save(path, compression="raw", tiffinfo={278: 16})
+
+    reduced, n_tiles = reduce_banded(path, factor, band_bytes=301 * 3 * 10)
+    assert n_tiles > 1
+    assert reduced.tobytes() == original.reduce(factor).tobytes()
+
+
+@pytest.mark.parametrize("factor", [1, 2, 5])
+def test_tiled_tiff(tmp_path, factor):
+    path = str(tmp_path / "tiles.tif")
+    original = noise_image(75, 53)
+    write_tiled_tiff(path, original, tile_size=16)
+
+    with Image.open(path) as image:
+        assert image.tobytes() == original.tobytes()
+
+    reduced, n_tiles = reduce_banded(path, factor, band_bytes=75 * 3 * 7)
+    assert n_tiles == 5 * 4
+    assert reduced.tobytes() == original.reduce(factor).tobytes()
+
+
+def test_make_jpeg_decodes_strips_in_bands(tmp_path):
+    path = str(tmp_path / "strips.tif")
+    noise_image(400, 300).save(path, compression="raw", tiffinfo={278: 16})
+
+    # Far too small to decode the whole image, but enough for a band
+    jpeg_path = str(tmp_path / "out.jpg")
+    derivatives.make_jpeg(path, jpeg_path, 100, memory_budget=8 * 400 * 3 * 8)
+    with Image.open(jpeg_path) as jpeg:
+        assert jpeg.size == (100, 75)
+
+
+def test_sidecar_reaches_the_rendered_record(tmp_path):
+    path = str(tmp_path / "derivatives.json")
+    sizes = {"jpeg": {"width": 100, "height": 60}, "thumbnail": {"width": 32, "height": 19}}
+    assert derivatives.read_derivatives(path) == {}
+    derivatives.write_derivatives({"A": sizes}, path)
+
+    artwork = Artwork(uuid="A", picture=Picture(0, 1000, 600, "https://example.org/A.tif"))
+    art_template.add_derivatives(artwork, derivatives.read_derivatives(path))
+    assert artwork.picture.to_json()["derivatives"] == sizes
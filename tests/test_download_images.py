@@ -0,0 +1,199 @@
+import importlib
+import io
+import re
+import struct
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from PIL import Image
+
+from throttle import TokenBucket
+
+download = importlib.import_module("08_download_images")
+
+
+def tiff_bytes(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, "TIFF")
+    return output.getvalue()
+
+
+class ImageServer:
+    """Serves one file, with or without Range support, and can stop short."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = True
+        # Send only this many bytes of the next answer, then hang up
+        self.cut_at = None
+        self.requests = []
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.headers.get("Range"))
+                data = server.data
+                status = 200
+                match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range") or "")
+                if match and server.ranges:
+                    start = int(match.group(1))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(data)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+                    data = data[start:]
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if server.cut_at is not None:
+                    data, server.cut_at = data[: server.cut_at], None
+                    self.close_connection = True
+                self.wfile.write(data)
+
+        return Handler
+
+
+IMAGE = tiff_bytes(64, 48)
+
+
+@pytest.fixture
+def images(serve):
+    images = ImageServer(IMAGE)
+    images.url = f"{serve(images.handler())}/image.tif"
+    return images
+
+
+@pytest.fixture
+def session():
+    session = download.make_session(1, max_attempts=1)
+    yield session
+    session.close()
+
+
+def fetch(session, images, tmp_path, width=64, height=48, limit=None):
+    path = str(tmp_path / "A.tif")
+    download.download_image(session, images.url, path, width, height, limit)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_downloads_a_whole_image(session, images, tmp_path):
+    assert fetch(session, images, tmp_path) == IMAGE
+    assert images.requests == [None]
+    assert not (tmp_path / "A.tif.part").exists()
+
+
+def test_resumes_a_part_file(session, images, tmp_path):
+    (tmp_path / "A.tif.part").write_bytes(IMAGE[:100])
+
+    assert fetch(session, images, tmp_path) == IMAGE
+    assert images.requests == ["bytes=100-"]
+
+
+def test_keeps_what_it_got_when_cut_off(session, images, tmp_path, monkeypatch):
+    # Everything up to the last whole chunk before the cut is kept
+    monkeypatch.setattr(download, "CHUNK_SIZE", 100)
+    images.cut_at = 1050
+
+    with pytest.raises(OSError):
+        fetch(session, images, tmp_path)
+    assert (tmp_path / "A.tif.part").read_bytes() == IMAGE[:1000]
+
+    assert fetch(session, images, tmp_path) == IMAGE
+    assert images.requests == [None, "bytes=1000-"]
+
+
+def test_416_means_the_part_file_is_complete(session, images, tmp_path):
+    (tmp_path / "A.tif.part").write_bytes(IMAGE)
+
+    assert fetch(session, images, tmp_path) == IMAGE
+    assert images.requests == [f"bytes={len(IMAGE)}-"]
+
+
+def test_starts_over_when_the_range_is_ignored(session, images, tmp_path):
+    images.ranges = False
+    (tmp_path / "A.tif.part").write_bytes(b"not what the server has")
+
+    assert fetch(session, images, tmp_path) == IMAGE
+    assert images.requests == ["bytes=23-"]
+
+
+@pytest.mark.parametrize("width, height", [(48, 64), (64, 49)])
+def test_rejects_the_wrong_dimensions(session, images, tmp_path, width, height):
+    with pytest.raises(ValueError, match=f"Expected a {width}x{height} TIFF, got \\(64, 48\\)"):
+        fetch(session, images, tmp_path, width, height)
+    # Resuming would not make it any better
+    assert not (tmp_path / "A.tif.part").exists()
+    assert not (tmp_path / "A.tif").exists()
+
+
+def test_rejects_what_is_not_a_tiff(session, images, tmp_path):
+    output = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(output, "JPEG")
+    images.data = output.getvalue()
+
+    with pytest.raises(ValueError, match="Not a TIFF file"):
+        fetch(session, images, tmp_path)
+    assert not (tmp_path / "A.tif.part").exists()
+
+
+def test_caps_the_bandwidth(session, images, tmp_path):
+    images.data = IMAGE + bytes(60_000 - len(IMAGE))
+    # No burst to speak of, so 60 kB at 200 kB/s takes at least 0.3 s
+    limit = TokenBucket(200_000, burst=1)
+
+    start = time.monotonic()
+    fetch(session, images, tmp_path, limit=limit)
+    assert time.monotonic() - start >= 0.25
+
+
+def ifd(byte_order: str, big: bool, entries) -> bytes:
+    """A TIFF header and first directory holding just the given (tag, type, value) entries."""
+    if big:
+        header = struct.pack(byte_order + "2sHHHQ", byte_order_mark(byte_order), 43, 8, 0, 16)
+        count_format, entry_format, value_size = "Q", "HHQ", 8
+    else:
+        header = struct.pack(byte_order + "2sHI", byte_order_mark(byte_order), 42, 8)
+        count_format, entry_format, value_size = "H", "HHI", 4
+
+    directory = struct.pack(byte_order + count_format, len(entries))
+    for tag, field_type, value in entries:
+        value_format = download.TIFF_INTEGER_FORMATS[field_type]
+        value_bytes = struct.pack(byte_order + value_format, value).ljust(value_size, b"\0")
+        directory += struct.pack(byte_order + entry_format, tag, field_type, 1) + value_bytes
+
+    return header + directory
+
+
+def byte_order_mark(byte_order: str) -> bytes:
+    return b"II" if byte_order == "<" else b"MM"
+
+
+@pytest.mark.parametrize("byte_order", ["<", ">"])
+@pytest.mark.parametrize("big", [False, True])
+@pytest.mark.parametrize("field_type", [3, 4])
+def test_tiff_dimensions(byte_order, big, field_type):
+    data = ifd(byte_order, big, [(254, 4, 0), (256, field_type, 6000), (257, field_type, 4500)])
+
+    assert download.tiff_dimensions(io.BytesIO(data)) == (6000, 4500)
+
+
+def test_tiff_dimensions_of_a_real_file():
+    assert download.tiff_dimensions(io.BytesIO(tiff_bytes(17, 5))) == (17, 5)
+
+
+def test_tiff_without_a_size():
+    with pytest.raises(ValueError, match="no image size"):
+        download.tiff_dimensions(io.BytesIO(ifd("<", False, [(256, 3, 10)])))
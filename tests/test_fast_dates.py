@@ -0,0 +1,69 @@
+import importlib
+import json
+import os
+from itertools import product
+
+import pytest
+
+from fast_dates import classify_creation_dates
+
+further_enrich = importlib.import_module("06_further_enrich")
+get_creation_date = further_enrich.get_creation_date
+
+DATES = [None, "1867-01-01", "1867-05-03", "1867-05-01", "1867-12-31", "1868-01-01", "1867-1-01", "1867-02-30"]
+DESCRIPTIVE = [None, "", "1867", "(1867)", "1. januar 1867", "januar 1867", "1867-1868", "ca. 1867"]
+
+
+def scalar(from_date, to_date, descriptive_date):
+    try:
+        return get_creation_date(from_date, to_date, descriptive_date)
+    except Exception as e:
+        return type(e)
+
+
+def batch(records):
+    """classify_creation_dates one record at a time, so an error only hits its own record."""
+    output = []
+    for record in records:
+        try:
+            output.append(classify_creation_dates(*([value] for value in record), get_creation_date)[0])
+        except Exception as e:
+            output.append(type(e))
+    return output
+
+
+def test_matches_get_creation_date():
+    records = list(product(DATES, DATES, DESCRIPTIVE))
+    assert batch(records) == [scalar(*record) for record in records]
+
+
+def test_none_descriptive_date_is_left_to_get_creation_date():
+    assert classify_creation_dates(["1867-05-03"], ["1867-05-03"], [None], get_creation_date) == [
+        {"range_of_dates": False, "created_at_date": "1867-05-03"}
+    ]
+    with pytest.raises(AttributeError):
+        classify_creation_dates(["1867-01-01"], ["1867-01-01"], [None], get_creation_date)
+
+
+def test_whole_batch_matches_record_by_record():
+    # Every record that get_creation_date can handle, classified in one call
+    records = [record for record in product(DATES, DATES, DESCRIPTIVE) if not isinstance(scalar(*record), type)]
+    from_dates, to_dates, descriptive_dates = zip(*records)
+    assert classify_creation_dates(from_dates, to_dates, descriptive_dates, get_creation_date) == [
+        scalar(*record) for record in records
+    ]
+
+
+@pytest.mark.skipif(not os.path.isdir(further_enrich.data_dir), reason="no parsed records")
+def test_matches_on_corpus():
+    records = []
+    for filename in sorted(os.listdir(further_enrich.data_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(further_enrich.data_dir, filename)) as f:
+                data = json.load(f)
+            records.append((data.get("from_date"), data.get("to_date"), data.get("descriptive_date")))
+
+    from_dates, to_dates, descriptive_dates = zip(*records)
+    assert classify_creation_dates(from_dates, to_dates, descriptive_dates, get_creation_date) == [
+        scalar(*record) for record in records
+    ]
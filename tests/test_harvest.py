@@ -0,0 +1,65 @@
+import importlib
+import json
+
+import pytest
+
+nmk = importlib.import_module("01_nmk")
+
+
+class Session:
+    def close(self) -> None:
+        pass
+
+
+def undated(uuid: str) -> dict:
+    return {"artifact.uuid": uuid}
+
+
+@pytest.fixture
+def shard(tmp_path):
+    output_dir = tmp_path / "raw_json"
+    output_dir.mkdir()
+    return nmk.Shard("test", ("identifier.owner:NMK*",), str(output_dir), str(tmp_path / "harvest_state.json"))
+
+
+def write_corpus(shard, docs, mark) -> None:
+    page = {"responseHeader": {}, "response": {"numFound": len(docs), "start": 0, "docs": docs}}
+    with open(nmk.page_file(0, shard.output_dir), "w") as f:
+        json.dump(page, f)
+    nmk.write_state(mark, updated=[], deleted=[], state_file=shard.state_file)
+
+
+def harvest(monkeypatch, shard, live_docs) -> list:
+    """Run harvest_incremental against live_docs, returning the extra filters of every query."""
+    queries = []
+
+    def fetch_all(session, extra_filters, fields=None, filters=None):
+        queries.append(extra_filters)
+        return iter(live_docs)
+
+    monkeypatch.setattr(nmk, "make_session", lambda *args, **kwargs: Session())
+    monkeypatch.setattr(nmk, "fetch_all", fetch_all)
+    nmk.harvest_incremental(shard)
+    return queries
+
+
+def test_without_a_mark_fetches_everything(monkeypatch, shard):
+    # A full harvest of a shard without any dated doc stores no mark
+    write_corpus(shard, [undated("A")], None)
+
+    queries = harvest(monkeypatch, shard, [undated("A"), undated("B")])
+
+    assert queries == [(), ()]
+    assert [doc["artifact.uuid"] for doc in nmk.load_corpus(shard.output_dir)[1]] == ["A", "B"]
+    assert nmk.read_state(shard.state_file)["high_water_mark"] is None
+
+
+def test_with_a_mark_only_fetches_changes(monkeypatch, shard):
+    mark = "2024-01-01T00:00:00Z"
+    write_corpus(shard, [undated("A")], mark)
+    new = {"artifact.uuid": "B", "artifact.publishedDate": "2024-02-01T00:00:00Z"}
+
+    queries = harvest(monkeypatch, shard, [undated("A"), new])
+
+    assert queries[0] == (f"artifact.updatedDate:{{{mark} TO *] OR artifact.publishedDate:{{{mark} TO *]",)
+    assert nmk.read_state(shard.state_file)["high_water_mark"] == "2024-02-01T00:00:00Z"
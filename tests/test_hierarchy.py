@@ -0,0 +1,99 @@
+import importlib
+
+import pytest
+
+import hierarchy
+
+art_template = importlib.import_module("07_to_art_template")
+
+
+def doc(uuid: str, identifier: str, name: str, children=()) -> dict:
+    return {
+        "artifact.uuid": uuid,
+        "identifier.id": identifier,
+        "artifact.ingress.title": f"{identifier} [{name}]",
+        "artifact.hasChildren": bool(children),
+        "digitaltmuseum_link": f"https://digitaltmuseum.org/{uuid}",
+        "uuid_json": {
+            "names": [{"name": name, "nameType": "name"}],
+            "childArtifacts": [
+                {"uuid": child_uuid, "identifier": child_identifier, "sort": i}
+                for i, (child_uuid, child_identifier) in enumerate(children)
+            ],
+        },
+    }
+
+
+DOCS = [
+    doc("BOOK", "NG.K&H.B.06524", "Skissebok", [("P1", "NG.K&H.B.06524-001"), ("P1V", "NG.K&H.B.06524-001VERSO")]),
+    doc("P1", "NG.K&H.B.06524-001", "Tegning"),
+    doc("PAINTING", "NG.M.04248", "Maleri", [("BACK", "NG.M.04248-R")]),
+    doc("GROUP", "NG.M.00635", "Maleri", [("G1", "NG.M.00635-003"), ("G2", "NG.M.00635-004")]),
+    doc("THIN", "NG.K&H.B.09999", "Skissebok", [("T1", "NG.K&H.B.09999-001")]),
+    doc("LONE", "NG.M.00001", "Maleri"),
+]
+
+
+class Session:
+    def close(self) -> None:
+        pass
+
+
+@pytest.mark.parametrize(
+    "parent, child, expected",
+    [
+        ("NG.M.04248", "NG.M.04248-R", True),
+        ("NG.M.00467", "NG.M.00467.R", True),
+        ("NG.K&H.1999.0268", "NG.K&H.1999.0268VERSO", True),
+        ("NG.M.00635-007", "NG.M.00635-007-r", True),
+        ("NG.M.00635", "NG.M.00635-003", False),
+        ("NG.M.0424", "NG.M.04248-R", False),
+        (None, "NG.M.04248-R", False),
+    ],
+)
+def test_is_reverse(parent, child, expected):
+    assert hierarchy.is_reverse(parent, child) is expected
+
+
+def test_parent_kinds():
+    books = hierarchy.build_hierarchy(DOCS)
+
+    assert {uuid: book["kind"] for uuid, book in books.items()} == {
+        "BOOK": "sketchbook",
+        "PAINTING": "reverse",
+        "GROUP": "part",
+        # A one page "sketchbook" is no book to page through
+        "THIN": "part",
+    }
+    assert list(hierarchy.sketchbooks(books)) == ["BOOK"]
+
+
+def test_only_sketchbook_pages_are_fetched(monkeypatch, tmp_path):
+    books = hierarchy.build_hierarchy(DOCS)
+    fetched = []
+    monkeypatch.setattr(hierarchy.wgeter, "docs_dir", str(tmp_path))
+    monkeypatch.setattr(hierarchy.wgeter, "doc_file", lambda uuid: str(tmp_path / f"{uuid}.json"))
+    monkeypatch.setattr(hierarchy.wgeter, "make_session", lambda workers, **kwargs: Session())
+    monkeypatch.setattr(hierarchy.wgeter, "fetch_uuid_json", lambda session, url, uuid: fetched.append(uuid))
+
+    assert hierarchy.fetch_children(books, workers=1) == []
+    # P1 is in the corpus already, the painting's reverse is no page
+    assert fetched == ["P1V"]
+
+
+@pytest.mark.parametrize(
+    "parent, relation",
+    [("BOOK", "Page of the sketchbook"), ("PAINTING", "Reverse of"), ("GROUP", "Part of")],
+)
+def test_part_of_wording(parent, relation):
+    links = hierarchy.record_links(hierarchy.build_hierarchy(DOCS))
+    child = hierarchy.build_hierarchy(DOCS)[parent]["children"][0]["uuid"]
+
+    field = art_template.get_part_of(links[child]["part_of"])
+    assert f"|Value={{{{en|{relation} [https://digitaltmuseum.org/{parent} " in field
+
+
+def test_part_of_without_a_kind_is_neutral():
+    part_of = {"uuid": "X", "identifier": "NG.M.1", "title": None, "digitalt_museum_link": "https://d/X"}
+
+    assert "{{en|Part of [https://d/X Untitled] (NG.M.1)}}" in art_template.get_part_of(part_of)
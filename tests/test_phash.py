@@ -0,0 +1,75 @@
+import importlib
+import random
+
+import pytest
+from PIL import Image, ImageFilter
+
+phash = importlib.import_module("10_phash")
+
+
+def brute_force(values, value: int, max_distance: int) -> list:
+    found = [(phash.hamming(value, other), item) for item, other in values]
+    return sorted((distance, item) for distance, item in found if distance <= max_distance)
+
+
+def painting(seed: int, size=(600, 450)) -> Image.Image:
+    """Blurred noise, with shapes at the scale a thumbnail keeps."""
+    rng = random.Random(seed)
+    image = Image.new("L", (12, 9))
+    image.putdata([rng.randrange(256) for _ in range(12 * 9)])
+    return image.resize(size, Image.BICUBIC).filter(ImageFilter.GaussianBlur(4)).convert("RGB")
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 6, 12, 32])
+def test_search_matches_brute_force(max_distance):
+    rng = random.Random(11)
+    # Random hashes lie around 32 bits apart, so add near copies of a few
+    values = [(f"R{i}", rng.getrandbits(64)) for i in range(300)]
+    for i, (_, value) in enumerate(values[:30]):
+        for j in range(5):
+            flips = sum(1 << rng.randrange(64) for _ in range(rng.randrange(1, 10)))
+            values.append((f"N{i}-{j}", value ^ flips))
+    # The same hash twice lands in the same node
+    values.append(("DUP", values[0][1]))
+
+    tree = phash.BKTree()
+    for item, value in values:
+        tree.add(value, item)
+
+    for _, value in values[::7] + [("Q", rng.getrandbits(64))]:
+        assert tree.search(value, max_distance) == brute_force(values, value, max_distance)
+
+
+def test_empty_tree():
+    assert phash.BKTree().search(0, 64) == []
+
+
+@pytest.mark.parametrize("size", [(300, 225), (150, 112), (64, 48), (1200, 900)])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_dhash_survives_resizing(tmp_path, size, seed):
+    original, resized = tmp_path / "original.jpg", tmp_path / "resized.jpg"
+    painting(seed).save(original, quality=90)
+    painting(seed).resize(size, Image.LANCZOS).save(resized, quality=75)
+
+    assert phash.hamming(phash.dhash(str(original)), phash.dhash(str(resized))) <= phash.MAX_DISTANCE
+
+
+def test_dhash_tells_paintings_apart(tmp_path):
+    hashes = []
+    for seed in range(1, 6):
+        path = tmp_path / f"{seed}.jpg"
+        painting(seed).save(path)
+        hashes.append(phash.dhash(str(path)))
+
+    distances = [phash.hamming(a, b) for i, a in enumerate(hashes) for b in hashes[i + 1 :]]
+    assert min(distances) > phash.MAX_DISTANCE
+
+
+def test_find_duplicates():
+    hashes = {"A": 0b0000, "B": 0b0011, "C": 0xFFFF_0000_0000_0000}
+    commons = [(0b0001, "File:A.jpg"), (0x0F0F_0F0F_0F0F_0F0F, "File:Other.jpg")]
+
+    assert phash.find_duplicates(hashes, commons, 2) == {
+        "corpus": [["A", "B", 2]],
+        "commons": [["A", "File:A.jpg", 1], ["B", "File:A.jpg", 1]],
+    }
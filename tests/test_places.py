@@ -0,0 +1,112 @@
+import csv
+
+import numpy as np
+import pytest
+
+import places
+
+
+def brute_force(points: np.ndarray, queries: np.ndarray, max_km: float):
+    d = places.haversine(queries[:, 0, None], queries[:, 1, None], points[None, :, 0], points[None, :, 1])
+    best = d.argmin(axis=1)
+    distances = d[np.arange(len(queries)), best]
+    return np.where(distances <= max_km, best, -1), np.where(distances <= max_km, distances, np.inf)
+
+
+def km_north(lat: float, km: float) -> float:
+    # Along a meridian a degree is the same length everywhere
+    return lat + km / (places.EARTH_RADIUS_KM * np.pi / 180)
+
+
+def test_nearest_across_a_cell_edge():
+    # Just either side of 10 degrees east, in different cells
+    points = np.array([[60.5, 10.001], [60.5, 9.7]])
+    index = places.GridIndex(points)
+
+    indices, distances = index.nearest(np.array([[60.5, 9.999]]), 25)
+    assert indices.tolist() == [0]
+    assert distances[0] < 0.2
+
+
+def test_nearest_across_the_antimeridian():
+    points = np.array([[-17.0, 179.95], [-17.0, 178.0]])
+    index = places.GridIndex(points)
+
+    indices, distances = index.nearest(np.array([[-17.0, -179.95]]), 25)
+    assert indices.tolist() == [0]
+    assert distances[0] == pytest.approx(10.6, abs=0.2)
+
+
+def test_nearest_near_a_pole():
+    # Half the world apart in longitude, but only a few km over the pole
+    points = np.array([[89.99, 0.0]])
+    index = places.GridIndex(points)
+
+    indices, _ = index.nearest(np.array([[89.99, 180.0]]), 25)
+    assert indices.tolist() == [0]
+
+
+def test_distance_cutoff():
+    points = np.array([[60.0, 10.0]])
+    index = places.GridIndex(points)
+    queries = np.array([[km_north(60.0, 24.9), 10.0], [km_north(60.0, 25.1), 10.0], [np.nan, np.nan]])
+
+    indices, distances = index.nearest(queries, 25)
+    assert indices.tolist() == [0, -1, -1]
+    assert distances[0] == pytest.approx(24.9, abs=0.01)
+    assert np.isinf(distances[1:]).all()
+
+
+@pytest.mark.parametrize("max_km", [5, 25, 150])
+@pytest.mark.parametrize("cell_degrees", [0.5, 1.0, 2.0])
+def test_matches_brute_force(max_km, cell_degrees):
+    rng = np.random.default_rng(7)
+    # Points clustered around cell corners, the antimeridian and the poles,
+    # where a grid search is most likely to miss its neighbours
+    centres = np.array([[60.0, 10.0], [0.0, 180.0], [0.0, -180.0], [89.5, 45.0], [-89.5, -120.0], [-33.0, 151.0]])
+    points = np.concatenate([centre + rng.normal(0, 0.4, (200, 2)) for centre in centres])
+    queries = np.concatenate([centre + rng.normal(0, 0.5, (100, 2)) for centre in centres])
+    for array in (points, queries):
+        array[:, 0] = np.clip(array[:, 0], -89.999, 89.999)
+        array[:, 1] = (array[:, 1] + 180) % 360 - 180
+
+    indices, distances = places.GridIndex(points, cell_degrees).nearest(queries, max_km)
+    expected_indices, expected_distances = brute_force(points, queries, max_km)
+
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances)
+
+
+def test_empty_gazetteer():
+    indices, distances = places.GridIndex(np.empty((0, 2))).nearest(np.array([[60.0, 10.0]]), 25)
+    assert indices.tolist() == [-1]
+    assert np.isinf(distances).all()
+
+
+def test_build_gazetteer_keeps_filled_in_categories(tmp_path, monkeypatch):
+    path = tmp_path / "gazetteer.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, places.GAZETTEER_FIELDS)
+        writer.writeheader()
+        writer.writerow(dict(zip(places.GAZETTEER_FIELDS, ("Bergen", 60.39, 5.32, "Norway", "", "Bergen"))))
+
+    class Location:
+        def __init__(self, human_name, latitude, longitude):
+            self.human_name = human_name
+            self.latitude = latitude
+            self.longitude = longitude
+            self.place_names = []
+
+    locations = [
+        ("A", Location("Bergen", 60.0, 5.0)),
+        ("B", Location("Oslo", 59.91, 10.75)),
+        ("C", Location("Nowhere", None, None)),
+    ]
+    monkeypatch.setattr(places, "load_locations", lambda data_dir: locations)
+
+    assert places.build_gazetteer("unused", str(path)) == 1
+    rows = {row["name"]: row for row in places.read_gazetteer(str(path))}
+    assert rows["Bergen"]["category"] == "Bergen"
+    assert rows["Bergen"]["latitude"] == "60.39"
+    assert rows["Oslo"]["category"] == ""
+    assert list(rows) == ["Bergen", "Oslo"]
@@ -0,0 +1,73 @@
+import importlib
+
+import pytest
+
+nmk = importlib.import_module("01_nmk")
+
+
+@pytest.mark.parametrize(
+    "producer, expected",
+    [
+        ("Hans Gude", '"Hans Gude"'),
+        ("Gude, Hans Fredrik", '"Gude, Hans Fredrik"'),
+        ('Hans "Gude"', r'"Hans \"Gude\""'),
+        ("C:\\Gude", r'"C\:\\Gude"'),
+        ("Gude (etter)", r'"Gude \(etter\)"'),
+        ("Gude?*~^", r'"Gude\?\*\~\^"'),
+        ("A+B-C && D || !E", r'"A\+B\-C \&\& D \|\| \!E"'),
+        ("[x]{y}/z;", r'"\[x\]\{y\}\/z\;"'),
+    ],
+)
+def test_solr_phrase(producer, expected):
+    assert nmk.solr_phrase(producer) == expected
+
+
+def test_producer_filters_are_quoted():
+    shards = nmk.plan_shards(["NMK*"], ["Hans Gude", 'Gude "Hans" (kopi)'])
+
+    assert [shard.name for shard in shards] == ["nmk_hans-gude", "nmk_gude-hans-kopi"]
+    assert [shard.filters for shard in shards] == [
+        ("identifier.owner:NMK*", 'artifact.producer:"Hans Gude"'),
+        ("identifier.owner:NMK*", r'artifact.producer:"Gude \"Hans\" \(kopi\)"'),
+    ]
+
+
+def test_all_producers_and_years():
+    shards = nmk.plan_shards(["NMK-A", "NMK-B"], [], (1850, 1850))
+
+    # Owners stay patterns, and no producer means no producer filter
+    assert {shard.filters[0] for shard in shards} == {"identifier.owner:NMK-A", "identifier.owner:NMK-B"}
+    assert not any("artifact.producer" in f for shard in shards for f in shard.filters)
+    assert [shard.name for shard in shards[:5]] == [
+        "nmk-a_all_before-1850",
+        "nmk-a_all_1850",
+        "nmk-a_all_after-1850",
+        "nmk-a_all_undated",
+        "nmk-b_all_before-1850",
+    ]
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ("NMK*", "NMK-B", True),
+        ("NMK-A", "NMK-B", False),
+        ("NMK-A", "NMK-A", True),
+        ("N*B", "NM*", True),
+        ("*-A", "*-B", False),
+        ("NMK-?", "NMK-B", True),
+        ("NMK-?", "NMK-BB", False),
+        ("NMK*", "NMK", True),
+        ("NMK-A*", "NMK-B*", False),
+        ("*", "", True),
+    ],
+)
+def test_patterns_overlap(a, b, expected):
+    assert nmk.patterns_overlap(a, b) is expected
+    assert nmk.patterns_overlap(b, a) is expected
+
+
+def test_overlapping_owners_are_refused():
+    # Every NMK-B document would be harvested twice, once in each shard
+    with pytest.raises(ValueError, match="NMK\\* and NMK-B overlap"):
+        nmk.plan_shards(["NMK*", "NMK-B"], [])
@@ -0,0 +1,212 @@
+import argparse
+
+import pytest
+import requests
+
+import throttle
+
+
+class Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.headers = {}
+
+    def close(self) -> None:
+        pass
+
+
+def sender(*outcomes):
+    """A send() that answers with each outcome in turn, counting calls."""
+    calls = []
+
+    def send():
+        outcome = outcomes[len(calls)]
+        calls.append(outcome)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome)
+
+    return send, calls
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(throttle, "BASE_DELAY", 0)
+
+
+@pytest.mark.parametrize("failure", [503, requests.ReadTimeout(), requests.ConnectionError()])
+def test_idempotent_calls_are_retried(failure):
+    send, calls = sender(failure, 200)
+
+    assert throttle.Throttle(2).call(send).status_code == 200
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("failure", [500, 503])
+def test_non_idempotent_calls_return_5xx(failure):
+    send, calls = sender(failure, 200)
+
+    assert throttle.Throttle(2).call(send, idempotent=False).status_code == failure
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("failure", [requests.ReadTimeout, requests.ConnectionError])
+def test_non_idempotent_calls_raise_once_sent(failure):
+    send, calls = sender(failure(), 200)
+
+    with pytest.raises(failure):
+        throttle.Throttle(2).call(send, idempotent=False)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("failure", [429, requests.ConnectTimeout()])
+def test_non_idempotent_calls_retry_what_was_never_acted_on(failure):
+    send, calls = sender(failure, 200)
+
+    assert throttle.Throttle(2).call(send, idempotent=False).status_code == 200
+    assert len(calls) == 2
+
+
+def test_gives_up_after_max_attempts():
+    send, calls = sender(503, 503, 503)
+
+    assert throttle.Throttle(2, max_attempts=3).call(send).status_code == 503
+    assert len(calls) == 3
+
+
+def test_session_retries_by_method(monkeypatch):
+    session = throttle.ThrottledSession(throttle.Throttle(2))
+    seen = []
+    monkeypatch.setattr(session.throttle, "call", lambda send, idempotent: seen.append(idempotent))
+
+    session.get("http://localhost/")
+    session.post("http://localhost/")
+    session.post("http://localhost/", retry=True)
+    session.get("http://localhost/", retry=False)
+
+    assert seen == [True, False, True, False]
+
+
+class Clock:
+    """Stands in for the time module, with a sleep that only moves the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle, "time", clock)
+    return clock
+
+
+def test_max_attempts_must_be_positive():
+    with pytest.raises(ValueError, match="max_attempts must be at least 1"):
+        throttle.Throttle(2, max_attempts=0)
+
+
+@pytest.mark.parametrize("option", ["--max-attempts", "--min-concurrency"])
+def test_throttle_arguments_must_be_positive(option):
+    parser = argparse.ArgumentParser()
+    throttle.add_throttle_arguments(parser)
+
+    assert throttle.throttle_options(parser.parse_args([option, "1"]))
+    with pytest.raises(SystemExit):
+        parser.parse_args([option, "0"])
+
+
+def test_decreases_once_per_round_trip(clock):
+    limiter = throttle.Throttle(8)
+    limiter.release(0.2, ok=True)
+
+    # Every request in flight fails at about the same time
+    for _ in range(4):
+        limiter.release(None, ok=False)
+    assert (limiter.limit, limiter.decreases, limiter.failures) == (4, 1, 4)
+
+    clock.now += 0.1
+    limiter.release(None, ok=False)
+    assert limiter.limit == 4
+
+    # One smoothed latency later the next failure counts again
+    clock.now += 0.15
+    limiter.release(None, ok=False)
+    assert (limiter.limit, limiter.decreases) == (2, 2)
+
+
+def test_never_decreases_below_min_concurrency(clock):
+    limiter = throttle.Throttle(8, min_concurrency=3)
+
+    for _ in range(5):
+        clock.now += 10
+        limiter.release(None, ok=False)
+    assert limiter.limit == limiter.lowest_limit == 3
+
+
+def test_slower_answers_halve_the_limit(clock):
+    limiter = throttle.Throttle(8)
+    limiter.release(0.1, ok=True)
+
+    # The smoothed latency needs a few slow answers to pass three times the
+    # baseline, and then the limit is halved once for the round trip
+    for _ in range(5):
+        limiter.release(1.0, ok=True)
+    assert limiter.latency > throttle.LATENCY_TOLERANCE * limiter.baseline
+    assert (limiter.limit, limiter.decreases, limiter.failures) == (4, 1, 0)
+
+    # Still slow a whole slow round trip later
+    clock.now += 1.0
+    limiter.release(1.0, ok=True)
+    assert limiter.limit == 2
+
+
+def test_steady_answers_add_one_slot_per_window(clock):
+    limiter = throttle.Throttle(8)
+    limiter.limit = 2.0
+
+    limiter.release(0.1, ok=True)
+    limiter.release(0.1, ok=True)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+    for _ in range(100):
+        limiter.release(0.1, ok=True)
+    assert limiter.limit == 8
+    assert limiter.decreases == 0
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = throttle.TokenBucket(10, burst=5)
+
+    for _ in range(5):
+        bucket.consume()
+    assert clock.slept == []
+
+    for _ in range(3):
+        bucket.consume()
+    assert clock.slept == pytest.approx([0.1, 0.1, 0.1])
+
+    # Idle time fills the bucket, but never past the burst
+    clock.now += 60
+    clock.slept.clear()
+    for _ in range(6):
+        bucket.consume()
+    assert clock.slept == pytest.approx([0.1])
+
+
+def test_token_bucket_debt(clock):
+    # Taking more than is there is paid back by sleeping
+    bucket = throttle.TokenBucket(1000, burst=100)
+
+    bucket.consume(600)
+    assert clock.slept == pytest.approx([0.5])
+    bucket.consume(100)
+    assert clock.slept == pytest.approx([0.5, 0.1])
@@ -0,0 +1,235 @@
+import importlib
+import json
+import threading
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+from artwork import Artwork
+
+upload = importlib.import_module("11_upload")
+
+
+def artwork(**fields) -> Artwork:
+    return Artwork(uuid="UUID", national_museum_norway_artwork_id="NG.K&H.B.01234", **fields)
+
+
+def test_display_title():
+    filename = upload.commons_filename(artwork(display_title="Fra Hardanger [Tegning]"), ".jpg")
+
+    assert filename == "Hans Gude - Fra Hardanger -Tegning- - NG.K&H.B.01234.jpg"
+
+
+@pytest.mark.parametrize(
+    "titles, expected",
+    [
+        ({"nor": {"current": ["Skogsparti"]}}, "Skogsparti"),
+        ({"eng": {"current": ["Forest"]}, "nor": {"original": ["Skog"]}}, "Skog"),
+        ({"nor": {"original": ["Skog"], "current": ["Skogsparti"]}}, "Skogsparti"),
+        ({"swe": {"other": ["Skog/parti"]}}, "Skog-parti"),
+    ],
+)
+def test_falls_back_to_titles(titles, expected):
+    filename = upload.commons_filename(artwork(display_title=None, titles=titles), ".jpg")
+
+    assert filename == f"Hans Gude - {expected} - NG.K&H.B.01234.jpg"
+
+
+@pytest.mark.parametrize("titles", [None, {}, {"nor": {"current": []}}])
+def test_no_title_at_all(titles):
+    with pytest.raises(upload.UploadError, match="no title"):
+        upload.commons_filename(artwork(display_title=None, titles=titles), ".jpg")
+
+
+def test_load_jobs_skips_records_without_a_title(tmp_path, capsys):
+    for name in ("data", "pages", "images"):
+        (tmp_path / name).mkdir()
+    records = {"A": artwork(display_title="Skog"), "B": artwork(display_title=None)}
+    for uuid, record in records.items():
+        record.uuid = uuid
+        (tmp_path / "data" / f"{uuid}.json").write_text(json.dumps(record.to_json()))
+        (tmp_path / "pages" / f"{uuid}.wikitext").write_text("")
+        (tmp_path / "images" / f"{uuid}.jpg").write_bytes(b"")
+
+    jobs = upload.load_jobs(str(tmp_path / "data"), str(tmp_path / "pages"), str(tmp_path / "images"), set())
+
+    assert [job[:2] for job in jobs] == [("A", "Hans Gude - Skog - NG.K&H.B.01234.jpg")]
+    assert "Skipping B: B has no title" in capsys.readouterr().err
+
+
+class Wiki:
+    """Just enough of the MediaWiki action API to log in and upload in chunks.
+
+    answers holds one "maxlag", "ratelimited", "lose" or HTTP status for each
+    of the next upload requests to get instead of a normal answer; "lose"
+    still acts on the request, only the answer never arrives.
+    """
+
+    def __init__(self):
+        self.stash = {}
+        self.published = {}
+        self.uploads = []
+        self.answers = []
+        self.lock = threading.Lock()
+
+    def handler(self):
+        wiki = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                form = read_form(self)
+                with wiki.lock:
+                    answer = wiki.answers.pop(0) if form["action"] == "upload" and wiki.answers else None
+                    if form["action"] == "upload":
+                        wiki.uploads.append({key: value for key, value in form.items() if key != "chunk"})
+                    if answer in ("maxlag", "ratelimited"):
+                        return self.send_json({"error": {"code": answer, "info": "Wait"}}, {"Retry-After": "0"})
+                    if isinstance(answer, int):
+                        return self.send_json({"error": "busy"}, status=answer)
+                    result = wiki.act(form)
+
+                if answer == "lose":
+                    self.close_connection = True
+                    return
+                self.send_json(result)
+
+            def send_json(self, data, headers=None, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", **(headers or {})}.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def act(self, form: dict) -> dict:
+        if form["action"] == "query":
+            kind = form["type"]
+            return {"query": {"tokens": {f"{kind}token": f"{kind}-token"}}}
+        if form["action"] == "login":
+            return {"login": {"result": "Success" if form["lgtoken"] == "login-token" else "Failed"}}
+        if form.get("token") != "csrf-token":
+            return {"error": {"code": "badtoken", "info": "Invalid CSRF token."}}
+
+        if "chunk" not in form:
+            data = self.stash.pop(form["filekey"])
+            self.published[form["filename"]] = (bytes(data), form["text"])
+            return {"upload": {"result": "Success", "filename": form["filename"]}}
+
+        filekey = form.get("filekey") or f"key{len(self.stash)}"
+        data = self.stash.setdefault(filekey, bytearray())
+        if int(form["offset"]) != len(data):
+            return {"error": {"code": "stashfailed", "info": "Chunk offset mismatch.", "offset": len(data)}}
+        data += form["chunk"]
+        if len(data) < int(form["filesize"]):
+            return {"upload": {"result": "Continue", "filekey": filekey, "offset": len(data)}}
+        return {"upload": {"result": "Success", "filekey": filekey}}
+
+
+def read_form(handler) -> dict:
+    body = handler.rfile.read(int(handler.headers["Content-Length"]))
+    content_type = handler.headers["Content-Type"]
+    if not content_type.startswith("multipart/form-data"):
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    message = BytesParser(policy=default).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    form = {}
+    for part in message.iter_parts():
+        value = part.get_payload(decode=True)
+        name = part.get_param("name", header="content-disposition")
+        form[name] = value if name == "chunk" else value.decode()
+    return form
+
+
+IMAGE = bytes(range(35))
+FILENAME = "Hans Gude - Skog - NG.K&H.B.01234.jpg"
+
+
+@pytest.fixture
+def wiki(serve):
+    wiki = Wiki()
+    wiki.url = f"{serve(wiki.handler())}/w/api.php"
+    return wiki
+
+
+@pytest.fixture
+def job(tmp_path):
+    (tmp_path / "A.jpg").write_bytes(IMAGE)
+    (tmp_path / "A.wikitext").write_text("== {{int:filedesc}} ==")
+    return ("A", FILENAME, str(tmp_path / "A.jpg"), str(tmp_path / "A.wikitext"))
+
+
+def upload_all(wiki: Wiki, journal, job) -> list:
+    client = upload.MediaWikiClient(wiki.url, workers=1, max_attempts=2)
+    client.login("user", "password")
+    return upload.upload_all(client, journal, [job], workers=1, chunk_size=10, comment="Test")
+
+
+def journal_entries(journal) -> list:
+    with open(journal.path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_uploads_in_chunks_and_publishes(wiki, job, tmp_path):
+    journal = upload.Journal(str(tmp_path / "journal.jsonl"))
+
+    assert upload_all(wiki, journal, job) == []
+    assert wiki.published == {FILENAME: (IMAGE, "== {{int:filedesc}} ==")}
+    assert [int(request["offset"]) for request in wiki.uploads if "offset" in request] == [0, 10, 20, 30]
+    assert [(entry["status"], entry.get("offset")) for entry in journal_entries(journal)] == [
+        ("stashing", 10),
+        ("stashing", 20),
+        ("stashing", 30),
+        ("stashing", 35),
+        ("uploaded", None),
+    ]
+
+    # Nothing is left to do on the next run
+    assert upload_all(wiki, journal, job) == []
+    assert len(wiki.uploads) == 5
+
+
+def test_waits_out_maxlag_and_ratelimits(wiki, job, tmp_path):
+    wiki.answers = [None, "maxlag", "ratelimited"]
+    journal = upload.Journal(str(tmp_path / "journal.jsonl"))
+
+    assert upload_all(wiki, journal, job) == []
+    assert wiki.published[FILENAME][0] == IMAGE
+    # The second chunk was sent three times, the first two answered with a wait
+    assert [int(request["offset"]) for request in wiki.uploads if "offset" in request] == [0, 10, 10, 10, 20, 30]
+
+
+def test_resumes_after_a_lost_chunk_answer(wiki, job, tmp_path):
+    wiki.answers = [None, None, "lose"]
+    journal = upload.Journal(str(tmp_path / "journal.jsonl"))
+
+    errors = upload_all(wiki, journal, job)
+    assert [uuid for uuid, _ in errors] == ["A"]
+    # The wiki stored the third chunk, but the journal never heard about it
+    assert len(wiki.uploads) == 3
+    assert [len(data) for data in wiki.stash.values()] == [30]
+    assert journal.read()["A"]["offset"] == 20
+
+    assert upload_all(wiki, journal, job) == []
+    # Sent at the journal's offset, told the wiki's, and carried on from there
+    assert [int(request["offset"]) for request in wiki.uploads if "offset" in request] == [0, 10, 20, 20, 30]
+    assert wiki.published[FILENAME][0] == IMAGE
+
+
+@pytest.mark.parametrize("answer", [503, "lose"])
+def test_publish_is_not_retried(wiki, job, tmp_path, answer):
+    wiki.answers = [None, None, None, None, answer]
+    journal = upload.Journal(str(tmp_path / "journal.jsonl"))
+
+    errors = upload_all(wiki, journal, job)
+    assert [uuid for uuid, _ in errors] == ["A"]
+    assert len(wiki.uploads) == 5
+    assert journal_entries(journal)[-1]["status"] == "failed"
@@ -0,0 +1,310 @@
+"""Adaptive concurrency, a request rate ceiling and retries for every HTTP stage.
+
+A Throttle sits between a stage's workers and the server. It lets at most
+`limit` requests be in flight and moves that limit the way TCP does (AIMD):
+up by one for every window of good answers, halved when requests fail or
+start taking much longer than they took while the server was idle. However
+far the limit grows, a token bucket keeps the rate under a hard requests per
+second ceiling. Requests that time out, lose their connection or get a 429
+or 5xx are retried after an exponentially growing, jittered wait, or after
+as long as the server's Retry-After asks, during which every worker waits.
+Requests that are not idempotent, like POSTs by default, are only retried
+when the server cannot have acted on them: a connection that was never made
+or a 429. After a read timeout or a 5xx the caller has to find out for itself.
+
+    session = ThrottledSession(Throttle(8, max_rps=20))
+    session.get(url)
+"""
+import argparse
+import email.utils
+import random
+import threading
+import time
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrument
+
+MAX_ATTEMPTS = 5
+# Full jitter: wait a random time up to BASE_DELAY * 2**attempt, at most MAX_DELAY
+BASE_DELAY = 0.5
+MAX_DELAY = 60
+TIMEOUT = (10, 60)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+# What is still safe to retry when sending the request twice could do twice
+# what it asks for
+SAFE_RETRY_STATUSES = (429,)
+SAFE_RETRY_EXCEPTIONS = (requests.ConnectTimeout,)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+# Slow down once requests take this many times longer than the fastest ones
+LATENCY_TOLERANCE = 3.0
+# How quickly the smoothed latency follows new answers
+SMOOTHING = 0.2
+# The baseline drops to a faster answer straight away but only creeps up, so
+# a server that has become slower for good is accepted after a while
+BASELINE_DRIFT = 0.01
+DECREASE = 0.5
+
+
+class TokenBucket:
+    """Token bucket shared by every thread, in units per second.
+
+    A thread that takes more than is in the bucket leaves it in debt and
+    sleeps until its share has been paid back, so all threads together never
+    go faster than the rate for longer than one burst.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n: float = 1) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+def retry_after(response) -> float | None:
+    """Seconds the server asked us to wait, if it did."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+
+
+class Throttle:
+    """Concurrency limit, rate ceiling and retries shared by every worker thread."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        max_rps: float | None = None,
+        max_attempts: int = MAX_ATTEMPTS,
+        latency_tolerance: float = LATENCY_TOLERANCE,
+        name: str = "http",
+    ):
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, not {max_attempts}")
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.max_rps = max_rps
+        self.max_attempts = max_attempts
+        self.latency_tolerance = latency_tolerance
+        # A second's worth of requests may go out at once
+        self.bucket = TokenBucket(max_rps, burst=max(1.0, max_rps)) if max_rps else None
+
+        # Start where the stages always ran and only back off when told to
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.decreases = 0
+        self.lowest_limit = self.limit
+        instrument.report.add_throttle(self)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request, not just the one that was told to wait."""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self) -> None:
+        with self.condition:
+            while True:
+                paused = self.paused_until - time.monotonic()
+                if paused > 0:
+                    self.condition.wait(paused)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+        if self.bucket is not None:
+            self.bucket.consume()
+
+    def release(self, seconds: float | None, ok: bool) -> None:
+        """Give the slot back, adjusting the limit by how the request went.
+
+        seconds is None when the request never got an answer.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if not ok:
+                self.failures += 1
+                self._decrease()
+            elif seconds is not None:
+                self._observe(seconds)
+            self.condition.notify_all()
+
+    def _observe(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = self.baseline = seconds
+        else:
+            self.latency += SMOOTHING * (seconds - self.latency)
+            if seconds < self.baseline:
+                self.baseline = seconds
+            else:
+                self.baseline += BASELINE_DRIFT * (seconds - self.baseline)
+
+        if self.latency > self.latency_tolerance * self.baseline:
+            self._decrease()
+        else:
+            # One more slot for every limit's worth of good answers
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _decrease(self) -> None:
+        # Everything in flight at the time sees the same trouble, so only
+        # react once per round trip instead of once per request
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency or 1.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * DECREASE)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        self.decreases += 1
+
+    def call(self, send, idempotent: bool = True):
+        """Return send()'s response, retrying it while that makes sense.
+
+        Unless idempotent, only what the server cannot have acted on is
+        retried. Once max_attempts are used up the last response is
+        returned, for the caller's raise_for_status to report, or the last
+        exception raised.
+        """
+        retry_exceptions = RETRY_EXCEPTIONS if idempotent else SAFE_RETRY_EXCEPTIONS
+        retry_statuses = RETRY_STATUSES if idempotent else SAFE_RETRY_STATUSES
+        for attempt in range(self.max_attempts):
+            last_attempt = attempt == self.max_attempts - 1
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                response = send()
+            except RETRY_EXCEPTIONS as e:
+                self.release(None, ok=False)
+                if last_attempt or not isinstance(e, retry_exceptions):
+                    raise
+                self._wait(attempt, None)
+                continue
+            except BaseException:
+                self.release(None, ok=True)
+                raise
+
+            # The limit backs off on every sign of trouble, retried or not
+            self.release(time.perf_counter() - start, ok=response.status_code not in RETRY_STATUSES)
+            if response.status_code not in retry_statuses or last_attempt:
+                return response
+
+            delay = retry_after(response)
+            response.close()
+            self._wait(attempt, delay)
+
+    def _wait(self, attempt: int, delay: float | None) -> None:
+        with self.condition:
+            self.retries += 1
+        if delay is not None:
+            self.pause(delay)
+        else:
+            time.sleep(retry_delay(attempt))
+
+    def to_json(self) -> dict:
+        with self.condition:
+            return {
+                "name": self.name,
+                "max_concurrency": self.max_concurrency,
+                "max_rps": self.max_rps,
+                "limit": round(self.limit, 2),
+                "lowest_limit": round(self.lowest_limit, 2),
+                "requests": self.requests,
+                "failures": self.failures,
+                "retries": self.retries,
+                "decreases": self.decreases,
+                "latency_s": round(self.latency, 6) if self.latency is not None else None,
+                "baseline_s": round(self.baseline, 6) if self.baseline is not None else None,
+            }
+
+
+class ThrottledSession(requests.Session):
+    """A requests.Session that sends every request through a Throttle.
+
+    Requests are retried as idempotent when their method is in retry_methods,
+    or when they are sent with retry=True; retry=False opts out.
+    """
+
+    def __init__(self, throttle: Throttle, timeout=TIMEOUT, retry_methods=IDEMPOTENT_METHODS):
+        super().__init__()
+        self.throttle = throttle
+        self.timeout = timeout
+        self.retry_methods = retry_methods
+        # One keep-alive connection for every request that may be in flight
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=throttle.max_concurrency)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, retry=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if retry is None:
+            retry = method.upper() in self.retry_methods
+        return self.throttle.call(partial(super().request, method, url, **kwargs), idempotent=retry)
+
+
+def positive_int(value: str) -> int:
+    """argparse type for counts that make no sense below one."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
+def add_throttle_arguments(parser) -> None:
+    """Add the throttling options shared by every networked script."""
+    parser.add_argument("--max-rps", type=float, help="Never send more than this many requests per second.")
+    parser.add_argument(
+        "--min-concurrency",
+        type=positive_int,
+        default=1,
+        help="Never throttle down to fewer requests in flight than this.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=positive_int,
+        default=MAX_ATTEMPTS,
+        help="Tries per request on timeouts, 429 and 5xx before giving up.",
+    )
+
+
+def throttle_options(args) -> dict:
+    """Turn the parsed throttle arguments into Throttle keyword arguments."""
+    return {"max_rps": args.max_rps, "min_concurrency": args.min_concurrency, "max_attempts": args.max_attempts}